@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# cli.py
+#
+#  Copyright 2014 Manu Varkey <manuvarkey@gmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+"""Command line interface for batch processing of project files without GTK
+
+    python -m estimator.cli export|update-rates|res-usage|validate project.eproj ...
+"""
+
+import argparse, concurrent.futures, functools, logging, os, shutil, sqlite3, sys, tempfile
+import appdirs
+
+# local files import
+from . import undo, misc, data
+
+# Get logger object
+log = logging.getLogger()
+
+
+class ConsoleProgress:
+    """Progress object logging messages in place of ProgressWindow"""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def set_pulse_step(self, width):
+        pass
+
+    def set_fraction(self, fraction):
+        pass
+
+    def pulse(self, end=False):
+        pass
+
+    def add_message(self, message):
+        log.info('ConsoleProgress - ' + self.filename + ' - ' + misc.remove_markup(message))
+
+
+def get_library_filenames():
+    """Get filenames of default and user libraries"""
+    dirs = appdirs.AppDirs(misc.PROGRAM_NAME, misc.PROGRAM_AUTHOR, version=misc.PROGRAM_VER)
+    library_dirs = [misc.abs_path('database'), misc.posix_path(dirs.user_data_dir, 'database')]
+    library_names = []
+    for library_dir in library_dirs:
+        if os.path.exists(library_dir):
+            for f in sorted(os.listdir(library_dir)):
+                if f[-len(misc.PROJECT_EXTENSION):].lower() == misc.PROJECT_EXTENSION:
+                    library_names.append(misc.posix_path(library_dir, f))
+    return library_names
+
+def get_library_filename(name):
+    """Get filename of library with project name, None if not found"""
+    for library_name in get_library_filenames():
+        try:
+            connection = sqlite3.connect(misc.file_to_uri(library_name) + '?mode=ro', uri=True)
+            try:
+                row = connection.execute('''SELECT value FROM ProjectTable WHERE key = "project_name"''').fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            continue
+        if row and row[0] == name:
+            return library_name
+    return None
+
+def get_output_filename(filename, output):
+    """Get filename of spreadsheet exported from project filename"""
+    if output:
+        basename = os.path.splitext(os.path.basename(filename))[0] + '.xlsx'
+        return os.path.join(output, basename)
+    else:
+        return os.path.splitext(filename)[0] + '.xlsx'
+
+def open_project(filename):
+    """Copy project to a temporary file, validate and open it
+
+        Returns (database, temporary filename) or raises ValueError if project is invalid.
+    """
+    (temp_fpointer, filename_temp) = tempfile.mkstemp(prefix=misc.PROGRAM_NAME + '_cliproj_')
+    os.close(temp_fpointer)
+    try:
+        shutil.copyfile(filename, filename_temp)
+        database = data.schedule.ScheduleDatabase(undo.Stack())
+        ret_code = database.validate_database(filename_temp)
+        if ret_code[0] == False:
+            raise ValueError(ret_code[1])
+        database.open_database(filename_temp)
+    except:
+        os.remove(filename_temp)
+        raise
+    return (database, filename_temp)
+
+def run_command(command, filename, options):
+    """Run command on a project file
+
+        Runs in worker processes and returns (filename, success, message).
+    """
+    try:
+        (database, filename_temp) = open_project(filename)
+    except Exception as e:
+        log.error('run_command - ' + filename + ' - ' + str(e))
+        return (filename, False, str(e))
+
+    try:
+        try:
+            modified = False
+            if command == 'validate':
+                message = 'Valid project file'
+
+            elif command == 'export':
+                output = get_output_filename(filename, options['output'])
+                spreadsheet = misc.SpreadsheetWriter()
+                database.export_spreadsheet(spreadsheet, ConsoleProgress(filename), options['break_lines'])
+                spreadsheet.save(output)
+                message = 'Exported to ' + output
+
+            elif command == 'update-rates':
+                if options['library']:
+                    if not database.add_library(options['library_filename']):
+                        raise ValueError('Library could not be opened - ' + options['library'])
+                    database.update_resource_from_database(options['library'])
+                database.update_rates()
+                modified = True
+                message = 'Rates updated'
+
+            elif command == 'res-usage':
+                rows = []
+                for category, res_list_item in database.get_res_usage().items():
+                    for code, item in sorted(res_list_item.items()):
+                        rows.append([category, code, item[1], item[2], item[3]])
+                message = misc.get_tabular_text(rows, ['Category', 'Code', 'Description', 'Unit', 'Qty'])
+
+        finally:
+            database.close_database()
+
+        # Copy back modified project only after its database is closed
+        if modified:
+            shutil.copyfile(filename_temp, filename)
+        return (filename, True, message)
+
+    except Exception as e:
+        log.exception('run_command - ' + filename + ' - ' + command + ' failed')
+        return (filename, False, str(e))
+
+    finally:
+        os.remove(filename_temp)
+
+def print_results(results):
+    """Print results of run_command, returns number of failed files"""
+    failed = 0
+    for (filename, success, message) in results:
+        if success:
+            print(filename + ': ' + message)
+        else:
+            print(filename + ': Error: ' + message, file=sys.stderr)
+            failed += 1
+    return failed
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m estimator.cli',
+                                     description='Process ' + misc.PROGRAM_NAME + ' project files without the graphical interface')
+    parser.add_argument('command', choices=['export', 'update-rates', 'res-usage', 'validate'])
+    parser.add_argument('filenames', nargs='+', metavar='project', help='project files to be processed')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of project files processed in parallel')
+    parser.add_argument('-o', '--output', help='directory for exported spreadsheets')
+    parser.add_argument('-b', '--break-lines', action='store_true', help='break item descriptions when exporting')
+    parser.add_argument('-l', '--library', help='library to update resource rates from before updating rates')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress messages')
+    args = parser.parse_args(args)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+
+    if args.command == 'export':
+        # Projects with the same name in different directories export to the same file
+        outputs = dict()
+        for filename in args.filenames:
+            output = os.path.normcase(os.path.abspath(get_output_filename(filename, args.output)))
+            if output in outputs:
+                parser.error('projects ' + outputs[output] + ' and ' + filename + ' export to the same file ' + output)
+            outputs[output] = filename
+        if args.output and not os.path.exists(args.output):
+            os.makedirs(args.output)
+
+    library_filename = None
+    if args.command == 'update-rates' and args.library:
+        library_filename = get_library_filename(args.library)
+        if library_filename is None:
+            parser.error('library not found - ' + args.library)
+
+    options = dict(output=args.output, break_lines=args.break_lines, library=args.library,
+                   library_filename=library_filename)
+
+    func = functools.partial(run_command, args.command, options=options)
+    if args.jobs > 1 and len(args.filenames) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            failed = print_results(executor.map(func, args.filenames))
+    else:
+        failed = print_results(map(func, args.filenames))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
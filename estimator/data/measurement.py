@@ -22,8 +22,7 @@
 #
 #
 
-from gi.repository import Gtk, Gdk, GLib
-import copy, logging, importlib, sys
+import copy, logging, importlib, sys, os, threading
 
 # local files import
 from .. import misc
@@ -31,6 +30,49 @@ from .. import misc
 # Get logger object
 log = logging.getLogger()
 
+# Loaded measurement plugins keyed by name as (file modification time, CustomItem)
+plugin_registry = dict()
+plugin_registry_lock = threading.Lock()
+
+
+def get_plugin_names():
+    """Return sorted names of measurement plugins in meas_templates"""
+    file_names = os.listdir(misc.abs_path('meas_templates'))
+    return sorted(f[:-3] for f in file_names if f[-3:] == '.py' and f != '__init__.py')
+
+def get_plugin(name):
+    """Return CustomItem of measurement plugin, loading template only when modified
+
+        Raises ImportError if plugin could not be loaded.
+    """
+    filename = misc.abs_path('meas_templates', name + '.py')
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        raise ImportError('Plugin not found - ' + str(name))
+    with plugin_registry_lock:
+        if name not in plugin_registry or plugin_registry[name][0] != mtime:
+            spec = importlib.util.spec_from_file_location(name, filename)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
+            spec.loader.exec_module(module)
+            plugin_registry[name] = (mtime, module.CustomItem())
+            log.info('Plugin loaded - ' + name)
+        return plugin_registry[name][1]
+
+
+def get_item_from_model(model):
+    """Return measurement item for data model or None if model is not supported"""
+    class_list = ['MeasurementItemHeading',
+                'MeasurementItemCustom',
+                'MeasurementItemAbstract']
+    if model[0] in class_list and model[0] in globals():
+        item_type = globals()[model[0]]
+        item = item_type()
+        item.set_model(model)
+        return item
+    return None
+
 
 class Measurement:
     """Stores a Measurement groups"""
@@ -38,14 +80,9 @@ class Measurement:
         if model is not None:
             self.caption = model[0]
             self.items = []
-            class_list = ['MeasurementItemHeading',
-                        'MeasurementItemCustom',
-                        'MeasurementItemAbstract']
             for item_model in model[1]:
-                if item_model[0] in class_list:
-                    item_type = globals()[item_model[0]]
-                    item = item_type()
-                    item.set_model(item_model)
+                item = get_item_from_model(item_model)
+                if item is not None:
                     self.items.append(item)
         else:
             self.caption = ''
@@ -109,7 +146,7 @@ class Measurement:
             self.__init__(model[1])
 
     def get_spreadsheet_buffer(self, schedule, codes, start_row):
-        spreadsheet = misc.Spreadsheet()
+        spreadsheet = misc.SpreadsheetBuffer()
         row = start_row
         # Set datas of children
         for slno, item in enumerate(self.items):
@@ -146,24 +183,34 @@ class MeasurementItem:
         self.records = records
         self.remark = remark
         self.item_remarks = item_remarks
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard cached totals, to be called after modifying records in place"""
+        self.total_cache = None
 
     def set_item(self,index,itemno):
         self.itemnos[index] = itemno
+        self.invalidate()
 
     def get_item(self,index):
         return self.itemnos[index]
 
     def append_record(self,record):
         self.records.append(record)
+        self.invalidate()
 
     def insert_record(self,index,record):
         self.records.insert(index,record)
+        self.invalidate()
 
     def remove_record(self,index):
         del(self.records[index])
+        self.invalidate()
 
     def __setitem__(self, index, value):
         self.records[index] = value
+        self.invalidate()
 
     def __getitem__(self, index):
         return self.records[index]
@@ -182,6 +229,7 @@ class MeasurementItem:
         self.records = []
         self.remark = ''
         self.item_remarks = []
+        self.invalidate()
 
 class MeasurementItemHeading(MeasurementItem):
     """Stores an item heading"""
@@ -206,7 +254,7 @@ class MeasurementItemHeading(MeasurementItem):
             self.__init__(model[1])
 
     def get_spreadsheet_buffer(self, path, schedule, codes, row):
-        spreadsheet = misc.Spreadsheet()
+        spreadsheet = misc.SpreadsheetBuffer()
         spreadsheet.append_data([[str(path), self.remark], [None]], bold=True, wrap_text=True)
         return spreadsheet
 
@@ -229,7 +277,7 @@ class RecordCustom:
         for x,columntype in zip(self.data_string,columntypes):
             if columntype not in [misc.MEAS_DESC, misc.MEAS_CUST]:
                 try:
-                    num = eval(x)
+                    num = misc.evaluate(x)
                     self.data.append(num)
                 except:
                     self.data.append(0)
@@ -238,7 +286,9 @@ class RecordCustom:
         self.cust_funcs = cust_funcs
         self.total_func = total_func
         self.columntypes = columntypes
-        self.total = self.find_total()
+        self.total = self.total_func(self.data)
+        # Rendered model cached as (row, rendered_item)
+        self.rendered = None
 
     def get_model(self):
         """Get data model"""
@@ -246,6 +296,8 @@ class RecordCustom:
 
     def get_model_rendered(self, row=None):
         """Get data model with results of custom functions included for rendering"""
+        if self.rendered is not None and self.rendered[0] == row:
+            return list(self.rendered[1])
         item = self.get_model()
         rendered_item = []
         for item_elem, columntype, render_func in zip(item, self.columntypes, self.cust_funcs):
@@ -262,24 +314,25 @@ class RecordCustom:
                     if columntype == misc.MEAS_DESC:
                         rendered_item.append(item_elem)
                     elif columntype == misc.MEAS_NO:
-                        value = int(eval(item_elem)) if item_elem not in ['0','0.0'] else 0
+                        value = int(misc.evaluate(item_elem)) if item_elem not in ['0','0.0'] else 0
                         rendered_item.append(value)
                     elif columntype == misc.MEAS_L:
-                        value = round(eval(item_elem),3) if item_elem not in ['0','0.0'] else 0
+                        value = round(misc.evaluate(item_elem),3) if item_elem not in ['0','0.0'] else 0
                         rendered_item.append(value)
                 else:
                     rendered_item.append(None)
-            except TypeError:
+            except (TypeError, ValueError):
                 rendered_item.append(None)
                 log.warning('RecordCustom - Wrong value loaded in item - ' + str(item_elem))
-        return rendered_item
+        self.rendered = (row, rendered_item)
+        return list(rendered_item)
 
     def set_model(self, items, cust_funcs, total_func, columntypes):
         """Set data model"""
         self.__init__(items, cust_funcs, total_func, columntypes)
 
     def find_total(self):
-        return self.total_func(self.data)
+        return self.total
 
     def find_custom(self,index):
         return self.cust_funcs[index](self.data)
@@ -309,11 +362,7 @@ class MeasurementItemCustom(MeasurementItem):
         # Read description from file
         if plugin is not None:
             try:
-                spec = importlib.util.spec_from_file_location(plugin, misc.abs_path('meas_templates', plugin+'.py'))
-                module = importlib.util.module_from_spec(spec)
-                sys.modules[spec.name] = module
-                spec.loader.exec_module(module)
-                self.custom_object = module.CustomItem()
+                self.custom_object = get_plugin(plugin)
                 self.name = self.custom_object.name
                 self.itemtype = plugin
                 self.itemnos_mask = self.custom_object.itemnos_mask
@@ -326,7 +375,7 @@ class MeasurementItemCustom(MeasurementItem):
                 # For user data support
                 self.captions_udata = self.custom_object.captions_udata
                 self.columntypes_udata = self.custom_object.columntypes_udata
-                self.user_data = self.custom_object.user_data_default
+                self.user_data = copy.deepcopy(self.custom_object.user_data_default)
                 self.dimensions = self.custom_object.dimensions
             except ImportError:
                 log.error('Error Loading plugin - MeasurementItemCustom - ' + str(plugin))
@@ -348,6 +397,15 @@ class MeasurementItemCustom(MeasurementItem):
         else:
             MeasurementItem.__init__(self)
 
+    @property
+    def user_data(self):
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, value):
+        self._user_data = value
+        self.invalidate()
+
     def model_width(self):
         """Returns number of columns being measured"""
         return len(self.columntypes)
@@ -376,7 +434,7 @@ class MeasurementItemCustom(MeasurementItem):
             self.__init__(model[1], model[1][5])
 
     def get_spreadsheet_buffer(self, path, schedule, codes, s_row):
-        spreadsheet = misc.Spreadsheet()
+        spreadsheet = misc.SpreadsheetBuffer()
         row = 1
         # Item no and description
         for slno, key in enumerate(self.itemnos):
@@ -421,7 +479,9 @@ class MeasurementItemCustom(MeasurementItem):
 
     def get_total(self):
         if self.total_func is not None:
-            return self.total_func(self.records,self.user_data)
+            if self.total_cache is None:
+                self.total_cache = self.total_func(self.records,self.user_data)
+            return list(self.total_cache)
         else:
             return []
 
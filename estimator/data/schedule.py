@@ -22,10 +22,10 @@
 #
 #
 
-import logging, copy, re, json
+import logging, copy, re, json, os, hashlib, threading, concurrent.futures
 import peewee, sqlite3
 from playhouse.migrate import migrate, SqliteMigrator
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from decimal import Decimal, ROUND_HALF_UP
 
 # Rate rounding function with support for ro
@@ -47,28 +47,13 @@ log = logging.getLogger()
 
 # Module functions
 
-def parse_analysis(models, item, index, set_code=False, settings=None):
-    """Parses first instance of analysis of rates into item starting from index"""
+class AnalysisParser:
+    """Parser for analysis of rates from spreadsheet rows
 
-    def string_has(string, values):
-        """Check if string has one of the values in values"""
-        string_formated = string.lower()
-        for value in values:
-            if value in string_formated:
-                return True
-        return False
-
-    def search_for_values(models, indexes, cols, values=None):
-        """Search up or down in model columns from index for value in list"""
-        for index in indexes:
-            if index >= 0:
-                for col in cols:
-                    if values is None:
-                        if models[index][col] != '':
-                            return [models[index][col], index, col]
-                    elif string_has(models[index][col], values):
-                        return [models[index][col], index, col]
-        return None
+        Rows are lists of (code, description, unit, rate, qty, amount). Features of
+        rows used by the parser are computed once as bit flags, so that rows are not
+        searched for keywords again on every state of the parser.
+    """
 
     [UP, DOWN] = [0,1]
     [SEARCHING, ITEM, GROUP] = [0,1,2]
@@ -79,207 +64,287 @@ def parse_analysis(models, item, index, set_code=False, settings=None):
     TIMES_KEYS = ['rate per', 'rate for', 'cost per', 'cost for','cost of', 'rate of']
     ROUND_KEYS = ['say']
 
-    if settings:
-        (comment_loc, round_val) = settings
-    else:
-        (comment_loc, round_val) = (DOWN, -1)
-
-    # Initialise and start state machine
-
-    state = SEARCHING
-    item_start = 0
-    group = None
-
-    while index < len(models):
-        model = models[index]
-        # Search for item
-        if state == SEARCHING:
-            if 'description' in model[1].lower() and 'unit' in model[2].lower():
-                code_query = search_for_values(models, range(index-1,index-5,-1), [0])
-
-                if code_query:
-                    state = ITEM
-                    if set_code:
-                        item.code = code_query[0]
-                        item_code_index = code_query[1]
-                    if index+2 < len(models):  # Hack to prevent failures in bad files
-                        ana_query = search_for_values(models, range(item_code_index+1,index+2), [0,1,2], ANA_REMARK_KEYS)
-                        if ana_query:
-                            item.ana_remarks = ana_query[0]
-                            if ana_query[1] > index:
-                                index = ana_query[1]
-
-                    item_start = index
-            index = index + 1
-            continue
-
-        # Handle different classes of items
-        elif state == ITEM:
-            # If group add group
-            if(model[2] == ''
-               and model[3] == model[4] == model[5] == 0
-               and string_has(model[1], RES_KEYS)
-               and model[1].isupper()):
-                if model[0] != '':
-                    code = model[0]
-                else:
-                    code = None
-                item.add_ana_group(model[1], code=code)
-                state = GROUP
-                group = len(item.ana_items)-1
-
-                index = index + 1
-                continue
-
-            # If resource item, add blank group
-            elif model[0] != '' and model[1] != '' and model[2] != '' and model[4] != 0:
-                # Setup generic resource group for item
-                item.add_ana_group('RESOURCE')
-                state = GROUP
-                group = len(item.ana_items)-1
-
-                # Re-evaluate item under group
-                index = index
-                continue
-
-            # If total item, add total
-            elif(model[2] == ''and model[3] == 0
-                 and model[4] == 0 and model[5] != 0
-                 and string_has(model[1], SUM_KEYS)
-                 and model[5] >= models[index-1][5]):
-                item.add_ana_sum(model[1])
-
-                index = index + 1
-                continue
-
-            # If weight item, add weight
-            elif(model[2] == ''and model[3] == 0
-                 and model[4] == 0 and model[5] != 0
-                 and string_has(model[1], WEIGHT_KEYS)
-                 and model[5] < models[index-1][5]):
-                item.add_ana_weight(model[1], Currency(model[5]/models[index-1][5], 3))
-
-                index = index + 1
-                continue
+    # Row feature flags
+    (EMPTY_CODE, EMPTY_DESC, EMPTY_UNIT, ZERO_QTY, ZERO_RATE, ZERO_AMOUNT, UPPER,
+     HAS_RES, HAS_SUM, HAS_WEIGHT, HAS_TIMES, HAS_ROUND, HAS_TOTAL, HEADER) = [1 << bit for bit in range(14)]
+    ZERO_VALUES = ZERO_QTY | ZERO_RATE | ZERO_AMOUNT
+    # Combined flags of rows
+    BLANK = EMPTY_CODE | EMPTY_DESC | EMPTY_UNIT | ZERO_VALUES
+    RESOURCE = EMPTY_CODE | EMPTY_DESC | EMPTY_UNIT | ZERO_RATE
+    # Regular expressions matching keys in lower case description with corresponding flag
+    KEY_FLAGS = [(re.compile('|'.join(re.escape(key) for key in keys)), flag)
+                 for (keys, flag) in [(RES_KEYS, HAS_RES), (SUM_KEYS, HAS_SUM), (WEIGHT_KEYS, HAS_WEIGHT),
+                                      (TIMES_KEYS, HAS_TIMES), (ROUND_KEYS, HAS_ROUND)]]
+    ANA_REMARK_REGEX = re.compile('|'.join(re.escape(key) for key in ANA_REMARK_KEYS))
+
+    def __init__(self, models, settings=None):
+        if settings:
+            (self.comment_loc, self.round_val) = settings
+        else:
+            (self.comment_loc, self.round_val) = (self.DOWN, -1)
+        # Index of next row to be parsed
+        self.index = 0
+
+        # Numeric columns of rows read as text are converted to numbers
+        self.models = []
+        self.flags = []
+        for model in models:
+            try:
+                model = [model[0], model[1], model[2]] + [float(value) if type(value) is str else value for value in model[3:6]]
+            except ValueError:
+                model = [model[0], model[1], model[2]] + [self.get_number(value) for value in model[3:6]]
+            self.models.append(model)
+
+            description = model[1].lower()
+            flags = 0
+            for (regex, flag) in self.KEY_FLAGS:
+                if regex.search(description):
+                    flags |= flag
+            if 'total' in description:
+                flags |= self.HAS_TOTAL
+            if model[0] == '':
+                flags |= self.EMPTY_CODE
+            if model[1] == '':
+                flags |= self.EMPTY_DESC
+            if model[2] == '':
+                flags |= self.EMPTY_UNIT
+            if model[3] == 0:
+                flags |= self.ZERO_QTY
+            if model[4] == 0:
+                flags |= self.ZERO_RATE
+            if model[5] == 0:
+                flags |= self.ZERO_AMOUNT
+            if model[1].isupper():
+                flags |= self.UPPER
+            if 'description' in description and 'unit' in model[2].lower():
+                flags |= self.HEADER
+            self.flags.append(flags)
+
+    @staticmethod
+    def get_number(value):
+        """Get numeric value of cell, treating invalid values as zero"""
+        if isinstance(value, str):
+            try:
+                return float(value) if value else 0
+            except ValueError:
+                return 0
+        return value
+
+    def get_remark_col(self, index):
+        """Get column of first analysis remark key in code, description and unit of row"""
+        for col in (0, 1, 2):
+            if self.ANA_REMARK_REGEX.search(self.models[index][col].lower()):
+                return col
+        return None
 
-            # If times item, add times
-            elif(model[2] == '' and model[3] == 0
-                 and model[4] == 0 and model[5] != 0
-                 and string_has(model[1], TIMES_KEYS)
-                 and model[5] < models[index-1][5]):
-                item.add_ana_times(model[1], Currency(model[5]/models[index-1][5], 6))
+    def is_remark(self, index):
+        """Check if row is a remark line"""
+        flags = self.flags[index]
+        return (flags & (self.EMPTY_CODE | self.EMPTY_UNIT | self.ZERO_VALUES | self.EMPTY_DESC)
+                == self.EMPTY_CODE | self.EMPTY_UNIT | self.ZERO_VALUES
+                and (not flags & self.UPPER or not flags & self.HAS_RES))
+
+    def is_resource(self, index):
+        """Check if row is a resource item"""
+        return not self.flags[index] & self.RESOURCE
+
+    def is_value_row(self, index, key):
+        """Check if row has only an amount with description having key"""
+        flags = self.flags[index]
+        return (flags & (self.EMPTY_UNIT | self.ZERO_VALUES | key)
+                == self.EMPTY_UNIT | self.ZERO_QTY | self.ZERO_RATE | key)
+
+    def parse(self, item, index, set_code=False):
+        """Parses first instance of analysis of rates into item starting from index
+
+            Returns index of row following the analysis. Item is left unchanged
+            if no analysis is found.
+        """
+        models = self.models
+        flags = self.flags
+        state = self.SEARCHING
+        item_start = 0
+        group = None
+
+        while index < len(models):
+            model = models[index]
+            # Search for item
+            if state == self.SEARCHING:
+                if flags[index] & self.HEADER:
+                    code_index = None
+                    for search_index in range(index-1, index-5, -1):
+                        if search_index >= 0 and not flags[search_index] & self.EMPTY_CODE:
+                            code_index = search_index
+                            break
 
+                    if code_index is not None:
+                        state = self.ITEM
+                        if set_code:
+                            item.code = models[code_index][0]
+                        if index+2 < len(models):  # Hack to prevent failures in bad files
+                            for search_index in range(code_index+1, index+2):
+                                col = self.get_remark_col(search_index)
+                                if col is not None:
+                                    item.ana_remarks = models[search_index][col]
+                                    if search_index > index:
+                                        index = search_index
+                                    break
+
+                        item_start = index
                 index = index + 1
                 continue
 
-            # If round item, add round
-            elif(model[0] == '' and model[2] == '' and model[3] == 0
-                 and model[4] == 0 and model[5] != 0
-                 and string_has(model[1], ROUND_KEYS)
-                 and abs(model[5] - models[index-1][5]) < 1):
-
-                # Check if settigns override enabled
-                if round_val == -1:
-                    decimal1 = model[5]-int(model[5])
-                    decimal2 = model[5]*10 - int(model[5]*10)
-                    if decimal2 > 0:
-                        pos = 2
-                    elif decimal1 > 0:
-                        pos = 1
+            # Handle different classes of items
+            elif state == self.ITEM:
+                # If group add group
+                if (flags[index] & (self.EMPTY_UNIT | self.ZERO_VALUES | self.HAS_RES | self.UPPER)
+                        == self.EMPTY_UNIT | self.ZERO_VALUES | self.HAS_RES | self.UPPER):
+                    if model[0] != '':
+                        code = model[0]
                     else:
-                        pos = 0
-                    item.add_ana_round(model[1], pos)
-                else:
-                    item.add_ana_round(model[1], round_val)
+                        code = None
+                    item.add_ana_group(model[1], code=code)
+                    state = self.GROUP
+                    group = len(item.ana_items)-1
+
+                    index = index + 1
+                    continue
+
+                # If resource item, add blank group
+                elif self.is_resource(index):
+                    # Setup generic resource group for item
+                    item.add_ana_group('RESOURCE')
+                    state = self.GROUP
+                    group = len(item.ana_items)-1
+
+                    # Re-evaluate item under group
+                    continue
+
+                # If total item, add total
+                elif self.is_value_row(index, self.HAS_SUM) and model[5] >= models[index-1][5]:
+                    item.add_ana_sum(model[1])
+
+                    index = index + 1
+                    continue
+
+                # If weight item, add weight
+                elif self.is_value_row(index, self.HAS_WEIGHT) and model[5] < models[index-1][5]:
+                    item.add_ana_weight(model[1], Currency(model[5]/models[index-1][5], 3))
+
+                    index = index + 1
+                    continue
+
+                # If times item, add times
+                elif self.is_value_row(index, self.HAS_TIMES) and model[5] < models[index-1][5]:
+                    item.add_ana_times(model[1], Currency(model[5]/models[index-1][5], 6))
+
+                    index = index + 1
+                    continue
+
+                # If round item, add round
+                elif (flags[index] & self.EMPTY_CODE and self.is_value_row(index, self.HAS_ROUND)
+                      and abs(model[5] - models[index-1][5]) < 1):
+
+                    # Check if settigns override enabled
+                    if self.round_val == -1:
+                        decimal1 = model[5]-int(model[5])
+                        decimal2 = model[5]*10 - int(model[5]*10)
+                        if decimal2 > 0:
+                            pos = 2
+                        elif decimal1 > 0:
+                            pos = 1
+                        else:
+                            pos = 0
+                        item.add_ana_round(model[1], pos)
+                    else:
+                        item.add_ana_round(model[1], self.round_val)
 
-                index = index + 1
-                break
-
-        # Handle resource group
-        elif state == GROUP:
-            # If resource item
-            if model[0] != '' and model[1] != '' and model[2] != ''  and model[4] != 0:
-                # Setup resource item
-                code = model[0]
-                qty = model[3]
-                remarks = None
-                # Search if there is a remarks item to be added
-                if comment_loc == DOWN:
-                    for rem_index in range(1,15):
-                        if index+1 < len(models):  # Hack to prevent failures in bad files
-                            nxt = models[index+1]
-                            if(nxt[0] == nxt[2] == '' and nxt[3] == nxt[4] == nxt[5] == 0
-                               and nxt[1] != '' and (not nxt[1].isupper() or not string_has(nxt[1], RES_KEYS))):
+                    index = index + 1
+                    break
+
+            # Handle resource group
+            elif state == self.GROUP:
+                # If resource item
+                if self.is_resource(index):
+                    # Setup resource item
+                    code = model[0]
+                    qty = model[3]
+                    remarks = None
+                    # Search if there is a remarks item to be added
+                    if self.comment_loc == self.DOWN:
+                        for rem_index in range(1,15):
+                            if index+1 < len(models) and self.is_remark(index+1):
                                 if remarks:
-                                    remarks = remarks + '\n' + nxt[1]
+                                    remarks = remarks + '\n' + models[index+1][1]
                                 else:
-                                    remarks = nxt[1]
+                                    remarks = models[index+1][1]
                                 index = index + 1
                             else:
                                 break
-                        else:
-                            break
-                elif comment_loc == UP:
-                    for rem_index in range(1,15):
-                        if index-rem_index > 0:  # Hack to prevent failures in bad files
-                            prv = models[index-rem_index]
-                            if(prv[0] == prv[2] == '' and prv[3] == prv[4] == prv[5] == 0
-                               and prv[1] != '' and (not prv[1].isupper() or not string_has(prv[1], RES_KEYS))
-                               and index-rem_index > item_start):
+                    elif self.comment_loc == self.UP:
+                        for rem_index in range(1,15):
+                            if index-rem_index > 0 and self.is_remark(index-rem_index) and index-rem_index > item_start:
                                 if remarks:
-                                    remarks = prv[1] + '\n' + remarks
+                                    remarks = models[index-rem_index][1] + '\n' + remarks
                                 else:
-                                    remarks = prv[1]
+                                    remarks = models[index-rem_index][1]
                             else:
                                 break
-                        else:
-                            break
 
-                # Set resource model
-                res = ResourceItemModel(code = code,
-                                        description = model[1],
-                                        unit = model[2],
-                                        rate = model[4],
-                                        vat = 0,
-                                        discount = 0)
-                item.resources[code] = res
+                    # Set resource model
+                    res = ResourceItemModel(code = code,
+                                            description = model[1],
+                                            unit = model[2],
+                                            rate = model[4],
+                                            vat = 0,
+                                            discount = 0)
+                    item.resources[code] = res
 
-                res_items = [code, qty, remarks]
-                item.ana_items[group]['resource_list'].append(res_items)
+                    res_items = [code, qty, remarks]
+                    item.ana_items[group]['resource_list'].append(res_items)
 
-                index = index + 1
-                continue
+                    index = index + 1
+                    continue
 
-            # Sum of group item
-            elif string_has(model[1], RES_KEYS) and 'total' in model[1].lower():
-                group = None
-                state = ITEM
+                # Sum of group item
+                elif flags[index] & self.HAS_RES and flags[index] & self.HAS_TOTAL:
+                    group = None
+                    state = self.ITEM
 
-                index = index + 1
-                continue
+                    index = index + 1
+                    continue
 
-            # If remark item, skip
-            elif (model[0] == model[2] == '' and model[3] == model[4] == model[5] == 0
-                  and model[1] != ''
-                  and (not model[1].isupper() or not string_has(model[1], RES_KEYS))):
-                index = index + 1
-                continue
+                # If remark item or blank line, skip
+                elif self.is_remark(index) or flags[index] & self.BLANK == self.BLANK:
+                    index = index + 1
+                    continue
 
-            # If blank line, skip
-            elif (model[0] == model[1] == model[2] == ''
-                  and model[3] == model[4] == model[5] == 0):
-                index = index + 1
-                continue
+                # Any other item
+                else:
+                    group = None
+                    state = self.ITEM
 
-            # Any other item
-            else:
-                group = None
-                state = ITEM
+                    continue
 
-                continue
+            index = index + 1
+        return index
+
+    def iter_items(self, set_code=True):
+        """Yield schedule items for analyses of rates in rows in order
+
+            Parsing resumes from the row following the previous analysis each time
+            an item is requested, so that items can be processed as they are found.
+        """
+        while self.index < len(self.models):
+            item = ScheduleItemModel(None, None)
+            self.index = self.parse(item, self.index, set_code)
+            if item.ana_items or item.code is not None:
+                yield item
 
-        index = index + 1
-    return index
+
+def parse_analysis(models, item, index, set_code=False, settings=None):
+    """Parses first instance of analysis of rates into item starting from index"""
+    return AnalysisParser(models, settings).parse(item, index, set_code)
 
 
 # Data definition classes
@@ -541,6 +606,189 @@ class ResourceItemModel:
         self.category = category
 
 
+class RateGraph:
+    """Dependency graph of schedule items on resources and sub analysis items
+
+        A sub analysis item is a schedule item whose code is also used as a
+        resource in the analysis of other items. Sub analysis items are kept
+        in topological order so that rates can be recomputed in a single pass
+        irrespective of the depth of nesting.
+    """
+    def __init__(self, sch_codes, edges):
+        # Resources used by each schedule item
+        self.resources = dict()
+        # Schedule items using each resource
+        self.users = dict()
+        for sch_code, res_code in edges:
+            self.resources.setdefault(sch_code, set()).add(res_code)
+            self.users.setdefault(res_code, set()).add(sch_code)
+
+        # Schedule items used as resources
+        self.sub_ana = set(code for code in self.users if code in sch_codes)
+        # Sub analysis items used by each schedule item
+        self.dependencies = dict()
+        for code, res_codes in self.resources.items():
+            deps = res_codes & self.sub_ana
+            if deps:
+                self.dependencies[code] = deps
+
+        [self.order, self.cyclic] = self.sort()
+        self.rank = {code: index for index, code in enumerate(self.order)}
+        # Sub analysis items whose rates may differ from analysis
+        self.dirty = set(self.order)
+
+    def sort(self):
+        """Sort sub analysis items in topological order
+
+            Returns [order, cyclic] where cyclic is the set of items forming
+            or depending on a cycle.
+        """
+        indegree = {code: len(self.dependencies.get(code, ())) for code in self.sub_ana}
+        ready = deque(sorted(code for code, count in indegree.items() if count == 0))
+        order = []
+        while ready:
+            code = ready.popleft()
+            order.append(code)
+            for user in sorted(self.users.get(code, ())):
+                if user in indegree:
+                    indegree[user] -= 1
+                    if indegree[user] == 0:
+                        ready.append(user)
+        cyclic = set(indegree) - set(order)
+        if cyclic:
+            log.warning('RateGraph - sort - Cyclic sub analysis found - ' + ', '.join(sorted(cyclic)))
+        return [order, cyclic]
+
+    def get_dependencies(self, codes):
+        """Get all sub analysis items used by codes
+
+            Items are returned in topological order followed by cyclic items.
+        """
+        required = set()
+        pending = list(codes)
+        while pending:
+            code = pending.pop()
+            for dep in self.dependencies.get(code, ()):
+                if dep not in required:
+                    required.add(dep)
+                    pending.append(dep)
+        ordered = sorted(required - self.cyclic, key=self.rank.get)
+        return ordered + sorted(required & self.cyclic)
+
+    def mark_dirty(self, res_codes):
+        """Mark sub analysis items affected by change of resources as dirty"""
+        visited = set()
+        pending = list(res_codes)
+        while pending:
+            code = pending.pop()
+            if code in visited:
+                continue
+            visited.add(code)
+            if code in self.sub_ana and code not in self.cyclic:
+                self.dirty.add(code)
+            pending.extend(self.users.get(code, ()))
+
+    def mark_clean(self, codes):
+        self.dirty.difference_update(codes)
+
+
+class CompiledAnalysis:
+    """Analysis of rates of schedule items compiled over a resource rate vector
+
+        Resource groups of every analysis are stored as sparse rows of
+        (resource index, quantity) and the remaining analysis items as scalar
+        operations applied in sequence. Rates of any number of items can then
+        be evaluated from a vector of resource rates without building item
+        models. Rounding is applied at the same points as in
+        ScheduleItemModel.evaluate_results so that results match exactly.
+    """
+    def __init__(self, res_codes):
+        self.res_codes = list(res_codes)
+        self.res_index = {code: index for index, code in enumerate(self.res_codes)}
+        # Compiled operations of each schedule item
+        self.items = dict()
+
+    def add_item(self, code, ana_items):
+        """Compile analysis items of a schedule item
+
+            Resource lists of ANA_GROUP items should refer to resource codes
+            passed on initialisation.
+        """
+        operations = []
+        for item in ana_items:
+            itemtype = item['itemtype']
+            if itemtype == ScheduleItemModel.ANA_GROUP:
+                row = [(self.res_index[resource[0]], Decimal(resource[1])) for resource in item['resource_list']]
+                operations.append((itemtype, row))
+            elif itemtype in (ScheduleItemModel.ANA_WEIGHT, ScheduleItemModel.ANA_TIMES):
+                operations.append((itemtype, Decimal(item['value'])))
+            elif itemtype == ScheduleItemModel.ANA_ROUND:
+                operations.append((itemtype, item['value']))
+            else:
+                operations.append((itemtype, None))
+        self.items[code] = operations
+
+    @staticmethod
+    def get_net_rate(rate, vat, discount):
+        """Get resource rate inclusive of tax and discount"""
+        discount = discount if discount else 0
+        vat = vat if vat else 0
+        return Currency(rate * (100 + vat) * (100 - discount) / 10000)
+
+    def get_rate_vector(self, resources):
+        """Get vector of net resource rates
+
+            Arguments:
+                resources: dict of code to [rate, vat, discount]
+        """
+        rates = [0]*len(self.res_codes)
+        for code, index in self.res_index.items():
+            if code in resources:
+                rates[index] = self.get_net_rate(*resources[code])
+        return rates
+
+    def set_rate(self, rates, code, rate, vat=None, discount=None):
+        """Modify rate of a resource in vector of net resource rates"""
+        if code in self.res_index:
+            rates[self.res_index[code]] = self.get_net_rate(rate, vat, discount)
+
+    def evaluate(self, code, rates):
+        """Evaluate analysed rate of a schedule item
+
+            Returns None if item has no analysis.
+        """
+        sum_total = 0
+        sum_item = 0
+        result = None
+        for itemtype, value in self.items.get(code, ()):
+            if itemtype == ScheduleItemModel.ANA_GROUP:
+                sum_item = 0
+                for index, qty in value:
+                    sum_item = sum_item + Currency(qty * rates[index])
+                sum_total = Currency(sum_total + sum_item)
+                result = sum_item
+            elif itemtype == ScheduleItemModel.ANA_SUM:
+                sum_item = Currency(sum_total)
+                result = sum_total
+            elif itemtype == ScheduleItemModel.ANA_WEIGHT:
+                result = Currency(sum_item * value)
+                sum_total = sum_total + result
+            elif itemtype == ScheduleItemModel.ANA_TIMES:
+                result = Currency(sum_item * value)
+                sum_total = result
+                sum_item = sum_total
+            elif itemtype == ScheduleItemModel.ANA_ROUND:
+                sum_total = Currency(sum_total, value)
+                result = sum_total
+        return result
+
+    def evaluate_all(self, rates, codes=None):
+        """Evaluate analysed rates of items, returns dict of code to rate"""
+        if codes is None:
+            codes = self.items.keys()
+        return {code: self.evaluate(code, rates) for code in codes if code in self.items}
+
+
 # Sqlite database models
 
 def get_orm_model(bind_database):
@@ -575,6 +823,10 @@ def get_orm_model(bind_database):
         order = peewee.IntegerField()
         suborder = peewee.IntegerField(null = True)
         colour = peewee.CharField(null = True)
+        class Meta:
+            # Indexes for ordered listing of items and sub items
+            indexes = ((('category', 'parent', 'order'),False),
+                       (('parent', 'suborder'),False))
 
     class ResourceTable(BaseModelSch):
         code = peewee.CharField(unique = True)
@@ -586,6 +838,9 @@ def get_orm_model(bind_database):
         reference = peewee.CharField(null = True)
         category = peewee.ForeignKeyField(ResourceCategoryTable, null = True, on_delete = 'CASCADE', backref='resources')
         order = peewee.IntegerField()
+        class Meta:
+            # Index for ordered listing of resources
+            indexes = ((('category', 'order'),False),)
 
     class SequenceTable(BaseModelSch):
         id_seq = peewee.IntegerField()
@@ -595,8 +850,9 @@ def get_orm_model(bind_database):
         code = peewee.CharField(null = True)
         description = peewee.CharField(null = True)
         class Meta:
-            # Add uniqueness constraint
-            indexes = ((('id_seq', 'id_sch'),True),)
+            # Add uniqueness constraint and index for lookup by type
+            indexes = ((('id_seq', 'id_sch'),True),
+                       (('id_sch', 'itemtype'),False))
 
     class ResourceItemTable(BaseModelSch):
         id_sch = peewee.ForeignKeyField(ScheduleTable, on_delete = 'CASCADE', backref='resourceitems')
@@ -604,23 +860,60 @@ def get_orm_model(bind_database):
         id_res = peewee.ForeignKeyField(ResourceTable, on_delete = 'CASCADE', backref='resourceitems')
         qty = peewee.DecimalField()
         remarks = peewee.CharField(null = True)
+        class Meta:
+            indexes = ((('id_sch', 'id_seq'),False),)
 
+    class MeasurementItemTable(BaseModelSch):
+        order = peewee.IntegerField(index = True)
+        itemtype = peewee.CharField()
+        plugin = peewee.CharField(null = True)
+        remark = peewee.CharField(null = True)
+        user_data = peewee.CharField(null = True)
 
-    class Using(object):
-        """Dynamically swapout databases"""
+    class MeasurementRecordTable(BaseModelSch):
+        item = peewee.ForeignKeyField(MeasurementItemTable, on_delete = 'CASCADE', backref='records')
+        order = peewee.IntegerField()
+        data = peewee.CharField()
+        class Meta:
+            indexes = ((('item', 'order'),True),)
+
+    class MeasurementItemNoTable(BaseModelSch):
+        item = peewee.ForeignKeyField(MeasurementItemTable, on_delete = 'CASCADE', backref='itemnos')
+        slno = peewee.IntegerField()
+        # Id of ScheduleTable row measured
+        itemno = peewee.IntegerField(null = True, index = True)
+        remark = peewee.CharField(null = True)
+        class Meta:
+            indexes = ((('item', 'slno'),True),)
 
-        def __init__(self, db, tables):
-            self.db = db
-            self.tables = tables
-            self.bind_database = bind_database
+    return (BaseModelSch, ProjectTable, ScheduleCategoryTable, ResourceCategoryTable, ScheduleTable, ResourceTable, SequenceTable, ResourceItemTable,
+            MeasurementItemTable, MeasurementRecordTable, MeasurementItemNoTable)
 
-        def __enter__(self):
-            self.db.bind(self.tables)
 
-        def __exit__(self, *args):
-            self.bind_database.bind(self.tables)
+# Library registry
 
-    return (BaseModelSch, ProjectTable, ScheduleCategoryTable, ResourceCategoryTable, ScheduleTable, ResourceTable, SequenceTable, ResourceItemTable, Using)
+# Read only databases of libraries shared by all open projects keyed by absolute filename,
+# as (modification time, size) of file when opened and database
+library_readers = dict()
+library_readers_lock = threading.Lock()
+
+def open_library(filename):
+    """Return read only database of library filename, shared between projects until the file changes
+
+        Libraries bundled with the program are opened immutable. Other libraries
+        are user files which may be modified or replaced and are opened read only.
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with library_readers_lock:
+        if filename not in library_readers or library_readers[filename][0] != key:
+            bundled_dir = os.path.normcase(os.path.abspath(misc.abs_path('database')))
+            immutable = os.path.normcase(os.path.dirname(filename)) == bundled_dir
+            reader = ScheduleDatabase(None)
+            reader.open_database(filename, read_only=True, immutable=immutable)
+            library_readers[filename] = (key, reader)
+        return library_readers[filename][1]
 
 
 # Data base handler
@@ -632,9 +925,27 @@ class ScheduleDatabase:
 
         self.database = peewee.SqliteDatabase(None)
         self.database_filename = None
-        (self.BaseModelSch, self.ProjectTable, self.ScheduleCategoryTable, self.ResourceCategoryTable, self.ScheduleTable, self.ResourceTable, self.SequenceTable, self.ResourceItemTable, self.Using) = get_orm_model(self.database)
+        self.read_only = False
+        (self.BaseModelSch, self.ProjectTable, self.ScheduleCategoryTable, self.ResourceCategoryTable, self.ScheduleTable, self.ResourceTable, self.SequenceTable, self.ResourceItemTable,
+         self.MeasurementItemTable, self.MeasurementRecordTable, self.MeasurementItemNoTable) = get_orm_model(self.database)
 
+        # Read only databases of libraries keyed by name
         self.libraries = OrderedDict()
+        # Directory for search indexes of libraries, in memory indexes used if None
+        self.search_index_dir = None
+        # Search index file of read only database
+        self.search_index_filename = None
+        # Project settings cache keyed by bound database
+        self.settings_cache = dict()
+        # Rate dependency graph keyed by bound database
+        self.rate_graphs = dict()
+        # Compiled analysis of rates keyed by bound database
+        self.compiled_analyses = dict()
+        # Guards compiled analyses built by worker threads, generation is bumped on invalidation
+        self.compiled_analyses_lock = threading.Lock()
+        self.compiled_analyses_generation = 0
+        # Callbacks notified of row changes by undoable actions
+        self.subscribers = []
 
     ## Undo management
 
@@ -656,8 +967,10 @@ class ScheduleDatabase:
 
         def do(self):
             'Do or redo the action'
+            self.args[0].setup_change_log()
             self._runner = self._generator(*self.args, **self.kwargs)
             rets = next(self._runner)
+            self.args[0].emit_changes()
             if isinstance(rets, tuple):
                 self._text = rets[0]
                 return rets[1:]
@@ -670,12 +983,16 @@ class ScheduleDatabase:
 
         def undo(self):
             'Undo the action'
+            self.args[0].setup_change_log()
             try:
                 next(self._runner)
             except StopIteration:
                 pass
             # Delete it so that its not accidentally called again
             del self._runner
+            # Rates restored by undo are not tracked by rate graph
+            self.args[0].invalidate_rate_graph()
+            self.args[0].emit_changes()
 
         def text(self):
             'Return the descriptive text of the action'
@@ -742,6 +1059,246 @@ class ScheduleDatabase:
         '''
         return ScheduleDatabase._Group(desc, self.stack)
 
+    ## Search index
+
+    def get_search_tables(self):
+        """Return full text search tables as [(name, model, indexed fields)]"""
+        return [('schedulesearch', self.ScheduleTable, ['code', 'description', 'unit', 'remarks']),
+                ('resourcesearch', self.ResourceTable, ['code', 'description', 'unit', 'reference'])]
+
+    def table_exists(self, name, schema='main'):
+        cursor = self.database.execute_sql('SELECT count(*) FROM {}.sqlite_master WHERE name = ?'.format(schema), (name,))
+        return cursor.fetchone()[0] > 0
+
+    def remove_stored_search_index(self):
+        """Remove full text search index stored in project by earlier builds
+
+            Search index is now held per connection, see get_search_schema.
+        """
+        if not self.table_exists('schedulesearch'):
+            return
+        try:
+            with self.database.atomic():
+                # Triggers are dropped first as these do not need the fts5 module
+                for (name, model, fields) in self.get_search_tables():
+                    for event in ('insert', 'delete', 'update'):
+                        self.database.execute_sql('DROP TRIGGER IF EXISTS main.{}_{}'.format(name, event))
+            with self.database.atomic():
+                for (name, model, fields) in self.get_search_tables():
+                    self.database.execute_sql('DROP TABLE IF EXISTS main.' + name)
+            log.info('ScheduleDatabase - remove_stored_search_index - stored search index removed')
+        except peewee.OperationalError as e:
+            log.warning('ScheduleDatabase - remove_stored_search_index - ' + str(e))
+
+    def get_search_schema(self):
+        """Return schema holding search index of current connection, building it on first use
+
+            Read only libraries get the index in a sidecar file if search_index_filename
+            is set, rebuilt when the library file changes. Writable projects get an in
+            memory index kept updated by temporary triggers and rebuilt on changes
+            committed by other connections. Nothing is written to the database file.
+        """
+        attached = [row[1] for row in self.database.execute_sql('PRAGMA database_list').fetchall()]
+        if self.read_only and 'search' in attached:
+            return 'search'
+
+        try:
+            if self.read_only:
+                filename = self.search_index_filename if self.search_index_filename else ':memory:'
+                source_stat = os.stat(self.database_filename)
+                source = '{}:{}'.format(source_stat.st_mtime, source_stat.st_size)
+            else:
+                filename = ':memory:'
+                data_version = self.database.execute_sql('PRAGMA main.data_version').fetchone()[0]
+                source = 'data_version:{}'.format(data_version)
+            if 'search' not in attached:
+                self.database.execute_sql('ATTACH DATABASE ? AS search', (filename,))
+            with self.database.atomic():
+                self.database.execute_sql('CREATE TABLE IF NOT EXISTS search.searchinfo (key TEXT PRIMARY KEY, value TEXT)')
+                row = self.database.execute_sql("SELECT value FROM search.searchinfo WHERE key = 'source'").fetchone()
+                if row is None or row[0] != source:
+                    for (name, model, fields) in self.get_search_tables():
+                        table = model._meta.table_name
+                        columns = ', '.join(fields)
+                        self.database.execute_sql('DROP TABLE IF EXISTS search.' + name)
+                        self.database.execute_sql("CREATE VIRTUAL TABLE search.{0} USING fts5({1}, tokenize='trigram')".format(name, columns))
+                        self.database.execute_sql('INSERT INTO search.{0}(rowid, {1}) SELECT id, {1} FROM main.{2}'.format(name, columns, table))
+                        if not self.read_only:
+                            # Trigger bodies can not qualify tables, search index resolved by name
+                            new_values = ', '.join('NEW.' + field for field in fields)
+                            insert_sql = 'INSERT INTO {0}(rowid, {1}) VALUES (NEW.id, {2});'.format(name, columns, new_values)
+                            delete_sql = 'DELETE FROM {0} WHERE rowid = OLD.id;'.format(name)
+                            self.database.execute_sql('CREATE TEMP TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON main.{1} BEGIN {2} END'.format(name, table, insert_sql))
+                            self.database.execute_sql('CREATE TEMP TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON main.{1} BEGIN {2} END'.format(name, table, delete_sql))
+                            self.database.execute_sql('CREATE TEMP TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE OF {1} ON main.{2} BEGIN {3} {4} END'.format(name, columns, table, delete_sql, insert_sql))
+                    self.database.execute_sql("INSERT OR REPLACE INTO search.searchinfo VALUES ('source', ?)", (source,))
+                    log.info('ScheduleDatabase - get_search_schema - search index built - ' + filename)
+            return 'search'
+        except (peewee.OperationalError, OSError) as e:
+            log.warning('ScheduleDatabase - get_search_schema - search index not available - ' + str(e))
+            return None
+
+    def get_search_query(self, name, model, text, fields, columns, joins=''):
+        """Return (sql, params) selecting columns of rows matching all words of text ranked by relevance"""
+        schema = self.get_search_schema()
+        if schema is None:
+            return None
+
+        # Trigram index matches words of three or more characters, others are scanned
+        words = text.lower().split()
+        phrases = ['"' + word.replace('"', '""') + '"' for word in words if len(word) >= 3]
+        conditions = []
+        params = []
+        if phrases:
+            conditions.append('f.{} MATCH ?'.format(name))
+            params.append(' '.join(phrases))
+        for word in words:
+            if len(word) < 3:
+                conditions.append('instr(lower(' + " || ' ' || ".join("coalesce(t.{}, '')".format(field) for field in fields) + '), ?)')
+                params.append(word)
+        if not conditions:
+            return None
+
+        sql = 'SELECT {} FROM {}.{} f JOIN main.{} t ON t.id = f.rowid {} WHERE {}'.format(
+            columns, schema, name, model._meta.table_name, joins, ' AND '.join(conditions))
+        if phrases:
+            sql += ' ORDER BY f.rank'
+        return sql, params
+
+    def search_items(self, text):
+        """Search schedule items by code, description, unit and remarks
+
+            Returns OrderedDict of code: (parent code, category) ranked by relevance
+            or None if search index is not available.
+        """
+        query = self.get_search_query('schedulesearch', self.ScheduleTable, text,
+            ['code', 'description', 'unit', 'remarks'], 't.code, p.code, c.description',
+            joins='LEFT JOIN main.{0} p ON p.id = t.parent_id LEFT JOIN main.{1} c ON c.id = t.category_id'.format(
+                self.ScheduleTable._meta.table_name, self.ScheduleCategoryTable._meta.table_name))
+        if query is None:
+            return None
+        (sql, params) = query
+        results = OrderedDict()
+        for (code, parent_code, category) in self.database.execute_sql(sql, params):
+            results[code] = (parent_code, category if category else 'UNCATEGORISED')
+        return results
+
+    def search_resources(self, text):
+        """Search resources by code, description, unit and reference
+
+            Returns OrderedDict of code: category ranked by relevance
+            or None if search index is not available.
+        """
+        query = self.get_search_query('resourcesearch', self.ResourceTable, text,
+            ['code', 'description', 'unit', 'reference'], 't.code, c.description',
+            joins='LEFT JOIN main.{0} c ON c.id = t.category_id'.format(self.ResourceCategoryTable._meta.table_name))
+        if query is None:
+            return None
+        (sql, params) = query
+        results = OrderedDict()
+        for (code, category) in self.database.execute_sql(sql, params):
+            results[code] = category if category else 'UNCATEGORISED'
+        return results
+
+    def search_libraries(self, text):
+        """Search schedule items of all libraries, returns {library name: search_items result}"""
+        results = OrderedDict()
+        for name in self.libraries:
+            results[name] = self.get_library_reader(name).search_items(text)
+        return results
+
+    ## Change events
+
+    def get_tracked_tables(self):
+        """Return tables tracked for change events as [(name, model, key, content fields, position fields)]"""
+        return [('schedule', self.ScheduleTable, 'code',
+                    ['description', 'unit', 'rate', 'qty', 'remarks', 'colour'],
+                    ['category', 'parent', 'order', 'suborder']),
+                ('resource', self.ResourceTable, 'code',
+                    ['description', 'unit', 'rate', 'vat', 'discount', 'reference'],
+                    ['category', 'order']),
+                ('schedule_category', self.ScheduleCategoryTable, 'description', [], ['order']),
+                ('resource_category', self.ResourceCategoryTable, 'description', [], ['order']),
+                ('project', self.ProjectTable, 'key', ['value'], []),
+                ('measurement', self.MeasurementItemTable, 'id', ['itemtype', 'plugin', 'remark', 'user_data'], ['order'])]
+
+    def subscribe(self, callback):
+        """Register callback(changes) to be called after every undoable action, undo and redo
+
+            changes is a dict keyed by table name ('schedule', 'resource', 'schedule_category',
+            'resource_category', 'project', 'measurement') of dicts holding sets of 'inserted',
+            'updated', 'deleted' and 'moved' row keys.
+        """
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove callback registered by subscribe"""
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def setup_change_log(self):
+        """Setup temporary change log triggers on current connection"""
+        if not self.subscribers:
+            return
+        cursor = self.database.execute_sql("SELECT count(*) FROM sqlite_temp_master WHERE type='table' AND name='changelog'")
+        if cursor.fetchone()[0]:
+            return
+
+        def column(model, field):
+            return '"' + model._meta.fields[field].column_name + '"'
+
+        statements = ['CREATE TEMP TABLE IF NOT EXISTS changelog (tablename TEXT, operation TEXT, key TEXT)']
+        for (name, model, key, content, position) in self.get_tracked_tables():
+            table = 'main."' + model._meta.table_name + '"'
+            key_col = column(model, key)
+            log_sql = "INSERT INTO changelog SELECT '{}', '{{}}', {{}}.{} WHERE {{}};".format(name, key_col)
+            # Row inserted
+            statements.append('CREATE TEMP TRIGGER IF NOT EXISTS changelog_{0}_insert AFTER INSERT ON {1} BEGIN {2} END'.format(
+                name, table, log_sql.format('inserted', 'NEW', 1)))
+            # Row deleted
+            statements.append('CREATE TEMP TRIGGER IF NOT EXISTS changelog_{0}_delete AFTER DELETE ON {1} BEGIN {2} END'.format(
+                name, table, log_sql.format('deleted', 'OLD', 1)))
+            # Row content modified, a change of key is logged as delete and insert
+            key_changed = 'OLD.{0} IS NOT NEW.{0}'.format(key_col)
+            columns = ', '.join([key_col] + [column(model, field) for field in content])
+            statements.append('CREATE TEMP TRIGGER IF NOT EXISTS changelog_{0}_update AFTER UPDATE OF {1} ON {2} BEGIN {3} {4} {5} END'.format(
+                name, columns, table,
+                log_sql.format('deleted', 'OLD', key_changed),
+                log_sql.format('inserted', 'NEW', key_changed),
+                log_sql.format('updated', 'NEW', 'NOT (' + key_changed + ')')))
+            # Row position modified
+            if position:
+                columns = ', '.join(column(model, field) for field in position)
+                moved = ' OR '.join('OLD.{0} IS NOT NEW.{0}'.format(column(model, field)) for field in position)
+                statements.append('CREATE TEMP TRIGGER IF NOT EXISTS changelog_{0}_move AFTER UPDATE OF {1} ON {2} BEGIN {3} END'.format(
+                    name, columns, table, log_sql.format('moved', 'NEW', moved)))
+
+        with self.database.atomic():
+            for statement in statements:
+                self.database.execute_sql(statement)
+
+    def emit_changes(self):
+        """Notify subscribers of row changes logged since last call"""
+        if not self.subscribers:
+            return
+        cursor = self.database.execute_sql("SELECT count(*) FROM sqlite_temp_master WHERE type='table' AND name='changelog'")
+        if not cursor.fetchone()[0]:
+            return
+        with self.database.atomic():
+            rows = self.database.execute_sql('SELECT tablename, operation, key FROM temp.changelog').fetchall()
+            self.database.execute_sql('DELETE FROM temp.changelog')
+        if not rows:
+            return
+
+        changes = dict()
+        for (table, operation, key) in rows:
+            if table not in changes:
+                changes[table] = {'inserted': set(), 'updated': set(), 'deleted': set(), 'moved': set()}
+            changes[table][operation].add(key)
+        for callback in list(self.subscribers):
+            callback(changes)
+
     ## Database management
 
     def create_new_database(self, filename=None):
@@ -755,21 +1312,38 @@ class ScheduleDatabase:
         # Create tables
         tables = [self.ProjectTable, self.ScheduleTable, self.ResourceTable,
                   self.ScheduleCategoryTable, self.ResourceCategoryTable,
-                  self.SequenceTable, self.ResourceItemTable]
+                  self.SequenceTable, self.ResourceItemTable,
+                  self.MeasurementItemTable, self.MeasurementRecordTable, self.MeasurementItemNoTable]
         self.database.create_tables(tables)
 
         # Update default project settings
         self.set_project_settings(misc.default_project_settings)
         log.info('ScheduleDatabase - create_new_database - database tables created')
 
-    def open_database(self, filename):
+    def open_database(self, filename, read_only=False, immutable=False):
 
         # Database intitialisation
-        self.database.init(filename)
+        if read_only and immutable:
+            # File assumed unchanged while open, skipping locking and change detection
+            self.database.init(misc.file_to_uri(filename) + '?mode=ro&immutable=1', uri=True,
+                               pragmas=misc.LIBRARY_PRAGMAS)
+        elif read_only:
+            self.database.init(misc.file_to_uri(filename) + '?mode=ro', uri=True)
+        else:
+            self.database.init(filename)
+        self.settings_cache.clear()
+        self.rate_graphs.clear()
+        with self.compiled_analyses_lock:
+            self.compiled_analyses_generation += 1
+            self.compiled_analyses.clear()
         # Set current database filename
         self.database_filename = filename
+        self.read_only = read_only
         # Enable foreign key support for sqlite database
         self.database.execute_sql('PRAGMA foreign_keys=ON;')
+        # Search index is built per connection on first search
+        if not read_only:
+            self.remove_stored_search_index()
 
         return True
 
@@ -777,16 +1351,23 @@ class ScheduleDatabase:
         # Try to open database and check database compatibility
         try:
             connection = sqlite3.connect(filename)
-            cursor = connection.cursor()
-            cursor.execute('''SELECT value FROM ProjectTable where key="file_version"''')
-            proj_version = cursor.fetchone()
-
-            if proj_version[0] > misc.PROJECT_FILE_VER:
-                return [False, "Newer project file version found. Please use the latest application version."]
-            elif proj_version[0] == 'GESTIMATOR_FILE_REFERENCE_VER_1':
-                self.migrate_from_ver_1(filename)
-                cursor.execute('''UPDATE ProjectTable SET value = ? WHERE key = "file_version"''', (misc.PROJECT_FILE_VER,))
-                connection.commit()
+            try:
+                cursor = connection.cursor()
+                cursor.execute('''SELECT value FROM ProjectTable where key="file_version"''')
+                proj_version = cursor.fetchone()
+
+                if proj_version[0] > misc.PROJECT_FILE_VER:
+                    return [False, "Newer project file version found. Please use the latest application version."]
+                elif proj_version[0] in ('GESTIMATOR_FILE_REFERENCE_VER_1', 'GESTIMATOR_FILE_REFERENCE_VER_2',
+                                         'GESTIMATOR_FILE_REFERENCE_VER_3'):
+                    if proj_version[0] == 'GESTIMATOR_FILE_REFERENCE_VER_1':
+                        self.migrate_from_ver_1(filename)
+                    if proj_version[0] in ('GESTIMATOR_FILE_REFERENCE_VER_1', 'GESTIMATOR_FILE_REFERENCE_VER_2'):
+                        self.migrate_from_ver_2(filename)
+                    self.migrate_from_ver_3(filename)
+                    cursor.execute('''UPDATE ProjectTable SET value = ? WHERE key = "file_version"''', (misc.PROJECT_FILE_VER,))
+                    connection.commit()
+            finally:
                 connection.close()
         except:
             return [False, 'Error validating file. unknown/corrupt file.']
@@ -807,10 +1388,45 @@ class ScheduleDatabase:
 
         log.info('ScheduleDatabase - database migrated - ' + filename)
 
+    def migrate_from_ver_2(self, filename):
+        """Move measurement stored as project setting into measurement tables"""
+        log.info('ScheduleDatabase - migrate_from_ver_2 called - ' + filename)
+
+        # Open database with its own models
+        migrator = ScheduleDatabase(None)
+        migrator.database.init(filename)
+        migrator.setup_measurement_tables()
+        migrator.database.close()
+
+        log.info('ScheduleDatabase - database migrated - ' + filename)
+
+    def migrate_from_ver_3(self, filename):
+        """Add composite indexes used for listing items and reading analysis of rates"""
+        log.info('ScheduleDatabase - migrate_from_ver_3 called - ' + filename)
+
+        # Open database
+        my_db = peewee.SqliteDatabase(filename)
+        migrator = SqliteMigrator(my_db)
+
+        with my_db.transaction():
+            migrate(migrator.add_index('scheduletable', ('category_id', 'parent_id', 'order'), False),
+                    migrator.add_index('scheduletable', ('parent_id', 'suborder'), False),
+                    migrator.add_index('resourcetable', ('category_id', 'order'), False),
+                    migrator.add_index('sequencetable', ('id_sch_id', 'itemtype'), False),
+                    migrator.add_index('resourceitemtable', ('id_sch_id', 'id_seq_id'), False))
+        my_db.close()
+
+        log.info('ScheduleDatabase - database migrated - ' + filename)
+
     def close_database(self):
 
         self.database.close()
         self.database_filename = None
+        self.settings_cache.clear()
+        self.rate_graphs.clear()
+        with self.compiled_analyses_lock:
+            self.compiled_analyses_generation += 1
+            self.compiled_analyses.clear()
 
     def get_database_name(self):
         return self.database_filename
@@ -822,9 +1438,8 @@ class ScheduleDatabase:
             ret_code = self.validate_database(filename)
             if ret_code[0] == True:
                 # Add library
-                library = peewee.SqliteDatabase(filename)
-                with self.Using(library, [self.ProjectTable]):
-                    name = self.get_project_settings()['project_name']
+                library = open_library(filename)
+                name = library.get_project_settings()['project_name']
                 log.info('ScheduleDatabase - add_library - library added - ' + name)
             else:
                 log.error('ScheduleDatabase - add_library - Error validating file')
@@ -835,20 +1450,22 @@ class ScheduleDatabase:
         self.libraries[name] = library
         return True
 
-    def using_library(self, name):
-        """Return context manager for using database name"""
-        tables = [self.ProjectTable, self.ScheduleTable, self.ResourceTable,
-                  self.ScheduleCategoryTable, self.ResourceCategoryTable,
-                  self.SequenceTable, self.ResourceItemTable]
+    def get_library_names(self):
+        return list(self.libraries.keys())
 
+    def get_library_reader(self, name):
+        """Return read only database of library with its own models, safe to use from worker threads"""
         if name in self.libraries:
-            return self.Using(self.libraries[name], tables)
+            reader = self.libraries[name]
+            if self.search_index_dir and reader.search_index_filename is None:
+                filename = reader.get_database_name()
+                path_hash = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()[0:8]
+                reader.search_index_filename = os.path.join(self.search_index_dir,
+                    os.path.basename(filename) + '.' + path_hash + '.search')
+            return reader
         else:
             return None
 
-    def get_library_names(self):
-        return list(self.libraries.keys())
-
     def bulk_modify_analysis_draft(self):
         """ Draft function for manual manipulation of database"""
         sch_table = self.get_item_table(flat=True)
@@ -901,8 +1518,9 @@ class ScheduleDatabase:
         if codes == None:
             codes = self.get_item_table(flat=True).keys()
 
-        for code in codes:
-            sch_item = self.get_item(code, modify_res_code=False)
+        sch_items = self.get_items(codes, modify_res_code=False)
+
+        for code, sch_item in sch_items.items():
             if sch_item.ana_items and len(sch_item.ana_items) > 1:
                 for slno, item in enumerate(sch_item.ana_items):
                     if item['itemtype'] == ScheduleItemModel.ANA_GROUP:
@@ -944,64 +1562,195 @@ class ScheduleDatabase:
     ## Project settings
 
     def get_project_settings(self):
-        with self.database.atomic():
-            items = self.ProjectTable.select()
-            settings = dict()
-            for item in items:
-                settings[item.key] = item.value
-            return settings
+        """Get project settings of the bound database
+
+            Settings are cached per bound database.
+        """
+        bound_database = self.ProjectTable._meta.database
+        if bound_database not in self.settings_cache:
+            with self.database.atomic():
+                items = self.ProjectTable.select()
+                settings = dict()
+                for item in items:
+                    settings[item.key] = item.value
+            self.settings_cache[bound_database] = settings
+        return dict(self.settings_cache[bound_database])
+
+    def get_project_setting(self, key, default=None):
+        """Get a single project setting of the bound database"""
+        return self.get_project_settings().get(key, default)
 
     def set_project_settings(self, settings):
+        """Add or update project settings of the bound database"""
+        bound_database = self.ProjectTable._meta.database
         with self.database.atomic():
-            # Clear settings
-            self.ProjectTable.delete().execute()
-            # Add settings
-            for key, value in settings.items():
-                self.ProjectTable.create(key=key, value=value)
+            rows = [{'key': key, 'value': value} for key, value in settings.items()]
+            if rows:
+                self.ProjectTable.insert_many(rows).on_conflict_replace().execute()
+        # Invalidate cache
+        self.settings_cache.pop(bound_database, None)
 
     ## Measurements
 
-    def get_measurement(self):
-        settings = self.get_project_settings()
-        if 'project_measurement' in settings:
-            model = json.loads(settings['project_measurement'])
+    def setup_measurement_tables(self):
+        """Create measurement tables and migrate measurement stored as project setting"""
+        tables = [self.MeasurementItemTable, self.MeasurementRecordTable, self.MeasurementItemNoTable]
+        with self.database.atomic():
+            self.database.create_tables(tables, safe=True)
+            try:
+                item = self.ProjectTable.select().where(self.ProjectTable.key == 'project_measurement').get()
+            except self.ProjectTable.DoesNotExist:
+                return
+            model = json.loads(item.value)
+            if model[0] == 'Measurement':
+                self.ProjectTable.insert(key='project_measurement_caption', value=model[1][0]).on_conflict_replace().execute()
+                self.MeasurementItemTable.delete().execute()
+                for order, item_model in enumerate(model[1][1]):
+                    self.insert_measurement_rows(order, item_model)
+            item.delete_instance()
+        self.settings_cache.pop(self.ProjectTable._meta.database, None)
+        log.info('ScheduleDatabase - setup_measurement_tables - measurement migrated from project settings')
+
+    def get_measurement_fields(self, model):
+        """Return MeasurementItemTable fields of measurement item data model"""
+        if model[0] == 'MeasurementItemCustom':
+            data = model[1]
+            return {'itemtype': model[0], 'plugin': data[5], 'remark': data[2], 'user_data': json.dumps(data[4])}
         else:
-            # Handle missing field
-            model = json.loads(misc.default_project_settings['project_measurement'])
+            return {'itemtype': model[0], 'plugin': None, 'remark': model[1][0], 'user_data': None}
+
+    def insert_measurement_children(self, item_id, model):
+        """Insert record and itemno rows of measurement item data model"""
+        if model[0] == 'MeasurementItemCustom':
+            data = model[1]
+            records = [{'item': item_id, 'order': slno, 'data': json.dumps(record)}
+                       for slno, record in enumerate(data[1])]
+            itemnos = [{'item': item_id, 'slno': slno, 'itemno': itemno, 'remark': remark}
+                       for slno, (itemno, remark) in enumerate(zip(data[0], data[3]))]
+            if records:
+                self.MeasurementRecordTable.insert_many(records).execute()
+            if itemnos:
+                self.MeasurementItemNoTable.insert_many(itemnos).execute()
+
+    def insert_measurement_rows(self, order, model):
+        """Insert rows for measurement item data model at order without moving other items"""
+        item_id = self.MeasurementItemTable.insert(order=order, **self.get_measurement_fields(model)).execute()
+        self.insert_measurement_children(item_id, model)
+        return item_id
+
+    def get_measurement_models(self, item_rows):
+        """Return data models of measurement item rows"""
+        ids = [item_row.id for item_row in item_rows]
+        records = dict()
+        itemnos = dict()
+        if ids:
+            record_query = (self.MeasurementRecordTable
+                            .select(self.MeasurementRecordTable.item, self.MeasurementRecordTable.data)
+                            .where(self.MeasurementRecordTable.item << ids)
+                            .order_by(self.MeasurementRecordTable.order))
+            for (item_id, data) in record_query.tuples():
+                records.setdefault(item_id, []).append(json.loads(data))
+            itemno_query = (self.MeasurementItemNoTable
+                            .select(self.MeasurementItemNoTable.item, self.MeasurementItemNoTable.itemno,
+                                    self.MeasurementItemNoTable.remark)
+                            .where(self.MeasurementItemNoTable.item << ids)
+                            .order_by(self.MeasurementItemNoTable.slno))
+            for itemno in itemno_query.tuples():
+                itemnos.setdefault(itemno[0], []).append(itemno[1:])
+        models = []
+        for item_row in item_rows:
+            if item_row.itemtype == 'MeasurementItemCustom':
+                item_itemnos = itemnos.get(item_row.id, [])
+                data = [[itemno[0] for itemno in item_itemnos],
+                        records.get(item_row.id, []),
+                        item_row.remark,
+                        [itemno[1] for itemno in item_itemnos],
+                        json.loads(item_row.user_data),
+                        item_row.plugin]
+                models.append([item_row.itemtype, data])
+            else:
+                models.append([item_row.itemtype, [item_row.remark]])
+        return models
+
+    def get_measurement(self):
+        item_rows = list(self.MeasurementItemTable.select().order_by(self.MeasurementItemTable.order))
+        caption = self.get_project_setting('project_measurement_caption', '')
         meas = measurement.Measurement()
-        meas.set_model(model)
+        meas.set_model(['Measurement', [caption, self.get_measurement_models(item_rows)]])
         return meas
 
     def set_measurement(self, measurement):
-        # Get project settings and set measurement
-        settings = self.get_project_settings()
+        # Replace all measurement rows
         model = measurement.get_model()
-        settings['project_measurement'] = json.dumps(model)
-        self.set_project_settings(settings)
+        with self.database.atomic():
+            self.MeasurementItemTable.delete().execute()
+            for order, item_model in enumerate(model[1][1]):
+                self.insert_measurement_rows(order, item_model)
+        self.set_project_settings({'project_measurement_caption': model[1][0]})
+
+    def get_measurement_item(self, index):
+        """Return measurement item at index or None"""
+        try:
+            item_row = self.MeasurementItemTable.select().where(self.MeasurementItemTable.order == index).get()
+        except self.MeasurementItemTable.DoesNotExist:
+            return None
+        return measurement.get_item_from_model(self.get_measurement_models([item_row])[0])
+
+    def get_measurement_items(self, ids):
+        """Return measurement items with row ids as {id: (index, item)}"""
+        item_rows = list(self.MeasurementItemTable.select().where(self.MeasurementItemTable.id << list(ids)))
+        models = self.get_measurement_models(item_rows)
+        return {item_row.id: (item_row.order, measurement.get_item_from_model(model))
+                for item_row, model in zip(item_rows, models)}
+
+    def insert_measurement_item(self, index, item):
+        """Insert measurement item at index moving down items below"""
+        with self.database.atomic():
+            count = self.MeasurementItemTable.select().count()
+            index = min(index, count)
+            (self.MeasurementItemTable.update(order = self.MeasurementItemTable.order + 1)
+                .where(self.MeasurementItemTable.order >= index).execute())
+            self.insert_measurement_rows(index, item.get_model())
+        return index
+
+    def delete_measurement_item(self, index):
+        """Delete measurement item at index moving up items below"""
+        with self.database.atomic():
+            self.MeasurementItemTable.delete().where(self.MeasurementItemTable.order == index).execute()
+            (self.MeasurementItemTable.update(order = self.MeasurementItemTable.order - 1)
+                .where(self.MeasurementItemTable.order > index).execute())
+
+    def set_measurement_item(self, index, item):
+        """Replace measurement item at index"""
+        model = item.get_model()
+        with self.database.atomic():
+            try:
+                item_row = self.MeasurementItemTable.select().where(self.MeasurementItemTable.order == index).get()
+            except self.MeasurementItemTable.DoesNotExist:
+                log.warning('ScheduleDatabase - set_measurement_item - Item not found - ' + str(index))
+                return False
+            self.MeasurementItemTable.update(**self.get_measurement_fields(model)).where(self.MeasurementItemTable.id == item_row.id).execute()
+            self.MeasurementRecordTable.delete().where(self.MeasurementRecordTable.item == item_row.id).execute()
+            self.MeasurementItemNoTable.delete().where(self.MeasurementItemNoTable.item == item_row.id).execute()
+            self.insert_measurement_children(item_row.id, model)
+        return True
 
     @undoable
     def add_measurement_item_at_node(self, item, path):
         """Undoable function for adding a MeasurementItem to model"""
         if isinstance(item, measurement.MeasurementItem):
             delete_path = None
-            # Get measurement
-            meas = self.get_measurement()
 
             if path not in [None, []]:
                 if len(path) == 1: # if a measurement item selected
-                    meas.insert_item(path[0]+1, item)
-                    delete_path = [path[0]+1]
+                    delete_path = [self.insert_measurement_item(path[0]+1, item)]
             else: # if path is None append at top
-                meas.insert_item(0, item)
-                delete_path = [0]
-
-            # Set measurement
-            self.set_measurement(meas)
+                delete_path = [self.insert_measurement_item(0, item)]
 
             yield "Add Measurement item at '{}'".format(path)
             # Undo action
             if delete_path != None:
-                self.delete_row_meas(delete_path)
+                self.delete_measurement_item(delete_path[0])
         else:
             log.warning('add_measurement_item_at_node - Wrong model loaded')
             return
@@ -1010,22 +1759,12 @@ class ScheduleDatabase:
     def edit_measurement_item(self, path, newval, oldval):
         """Undoable function for editing a MeasurementItem in model"""
         if len(path) == 1 and isinstance(newval, measurement.MeasurementItem) and isinstance(oldval, measurement.MeasurementItem):
-            # Get measurement
-            meas = self.get_measurement()
-            # Set edited value
-            meas[path[0]] = newval
-            # Set measurement
-            self.set_measurement(meas)
+            self.set_measurement_item(path[0], newval)
 
         yield "Edit measurement items at '{}'".format(path)
         # Undo action
         if len(path) == 1 and isinstance(newval, measurement.MeasurementItem) and isinstance(oldval, measurement.MeasurementItem):
-            # Get measurement
-            meas = self.get_measurement()
-            # Set edited value
-            meas[path[0]] = oldval
-            # Set measurement
-            self.set_measurement(meas)
+            self.set_measurement_item(path[0], oldval)
 
     @undoable
     def delete_row_meas(self, path):
@@ -1033,18 +1772,14 @@ class ScheduleDatabase:
         item = None
 
         if len(path) == 1:
-            # Get measurement
-            meas = self.get_measurement()
-            # Delete value
-            item = meas[path[0]]
-            meas.remove_item(path[0])
-            # Set measurement
-            self.set_measurement(meas)
+            item = self.get_measurement_item(path[0])
+            if item is not None:
+                self.delete_measurement_item(path[0])
 
         yield "Delete measurement items at '{}'".format(path)
         # Undo action
         if len(path) == 1 and item:
-            self.add_measurement_item_at_node(item, path)
+            self.insert_measurement_item(path[0], item)
 
     @undoable
     def update_qty(self, codes=None, rounding='Round to 0'):
@@ -1076,6 +1811,127 @@ class ScheduleDatabase:
                     sch_row.save()
 
 
+    ## Ordering keys
+
+    def get_order_key(self, field, where, index=None):
+        """Get ordering key for a row to be inserted at index among rows selected by where
+
+            Schedule and resource rows are ordered by sparse keys so that a row
+            can be inserted or moved without renumbering its neighbours. Returns
+            [key, index] where index is limited to the number of rows and is
+            appended at end if None. key is None if there is no room between
+            the neighbouring keys.
+        """
+        query = field.model.select(field).where(where).order_by(field)
+        before = None
+        after = None
+        if index is not None and index <= 0:
+            index = 0
+            after = query.limit(1).scalar()
+        else:
+            keys = []
+            if index is not None:
+                keys = [key for (key,) in query.offset(index-1).limit(2).tuples()]
+            if keys:
+                before = keys[0]
+                after = keys[1] if len(keys) == 2 else None
+            else:
+                # Append after last row
+                index = query.count()
+                before = field.model.select(peewee.fn.MAX(field)).where(where).scalar()
+
+        return [self.get_key_between(before, after), index]
+
+    @staticmethod
+    def get_key_between(before, after):
+        """Get ordering key between keys before and after, either of which may be None
+
+            Returns None if there is no room between keys.
+        """
+        if before is None and after is None:
+            return misc.ORDER_KEY_GAP
+        elif after is None:
+            return before + misc.ORDER_KEY_GAP
+        elif before is None:
+            return after - misc.ORDER_KEY_GAP
+        elif after - before > 1:
+            return (before + after) // 2
+        else:
+            return None
+
+    def get_order_index(self, field, where, key):
+        """Get index of row with ordering key among rows selected by where"""
+        return field.model.select().where(where & (field < key)).count()
+
+    def rebalance_order_keys(self, field, where):
+        """Spread ordering keys of rows selected by where evenly
+
+            Returns dict of row id to new key of rows whose key was changed.
+        """
+        model = field.model
+        changed = dict()
+        query = model.select(model.id, field).where(where).order_by(field, model.id).tuples()
+        for slno, (row_id, key) in enumerate(query):
+            if key != (slno+1)*misc.ORDER_KEY_GAP:
+                changed[row_id] = (slno+1)*misc.ORDER_KEY_GAP
+        rows = [model(id=row_id, **{field.name: key}) for row_id, key in changed.items()]
+        if rows:
+            model.bulk_update(rows, fields=[field], batch_size=misc.INSERT_BATCH_ROWS)
+            log.info('ScheduleDatabase - rebalance_order_keys - keys rebalanced - ' + str(len(rows)))
+        return changed
+
+    def get_schedule_order_key(self, category_id, index=None):
+        """Get order key for a schedule item inserted at index of category"""
+        where = (self.ScheduleTable.category == category_id) & (self.ScheduleTable.parent == None)
+        [key, index] = self.get_order_key(self.ScheduleTable.order, where, index)
+        if key is None:
+            # Sub items share order key of their parent
+            changed = self.rebalance_order_keys(self.ScheduleTable.order, where)
+            for parent_id, key in changed.items():
+                self.ScheduleTable.update(order = key).where(self.ScheduleTable.parent == parent_id).execute()
+            [key, index] = self.get_order_key(self.ScheduleTable.order, where, index)
+        return [key, index]
+
+    def get_schedule_suborder_key(self, parent_id, index=None):
+        """Get suborder key for a sub item inserted at index under parent"""
+        where = (self.ScheduleTable.parent == parent_id)
+        [key, index] = self.get_order_key(self.ScheduleTable.suborder, where, index)
+        if key is None:
+            self.rebalance_order_keys(self.ScheduleTable.suborder, where)
+            [key, index] = self.get_order_key(self.ScheduleTable.suborder, where, index)
+        return [key, index]
+
+    def get_resource_order_key(self, category_id, index=None, exclude=None):
+        """Get order key for a resource inserted at index of category, ignoring resource id exclude"""
+        where = (self.ResourceTable.category == category_id)
+        if exclude is not None:
+            where = where & (self.ResourceTable.id != exclude)
+        [key, index] = self.get_order_key(self.ResourceTable.order, where, index)
+        if key is None:
+            self.rebalance_order_keys(self.ResourceTable.order, where)
+            [key, index] = self.get_order_key(self.ResourceTable.order, where, index)
+        return [key, index]
+
+    def get_schedule_item_at(self, category_id, index):
+        """Get top level schedule item at index of category"""
+        items = []
+        if index >= 0:
+            # get() would reset the offset
+            items = list(self.ScheduleTable.select()
+                         .where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.parent == None))
+                         .order_by(self.ScheduleTable.order).limit(1).offset(index))
+        if not items:
+            raise self.ScheduleTable.DoesNotExist
+        return items[0]
+
+    def get_schedule_item_path(self, sch):
+        """Get [category, item, sub item] indices of schedule item from its ordering keys"""
+        top_where = (self.ScheduleTable.category == sch.category_id) & (self.ScheduleTable.parent == None)
+        path = [sch.category.order, self.get_order_index(self.ScheduleTable.order, top_where, sch.order)]
+        if sch.parent_id is not None:
+            path.append(self.get_order_index(self.ScheduleTable.suborder, self.ScheduleTable.parent == sch.parent_id, sch.suborder))
+        return path
+
     ## Resource category methods
 
     def get_resource_categories(self):
@@ -1141,6 +1997,7 @@ class ScheduleDatabase:
 
     def delete_resource_category_atomic(self, category_name):
         """Delete resource category"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             try:
                 old_item = self.ResourceCategoryTable.select().where(self.ResourceCategoryTable.description == category_name).get()
@@ -1190,7 +2047,7 @@ class ScheduleDatabase:
                                      reference = item.reference,
                                      category = item.category.description)
 
-    def get_resource_table(self, category = None, flat=False, modify_code=False):
+    def get_resource_table(self, category = None, flat=False, modify_code=False, codes=None):
         with self.database.atomic():
             res = OrderedDict()
             proj_code = self.get_project_settings()['project_resource_code']
@@ -1235,6 +2092,8 @@ class ScheduleDatabase:
                     res_cat = self.ResourceTable.select().where(self.ResourceTable.category == category_model.id).order_by(self.ResourceTable.order)
                 else:
                     res_cat = self.ResourceTable.select().order_by(self.ResourceTable.order)
+                if codes is not None:
+                    res_cat = res_cat.where(self.ResourceTable.code << list(codes))
                 for item in res_cat:
                     if modify_code and len(item.code.split(':')) == 1:
                         code = proj_code + ':' + item.code
@@ -1252,6 +2111,21 @@ class ScheduleDatabase:
 
             return res
 
+    def get_resource_layout(self):
+        """Get [(category, [code, ...]), ...] of resources in display order"""
+        with self.database.atomic():
+            layout = OrderedDict()
+            categories = self.ResourceCategoryTable.select(self.ResourceCategoryTable.id, self.ResourceCategoryTable.description).order_by(self.ResourceCategoryTable.order).tuples()
+            for (category_id, category_name) in categories:
+                layout[category_id] = (category_name if category_name else 'UNCATEGORISED', [])
+            items = (self.ResourceTable.select(self.ResourceTable.category, self.ResourceTable.code)
+                     .join(self.ResourceCategoryTable)
+                     .order_by(self.ResourceCategoryTable.order, self.ResourceTable.order)
+                     .tuples())
+            for (category_id, code) in items:
+                layout[category_id][1].append(code)
+            return list(layout.values())
+
     def get_res_library_codes(self):
         """Get unique library codes in the resource list"""
         with self.database.atomic():
@@ -1297,10 +2171,11 @@ class ScheduleDatabase:
 
     def delete_resource_item_atomic(self, code):
         """Delete schedule item"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             try:
                 old_item = self.ResourceTable.select().where(self.ResourceTable.code == code).get()
-                old_order = old_item.order
+                old_order = self.get_order_index(self.ResourceTable.order, self.ResourceTable.category == old_item.category_id, old_item.order)
                 old_category_order = old_item.category.order
 
                 if old_order > 0:
@@ -1309,8 +2184,6 @@ class ScheduleDatabase:
                     old_res_path = [old_category_order]
 
                 old_item.delete_instance()
-                # Update order values
-                self.ResourceTable.update(order = self.ResourceTable.order - 1).where((self.ResourceTable.category == old_item.category.id) & (self.ResourceTable.order > old_order)).execute()
             except self.ResourceTable.DoesNotExist:
                 return False
 
@@ -1331,6 +2204,7 @@ class ScheduleDatabase:
 
     def delete_resource_atomic(self, selected):
         """Delete resource elements"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             unique_codes = set()
             unique_cats = set()
@@ -1379,6 +2253,7 @@ class ScheduleDatabase:
                     self.delete_resource_category(code)
 
     def insert_resource_atomic(self, resource, path=None):
+        self.invalidate_rate_graph()
         with self.database.atomic():
 
             res_category_added = None
@@ -1394,12 +2269,10 @@ class ScheduleDatabase:
                 category_id = category.id
                 if len(path) == 1:
                     # Add as first item of category
-                    order = 0
-                    self.ResourceTable.update(order = self.ResourceTable.order + 1).where(self.ResourceTable.category == category_id).execute()
+                    [order_key, order] = self.get_resource_order_key(category_id, 0)
                 if len(path) == 2:
                     # Add after selected item
-                    order = path[1] + 1
-                    self.ResourceTable.update(order = self.ResourceTable.order + 1).where((self.ResourceTable.order >= order) & (self.ResourceTable.category == category_id)).execute()
+                    [order_key, order] = self.get_resource_order_key(category_id, path[1] + 1)
 
             # If path not specified
             else:
@@ -1412,14 +2285,14 @@ class ScheduleDatabase:
                     category = self.ResourceCategoryTable.select().where(self.ResourceCategoryTable.description == category_name).get()
                     category_id = category.id
                     # Append at end of category
-                    order = self.ResourceTable.select().where(self.ResourceTable.category == category_id).count()
+                    [order_key, order] = self.get_resource_order_key(category_id)
                 except self.ResourceCategoryTable.DoesNotExist:
                     # Add new category at end and add item under it
                     if self.insert_resource_category_atomic(category_name, path=[-1]) is not None:
                         category = self.ResourceCategoryTable.select().where(self.ResourceCategoryTable.description == category_name).get()
                         category_id = category.id
                         res_category_added = category_name
-                        order = 0
+                        [order_key, order] = self.get_resource_order_key(category_id)
                     else:
                         log.error('ScheduleDatabase - insert_resource - category could not be set - ' + str(category_name))
                         return False
@@ -1432,7 +2305,7 @@ class ScheduleDatabase:
                                 discount = resource.discount,
                                 reference = resource.reference,
                                 category = category_id,
-                                order = order)
+                                order = order_key)
 
             path_added = [category.order, order]
 
@@ -1515,20 +2388,15 @@ class ScheduleDatabase:
                 yield False
                 return
 
-            old_order = res.order
             old_category_id = res.category.id
             old_category_order = res.category.order
+            old_order = self.get_order_index(self.ResourceTable.order, self.ResourceTable.category == old_category_id, res.order)
             new_order = path[1]+1 if len(path) == 2 else 0
             if new_category_id == old_category_id and old_order < new_order:
                 new_order = new_order - 1
 
-            # Remove resource from old path
-            self.ResourceTable.update(order = self.ResourceTable.order - 1).where((self.ResourceTable.category == old_category_id) & (self.ResourceTable.order > old_order)).execute()
-
-            # Add at new path
-            self.ResourceTable.update(order = self.ResourceTable.order + 1).where((self.ResourceTable.category == new_category_id) & (self.ResourceTable.order >= new_order)).execute()
-
-            res.order = new_order
+            # Move to new path without disturbing other resources
+            [res.order, new_order] = self.get_resource_order_key(new_category_id, new_order, exclude=res.id)
             res.category = new_category_id
 
             res.save()
@@ -1585,13 +2453,13 @@ class ScheduleDatabase:
                         order = res.order
                     # If there is a change in category, recalculate order
                     else:
-                        order = self.ResourceTable.select().where(self.ResourceTable.category == category_id).count()
+                        [order, index] = self.get_resource_order_key(category_id)
                 except:
                     # Add new category at end and add resource under it
                     if self.insert_resource_category_atomic(res_model.category, path=[-1]) is not None:
                         category = self.ResourceCategoryTable.select().where(self.ResourceCategoryTable.description == res_model.category).get()
                         category_id = category.id
-                        order = 0
+                        [order, index] = self.get_resource_order_key(category_id)
                     else:
                         log.error('ScheduleDatabase - update_resource - category could not be set - ' + str(category_name))
                         return False
@@ -1618,6 +2486,11 @@ class ScheduleDatabase:
                 log.error('ScheduleDatabase - update_resource - Error saving resource')
                 return False
 
+            if column in (3, 4, 5):
+                self.mark_rates_dirty([code])
+            elif column == 0 or res_model:
+                self.invalidate_rate_graph()
+
         yield "Update resource '{}'".format(str(code)), True
 
         with self.database.atomic():
@@ -1777,8 +2650,7 @@ class ScheduleDatabase:
         with self.database.atomic():
             if databasename in self.get_library_names():
                 undodict = dict()
-                with self.using_library(databasename):
-                    res_new = self.get_resource_table(flat=True, modify_code=True)
+                res_new = self.get_library_reader(databasename).get_resource_table(flat=True, modify_code=True)
                 ress = self.ResourceTable.select()
                 for res in ress:
                     if res.code in res_new:
@@ -1788,6 +2660,7 @@ class ScheduleDatabase:
                         res.discount = res_new[res.code][5]
                         res.reference = res_new[res.code][6]
                         res.save()
+                self.mark_rates_dirty(undodict.keys())
 
         yield "Update rates from database:'{}'".format(databasename)
 
@@ -1868,6 +2741,7 @@ class ScheduleDatabase:
 
     def delete_schedule_category_atomic(self, category_name):
         """Delete resource category"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             try:
                 old_item = self.ScheduleCategoryTable.select().where(self.ScheduleCategoryTable.description == category_name).get()
@@ -1895,61 +2769,120 @@ class ScheduleDatabase:
     ## Schedule item methods
 
     def get_item(self, code, modify_res_code=True, copy_ana=True):
-        with self.database.atomic():
-            try:
-                item = self.ScheduleTable.select().where(self.ScheduleTable.code == code).get()
-            except self.ScheduleTable.DoesNotExist:
-                return None
+        return self.get_items([code], modify_res_code, copy_ana).get(code)
 
-            res_models = dict()
-            proj_code = self.get_project_settings()['project_resource_code']
-            parent = None
-            if item.parent:
-                try:
-                    parent_item = self.ScheduleTable.select().where(self.ScheduleTable.id == item.parent).get()
-                    parent = parent_item.code
-                except self.ScheduleTable.DoesNotExist:
-                    log.warning('ScheduleDatabase - get_item - Parent not found for ' + code)
-            sch_model = ScheduleItemModel(code = item.code,
-                                          description = item.description,
-                                          unit = item.unit,
-                                          rate = item.rate,
-                                          qty = item.qty,
-                                          remarks = item.remarks,
-                                          ana_remarks = item.ana_remarks,
-                                          category = item.category.description,
-                                          parent = parent,
-                                          colour = item.colour)
+    def get_items(self, codes, modify_res_code=True, copy_ana=True):
+        """Get schedule item models for a list of codes
+
+            Items are loaded using a fixed number of joined queries irrespective
+            of the number of codes. Returns an OrderedDict of code to
+            ScheduleItemModel in the order of codes, skipping codes not found.
+        """
+        sch_models = OrderedDict()
+        codes = list(codes)
+        if not codes:
+            return sch_models
+
+        with self.database.atomic():
+            # Get schedule items along with categories
+            items = dict()
+            query = (self.ScheduleTable.select(self.ScheduleTable, self.ScheduleCategoryTable)
+                     .join(self.ScheduleCategoryTable, peewee.JOIN.LEFT_OUTER)
+                     .where(self.ScheduleTable.code << codes))
+            for item in query:
+                items[item.code] = item
+            if not items:
+                return sch_models
+
+            # Get parent codes
+            parent_ids = set(item.parent_id for item in items.values() if item.parent_id is not None)
+            parent_codes = dict()
+            if parent_ids:
+                parents = (self.ScheduleTable.select(self.ScheduleTable.id, self.ScheduleTable.code)
+                           .where(self.ScheduleTable.id << list(parent_ids)).tuples())
+                parent_codes = dict(parents)
 
             if copy_ana:
-                for seq in item.sequences:
-                    if seq.itemtype == ScheduleItemModel.ANA_GROUP:
-                        ress = self.ResourceItemTable.select().where(self.ResourceItemTable.id_sch == item.id
-                                                                and self.ResourceItemTable.id_seq == seq.id)
-                        res_list = []
-                        for res in ress:
-                            # If already derived item retain code
-                            if modify_res_code == False or len((res.id_res.code).split(':')) > 1 or proj_code == '':
-                                mod_code = res.id_res.code
-                            # Modify code
-                            else:
-                                mod_code = proj_code + ':' + res.id_res.code
-                            res_list.append([mod_code, res.qty, res.remarks])
-                            res_model = self.get_resource(res.id_res.code)
-                            res_model.code = mod_code  # Modify resource code
-                            res_models[mod_code] = res_model
-                        sch_model.add_ana_group(seq.description, res_list, seq.code)
-                    elif seq.itemtype == ScheduleItemModel.ANA_SUM:
-                        sch_model.add_ana_sum(seq.description)
-                    elif seq.itemtype == ScheduleItemModel.ANA_WEIGHT:
-                        sch_model.add_ana_weight(seq.description, seq.value)
-                    elif seq.itemtype == ScheduleItemModel.ANA_TIMES:
-                        sch_model.add_ana_times(seq.description, seq.value)
-                    elif seq.itemtype == ScheduleItemModel.ANA_ROUND:
-                        sch_model.add_ana_round(seq.description, seq.value)
-                sch_model.resources = res_models
-                sch_model.evaluate_results()
-            return sch_model
+                proj_code = self.get_project_settings()['project_resource_code']
+                item_ids = [item.id for item in items.values()]
+
+                # Get analysis sequences of all items
+                sequences = dict()
+                seqs = (self.SequenceTable.select()
+                        .where(self.SequenceTable.id_sch << item_ids)
+                        .order_by(self.SequenceTable.id_sch, self.SequenceTable.id_seq))
+                for seq in seqs:
+                    sequences.setdefault(seq.id_sch_id, []).append(seq)
+
+                # Get resource items of all items along with resources and categories
+                resource_items = dict()
+                ress = (self.ResourceItemTable.select(self.ResourceItemTable, self.ResourceTable, self.ResourceCategoryTable)
+                        .join(self.ResourceTable)
+                        .join(self.ResourceCategoryTable, peewee.JOIN.LEFT_OUTER)
+                        .where(self.ResourceItemTable.id_sch << item_ids)
+                        .order_by(self.ResourceItemTable.id))
+                for res in ress:
+                    resource_items.setdefault(res.id_seq_id, []).append(res)
+
+            for code in codes:
+                if code not in items or code in sch_models:
+                    continue
+                item = items[code]
+
+                parent = None
+                if item.parent_id is not None:
+                    if item.parent_id in parent_codes:
+                        parent = parent_codes[item.parent_id]
+                    else:
+                        log.warning('ScheduleDatabase - get_items - Parent not found for ' + code)
+                category = item.category.description if item.category else None
+                sch_model = ScheduleItemModel(code = item.code,
+                                              description = item.description,
+                                              unit = item.unit,
+                                              rate = item.rate,
+                                              qty = item.qty,
+                                              remarks = item.remarks,
+                                              ana_remarks = item.ana_remarks,
+                                              category = category,
+                                              parent = parent,
+                                              colour = item.colour)
+
+                if copy_ana:
+                    res_models = dict()
+                    for seq in sequences.get(item.id, []):
+                        if seq.itemtype == ScheduleItemModel.ANA_GROUP:
+                            res_list = []
+                            for res in resource_items.get(seq.id, []):
+                                resource = res.id_res
+                                # If already derived item retain code
+                                if modify_res_code == False or len((resource.code).split(':')) > 1 or proj_code == '':
+                                    mod_code = resource.code
+                                # Modify code
+                                else:
+                                    mod_code = proj_code + ':' + resource.code
+                                res_list.append([mod_code, res.qty, res.remarks])
+                                res_category = resource.category.description if resource.category else None
+                                res_models[mod_code] = ResourceItemModel(code = mod_code,
+                                                                         description = resource.description,
+                                                                         unit = resource.unit,
+                                                                         rate = resource.rate,
+                                                                         vat = resource.vat,
+                                                                         discount = resource.discount,
+                                                                         reference = resource.reference,
+                                                                         category = res_category)
+                            sch_model.add_ana_group(seq.description, res_list, seq.code)
+                        elif seq.itemtype == ScheduleItemModel.ANA_SUM:
+                            sch_model.add_ana_sum(seq.description)
+                        elif seq.itemtype == ScheduleItemModel.ANA_WEIGHT:
+                            sch_model.add_ana_weight(seq.description, seq.value)
+                        elif seq.itemtype == ScheduleItemModel.ANA_TIMES:
+                            sch_model.add_ana_times(seq.description, seq.value)
+                        elif seq.itemtype == ScheduleItemModel.ANA_ROUND:
+                            sch_model.add_ana_round(seq.description, seq.value)
+                    sch_model.resources = res_models
+                    sch_model.evaluate_results()
+                sch_models[code] = sch_model
+            return sch_models
 
     def get_item_key(self, code):
         with self.database.atomic():
@@ -1968,7 +2901,7 @@ class ScheduleDatabase:
             return item.code
 
 
-    def get_item_table(self, category = None, flat=False):
+    def get_item_table(self, category = None, flat=False, codes=None):
         with self.database.atomic():
             sch_table = OrderedDict()
 
@@ -1982,21 +2915,30 @@ class ScheduleDatabase:
                 else:
                     categories = self.ScheduleCategoryTable.select().order_by(self.ScheduleCategoryTable.order)
 
+                cat_dicts = dict()
                 for category in categories:
                     cat_dict = OrderedDict()
-                    items = self.ScheduleTable.select().where((self.ScheduleTable.category == category.id) & (self.ScheduleTable.parent == None)).order_by(self.ScheduleTable.order)
-                    for item in items:
-                        child_list = []
-                        parent_list = [item.code, item.description, item.unit, item.rate, item.qty, item.remarks, item.colour]
-                        children = self.ScheduleTable.select().where(self.ScheduleTable.parent == item.id).order_by(self.ScheduleTable.suborder)
-                        for child in children:
-                            child_list.append([child.code, child.description, child.unit,
-                                          child.rate, child.qty, child.remarks, child.colour])
-                        cat_dict[item.code] = (parent_list, child_list,)
+                    cat_dicts[category.id] = cat_dict
                     category_name = category.description
                     if category_name is None or category_name == '':
                         category_name = 'UNCATEGORISED'
                     sch_table[category_name] = cat_dict
+
+                # Read all items and sub items in two queries
+                fields = [self.ScheduleTable.id, self.ScheduleTable.code, self.ScheduleTable.description,
+                          self.ScheduleTable.unit, self.ScheduleTable.rate, self.ScheduleTable.qty,
+                          self.ScheduleTable.remarks, self.ScheduleTable.colour]
+                children = dict()
+                child_rows = (self.ScheduleTable.select(self.ScheduleTable.parent, *fields)
+                              .where(self.ScheduleTable.parent != None)
+                              .order_by(self.ScheduleTable.parent, self.ScheduleTable.suborder).tuples())
+                for (parent_id, item_id, *child_list) in child_rows:
+                    children.setdefault(parent_id, []).append(child_list)
+                items = (self.ScheduleTable.select(self.ScheduleTable.category, *fields)
+                         .where((self.ScheduleTable.category << list(cat_dicts)) & (self.ScheduleTable.parent == None))
+                         .order_by(self.ScheduleTable.order).tuples())
+                for (category_id, item_id, *parent_list) in items:
+                    cat_dicts[category_id][parent_list[0]] = (parent_list, children.get(item_id, []),)
             else:
                 if category is not None:
                     try:
@@ -2007,6 +2949,8 @@ class ScheduleDatabase:
                     items = self.ScheduleTable.select().where(self.ScheduleTable.category == category_model.id).order_by(self.ScheduleTable.order, self.ScheduleTable.suborder)
                 else:
                     items = self.ScheduleTable.select().join(self.ScheduleCategoryTable).order_by(self.ScheduleCategoryTable.order, self.ScheduleTable.order, self.ScheduleTable.suborder)
+                if codes is not None:
+                    items = items.where(self.ScheduleTable.code << list(codes))
 
                 for item in items:
                     item_list = [item.code, item.description, item.unit,
@@ -2016,26 +2960,136 @@ class ScheduleDatabase:
 
             return sch_table
 
+    def get_item_layout(self):
+        """Get [(category, [(code, is_sub_item), ...]), ...] of schedule items in display order"""
+        with self.database.atomic():
+            layout = OrderedDict()
+            categories = self.ScheduleCategoryTable.select(self.ScheduleCategoryTable.id, self.ScheduleCategoryTable.description).order_by(self.ScheduleCategoryTable.order).tuples()
+            for (category_id, category_name) in categories:
+                layout[category_id] = (category_name if category_name else 'UNCATEGORISED', [])
+            items = (self.ScheduleTable.select(self.ScheduleTable.category, self.ScheduleTable.code, self.ScheduleTable.parent)
+                     .join(self.ScheduleCategoryTable)
+                     .order_by(self.ScheduleCategoryTable.order, self.ScheduleTable.order, self.ScheduleTable.suborder)
+                     .tuples())
+            for (category_id, code, parent_id) in items:
+                layout[category_id][1].append((code, parent_id is not None))
+            return list(layout.values())
+
+    ## Rate dependency graph
+
+    def get_rate_graph(self):
+        """Get rate dependency graph of bound database"""
+        bound_database = self.ScheduleTable._meta.database
+        if bound_database not in self.rate_graphs:
+            with self.database.atomic():
+                sch_codes = set(code for (code,) in self.ScheduleTable.select(self.ScheduleTable.code).tuples())
+                edges = (self.ResourceItemTable.select(self.ScheduleTable.code, self.ResourceTable.code)
+                         .join(self.ScheduleTable, on=(self.ResourceItemTable.id_sch == self.ScheduleTable.id))
+                         .switch(self.ResourceItemTable)
+                         .join(self.ResourceTable, on=(self.ResourceItemTable.id_res == self.ResourceTable.id))
+                         .tuples())
+                self.rate_graphs[bound_database] = RateGraph(sch_codes, edges)
+        return self.rate_graphs[bound_database]
+
+    def invalidate_rate_graph(self):
+        """Discard rate dependency graph and compiled analysis on change of analysis structure"""
+        bound_database = self.ScheduleTable._meta.database
+        self.rate_graphs.pop(bound_database, None)
+        with self.compiled_analyses_lock:
+            self.compiled_analyses_generation += 1
+            self.compiled_analyses.pop(bound_database, None)
+
+    def mark_rates_dirty(self, res_codes):
+        """Mark sub analysis items affected by change in resource rates"""
+        bound_database = self.ScheduleTable._meta.database
+        if bound_database in self.rate_graphs:
+            self.rate_graphs[bound_database].mark_dirty(res_codes)
+
+    def get_compiled_analysis(self):
+        """Get analysis of rates of all items of bound database in compiled form
+
+            May be called from worker threads. An analysis built while the cache
+            is invalidated is returned but not cached.
+        """
+        bound_database = self.ScheduleTable._meta.database
+        with self.compiled_analyses_lock:
+            analysis = self.compiled_analyses.get(bound_database)
+            generation = self.compiled_analyses_generation
+        if analysis is None:
+            with self.database.atomic():
+                res_codes = dict(self.ResourceTable.select(self.ResourceTable.id, self.ResourceTable.code).tuples())
+                analysis = CompiledAnalysis(res_codes.values())
+
+                # Resource lists of sequences
+                resource_lists = dict()
+                ress = (self.ResourceItemTable.select(self.ResourceItemTable.id_seq, self.ResourceItemTable.id_res, self.ResourceItemTable.qty)
+                        .order_by(self.ResourceItemTable.id).tuples())
+                for id_seq, id_res, qty in ress:
+                    resource_lists.setdefault(id_seq, []).append([res_codes[id_res], qty])
+
+                # Analysis items of schedule items
+                ana_items = OrderedDict()
+                seqs = (self.SequenceTable.select(self.ScheduleTable.code, self.SequenceTable.id, self.SequenceTable.itemtype, self.SequenceTable.value)
+                        .join(self.ScheduleTable)
+                        .order_by(self.SequenceTable.id_sch, self.SequenceTable.id_seq).tuples())
+                for code, id_seq, itemtype, value in seqs:
+                    ana_items.setdefault(code, []).append({'itemtype': itemtype,
+                                                           'value': value,
+                                                           'resource_list': resource_lists.get(id_seq, [])})
+                for code, items in ana_items.items():
+                    analysis.add_item(code, items)
+            with self.compiled_analyses_lock:
+                if generation == self.compiled_analyses_generation:
+                    self.compiled_analyses[bound_database] = analysis
+        return analysis
+
+    def get_resource_rates(self, codes=None):
+        """Get dict of resource code to [rate, vat, discount]"""
+        with self.database.atomic():
+            query = self.ResourceTable.select(self.ResourceTable.code, self.ResourceTable.rate,
+                                              self.ResourceTable.vat, self.ResourceTable.discount)
+            if codes is not None:
+                query = query.where(self.ResourceTable.code << list(codes))
+            return {code: [rate, vat, discount] for code, rate, vat, discount in query.tuples()}
+
+    def get_analysed_rates(self, codes=None):
+        """Evaluate analysis of items in a single pass
+
+            Returns dict of code to (stored_rate, analysed_rate, has_analysis)
+        """
+        with self.database.atomic():
+            query = self.ScheduleTable.select(self.ScheduleTable.code, self.ScheduleTable.rate)
+            if codes is not None:
+                query = query.where(self.ScheduleTable.code << list(codes))
+            stored_rates = query.tuples()
+
+            analysis = self.get_compiled_analysis()
+            rates = analysis.get_rate_vector(self.get_resource_rates())
+            analysed_rates = dict()
+            for code, rate in stored_rates:
+                if code in analysis.items:
+                    analysed_rates[code] = (rate, analysis.evaluate(code, rates), True)
+                else:
+                    analysed_rates[code] = (rate, None, False)
+            return analysed_rates
+
     def get_sub_ana_items(self, codes, modify_res_code=False):
         proj_code = self.get_project_settings()['project_resource_code']
-        subcodes = dict()
+        subcodes = OrderedDict()
 
-        for index in range(0, misc.SUB_ANA_SEARCH_DEPTH):
-            for code in codes:
-                item = self.get_item(code, modify_res_code=False, copy_ana=True)
-                if item:
-                    for res_code in item.resources:
-                        res_mod_code = proj_code + ':' + res_code
-                        sub_ana_item = self.get_item(res_code, modify_res_code=True, copy_ana=True)
-                        if sub_ana_item:
-                            if modify_res_code:
-                                sub_ana_item.code = res_mod_code
-                            else:
-                                sub_ana_item.code = res_code
-                            sub_ana_item.parent = None
-                            sub_ana_item.category = misc.SUB_ANA_TITLE
-                            subcodes[res_code] = sub_ana_item
-            codes = list(subcodes.keys())
+        if codes is None:
+            codes = self.get_item_table(flat=True).keys()
+
+        sub_codes = self.get_rate_graph().get_dependencies(codes)
+        sub_ana_items = self.get_items(sub_codes, modify_res_code=True, copy_ana=True)
+        for res_code, sub_ana_item in sub_ana_items.items():
+            if modify_res_code:
+                sub_ana_item.code = proj_code + ':' + res_code
+            else:
+                sub_ana_item.code = res_code
+            sub_ana_item.parent = None
+            sub_ana_item.category = misc.SUB_ANA_TITLE
+            subcodes[res_code] = sub_ana_item
 
         return subcodes.values()
 
@@ -2046,63 +3100,59 @@ class ScheduleDatabase:
         with self.database.atomic():
             old_rates = dict()
             old_rates_res = dict()
-            sub_ana_rates_dict = dict()
+            # Updated rates of sub analysis items
+            sub_ana_rates = dict()
 
             if codes is None:
-                sch_rows = self.ScheduleTable.select()
+                codes = [code for (code,) in self.ScheduleTable.select(self.ScheduleTable.code).tuples()]
             else:
-                sch_rows = self.ScheduleTable.select().where(self.ScheduleTable.code << codes)
-
-            # Save schedule rates
-            for sch_row in sch_rows:
-                old_rates[sch_row.code] = sch_row.rate
-
-            # Update item rates for sub ana items
-            for index in range(0, misc.SUB_ANA_SEARCH_DEPTH):
-                sub_ana_items = self.get_sub_ana_items(codes)
-                for item in sub_ana_items:
-                    try:
-                        sch_row = self.ScheduleTable.select().where(self.ScheduleTable.code == item.code).get()
-                        res_row = self.ResourceTable.select().where(self.ResourceTable.code == item.code).get()
-                    except self.ScheduleTable.DoesNotExist:
-                        continue
-
-                    if sch_row and res_row:
-                        # Save sub analysis schedule and resource rates
-                        if index == 0:
-                            if sch_row.code not in old_rates:
-                                old_rates[sch_row.code] = sch_row.rate
-                            old_rates_res[res_row.code] = res_row.rate
-                        # Update rates
-                        item.update_rate()
-                        sch_row.rate = item.rate
-                        res_row.rate = item.rate
-                        sch_row.save()
-                        res_row.save()
-
-            # Update item rates
-            for sch_row in sch_rows:
-                item = self.get_item(sch_row.code)
-                item.update_rate()
-                sch_row.rate = item.rate
-                sch_row.save()
+                codes = list(codes)
+
+            # Sub analysis items to be updated in topological order
+            graph = self.get_rate_graph()
+            sub_codes = [code for code in graph.get_dependencies(codes) if code in graph.dirty]
+
+            # Save schedule and sub analysis resource rates
+            sch_rows = self.ScheduleTable.select(self.ScheduleTable.code, self.ScheduleTable.rate).where(self.ScheduleTable.code << (sub_codes + codes))
+            for code, rate in sch_rows.tuples():
+                old_rates[code] = rate
+            resources = self.get_resource_rates()
+            for code in sub_codes:
+                old_rates_res[code] = resources[code][0]
+
+            # Evaluate sub analysis items followed by selected items
+            analysis = self.get_compiled_analysis()
+            rates = analysis.get_rate_vector(resources)
+            new_rates = dict()
+            for code in sub_codes:
+                rate = analysis.evaluate(code, rates)
+                if rate is None:
+                    rate = old_rates[code]
+                [res_rate, vat, discount] = resources[code]
+                analysis.set_rate(rates, code, rate, vat, discount)
+                sub_ana_rates[code] = rate
+                new_rates[code] = rate
+            for code in codes:
+                rate = analysis.evaluate(code, rates)
+                if rate is not None and code in old_rates:
+                    new_rates[code] = rate
+
+            # Save modified rates
+            for code, rate in new_rates.items():
+                if old_rates[code] != rate:
+                    self.ScheduleTable.update(rate=rate).where(self.ScheduleTable.code == code).execute()
+            for code, rate in sub_ana_rates.items():
+                if old_rates_res[code] != rate:
+                    self.ResourceTable.update(rate=rate).where(self.ResourceTable.code == code).execute()
+            graph.mark_clean(sub_ana_rates.keys())
 
         yield "Update schedule item rates", True
 
         with self.database.atomic():
-            if codes is None:
-                sch_rows = self.ScheduleTable.select()
-                res_rows = self.ResourceTable.select().where(self.ResourceTable.code << list(old_rates_res.keys()))
-            else:
-                sch_rows = self.ScheduleTable.select().where(self.ScheduleTable.code << list(old_rates.keys()))
-                res_rows = self.ResourceTable.select().where(self.ResourceTable.code << list(old_rates_res.keys()))
-
-            for sch_row in sch_rows:
-                sch_row.rate = old_rates[sch_row.code]
-                sch_row.save()
-            for res_row in res_rows:
-                res_row.rate = old_rates_res[res_row.code]
-                res_row.save()
+            for code, rate in old_rates.items():
+                self.ScheduleTable.update(rate=rate).where(self.ScheduleTable.code == code).execute()
+            for code, rate in old_rates_res.items():
+                self.ResourceTable.update(rate=rate).where(self.ResourceTable.code == code).execute()
 
     @undoable
     def update_item_schedule(self, code, value, col):
@@ -2138,6 +3188,11 @@ class ScheduleDatabase:
             except:
                 return False
 
+            if col == 0:
+                self.invalidate_rate_graph()
+            elif col == 3:
+                self.mark_rates_dirty([code])
+
         yield "Update schedule item '{}'".format(str(code)), True
 
         with self.database.atomic():
@@ -2220,7 +3275,205 @@ class ScheduleDatabase:
         """Updates schedule item i/c analysis"""
         return self.insert_item(sch_model, path=None, update=True)
 
+    def get_derived_res_code(self, code, local_res_code=None):
+        """Get code of resource prefixed with local_res_code if not a library resource"""
+        if local_res_code is not None and len(code.split(':')) == 1:
+            return local_res_code + '.' + code
+        return code
+
+    def insert_resources_missing_atomic(self, ress):
+        """Add resources not in database at end of their categories
+
+            ress is an OrderedDict of code to ResourceItemModel. Returns
+            [res_ids, ress_added] where res_ids maps codes of ress to resource
+            ids and ress_added maps paths to codes of resources and categories
+            added, or False with all changes rolled back if a category could
+            not be set.
+        """
+        res_ids = dict()
+        ress_added = OrderedDict()
+        if not ress:
+            return [res_ids, ress_added]
+
+        with self.database.atomic() as transaction:
+            res_ids = dict(self.ResourceTable.select(self.ResourceTable.code, self.ResourceTable.id)
+                           .where(self.ResourceTable.code << list(ress.keys())).tuples())
+            new_codes = [code for code in ress if code not in res_ids]
+            if not new_codes:
+                return [res_ids, ress_added]
+
+            self.invalidate_rate_graph()
+            categories = dict()
+            for category_id, description, order in self.ResourceCategoryTable.select(self.ResourceCategoryTable.id,
+                    self.ResourceCategoryTable.description, self.ResourceCategoryTable.order).tuples():
+                categories[description] = (category_id, order)
+            orders = dict()
+            for category_id, count, key in (self.ResourceTable.select(self.ResourceTable.category,
+                    peewee.fn.COUNT(self.ResourceTable.id), peewee.fn.MAX(self.ResourceTable.order))
+                    .group_by(self.ResourceTable.category).tuples()):
+                orders[category_id] = (count, key)
+            rows = []
+            for code in new_codes:
+                res = ress[code]
+                res_category_added = None
+                if res.category is None or res.category == '':
+                    category_name = 'UNCATEGORISED'
+                else:
+                    category_name = res.category
+                if category_name not in categories:
+                    # Add new category at end
+                    category_order = self.insert_resource_category_atomic(category_name, path=[-1])
+                    if category_order is False:
+                        log.error('ScheduleDatabase - insert_resources_missing_atomic - category could not be set - ' + str(category_name))
+                        transaction.rollback()
+                        return False
+                    category_id = (self.ResourceCategoryTable.select(self.ResourceCategoryTable.id)
+                                   .where(self.ResourceCategoryTable.description == category_name).scalar())
+                    categories[category_name] = (category_id, category_order)
+                    res_category_added = category_name
+                (category_id, category_order) = categories[category_name]
+                (order, key) = orders.get(category_id, (0, 0))
+                orders[category_id] = (order + 1, key + misc.ORDER_KEY_GAP)
+                rows.append({'code': code,
+                             'description': res.description,
+                             'unit': res.unit,
+                             'rate': res.rate,
+                             'vat': res.vat,
+                             'discount': res.discount,
+                             'reference': res.reference,
+                             'category': category_id,
+                             'order': key + misc.ORDER_KEY_GAP})
+                ress_added[(category_order, order)] = code
+                if res_category_added:
+                    ress_added[(category_order,)] = res_category_added
+
+            for batch in peewee.chunked(rows, misc.INSERT_BATCH_ROWS):
+                self.ResourceTable.insert_many(batch).execute()
+            res_ids.update(self.ResourceTable.select(self.ResourceTable.code, self.ResourceTable.id)
+                           .where(self.ResourceTable.code << new_codes).tuples())
+            return [res_ids, ress_added]
+
+    def insert_analysis_rows_atomic(self, analyses, res_ids, local_res_code=None):
+        """Write sequences and resource items of analysis of rates in batches
+
+            analyses is a list of (schedule item id, ScheduleItemModel) of items
+            without analysis rows and res_ids maps derived resource codes to ids.
+        """
+        self.invalidate_rate_graph()
+        with self.database.atomic():
+            # Add sequences
+            rows = []
+            for sch_id, item in analyses:
+                for slno, anaitem in enumerate(item.ana_items):
+                    itemtype = anaitem['itemtype']
+                    if itemtype == ScheduleItemModel.ANA_GROUP:
+                        value = None
+                        seq_code = anaitem['code']
+                    elif itemtype == ScheduleItemModel.ANA_SUM:
+                        value = None
+                        seq_code = None
+                    elif itemtype in (ScheduleItemModel.ANA_WEIGHT, ScheduleItemModel.ANA_TIMES, ScheduleItemModel.ANA_ROUND):
+                        value = anaitem['value']
+                        seq_code = None
+                    else:
+                        continue
+                    rows.append({'id_seq': slno,
+                                 'id_sch': sch_id,
+                                 'itemtype': itemtype,
+                                 'value': value,
+                                 'code': seq_code,
+                                 'description': anaitem['description']})
+            if not rows:
+                return
+            for batch in peewee.chunked(rows, misc.INSERT_BATCH_ROWS):
+                self.SequenceTable.insert_many(batch).execute()
+
+            # Add resource items against ids of added sequences
+            seq_ids = dict()
+            query = (self.SequenceTable.select(self.SequenceTable.id_sch, self.SequenceTable.id_seq, self.SequenceTable.id)
+                     .where(self.SequenceTable.id_sch << [sch_id for sch_id, item in analyses]).tuples())
+            for id_sch, id_seq, seq_id in query:
+                seq_ids[(id_sch, id_seq)] = seq_id
+            rows = []
+            for sch_id, item in analyses:
+                for slno, anaitem in enumerate(item.ana_items):
+                    if anaitem['itemtype'] == ScheduleItemModel.ANA_GROUP:
+                        for resource in anaitem['resource_list']:
+                            res_code = self.get_derived_res_code(item.resources[resource[0]].code, local_res_code)
+                            rows.append({'id_sch': sch_id,
+                                         'id_seq': seq_ids[(sch_id, slno)],
+                                         'id_res': res_ids[res_code],
+                                         'qty': resource[1],
+                                         'remarks': resource[2]})
+            for batch in peewee.chunked(rows, misc.INSERT_BATCH_ROWS):
+                self.ResourceItemTable.insert_many(batch).execute()
+
+    def get_analysis_resources(self, items, local_res_code=None):
+        """Get OrderedDict of derived code to ResourceItemModel of resources used in analysis of items"""
+        ress = OrderedDict()
+        for item in items:
+            for anaitem in item.ana_items:
+                if anaitem['itemtype'] == ScheduleItemModel.ANA_GROUP:
+                    for resource in anaitem['resource_list']:
+                        res_item = item.resources[resource[0]]
+                        ress.setdefault(self.get_derived_res_code(res_item.code, local_res_code), res_item)
+        return ress
+
+    def import_analyses(self, items):
+        """Replace analysis of rates of existing schedule items in a single transaction
+
+            Schedule items and resources are looked up with set based queries and
+            analysis rows are written in batches. Resources not in the database are
+            added. Only the analysis of rates and analysis remarks of schedule items
+            are modified. Returns an OrderedDict of item code to True if analysis is
+            imported and False if code is not found, or False with all changes
+            rolled back on error.
+        """
+        items = OrderedDict((item.code, item) for item in items)
+        results = OrderedDict((code, False) for code in items)
+        if not items:
+            return results
+
+        self.invalidate_rate_graph()
+        with self.database.atomic() as transaction:
+            # Get ids of schedule items
+            sch_ids = OrderedDict()
+            found = dict(self.ScheduleTable.select(self.ScheduleTable.code, self.ScheduleTable.id)
+                         .where(self.ScheduleTable.code << list(items.keys())).tuples())
+            for code in items:
+                if code in found:
+                    sch_ids[code] = found[code]
+                    results[code] = True
+            if not sch_ids:
+                return results
+
+            # Get resources used in analysis, adding those not in database
+            ress = self.get_analysis_resources(items[code] for code in sch_ids)
+            ret = self.insert_resources_missing_atomic(ress)
+            if ret is False:
+                log.error('ScheduleDatabase - import_analyses - resources could not be added')
+                transaction.rollback()
+                return False
+            [res_ids, ress_added] = ret
+            if ress_added:
+                log.info('ScheduleDatabase - import_analyses - resources added - ' + str(len(ress_added)))
+
+            # Delete old analysis items
+            ids = list(sch_ids.values())
+            self.ResourceItemTable.delete().where(self.ResourceItemTable.id_sch << ids).execute()
+            self.SequenceTable.delete().where(self.SequenceTable.id_sch << ids).execute()
+
+            # Update analysis remarks
+            schs = [self.ScheduleTable(id=sch_id, ana_remarks=items[code].ana_remarks) for code, sch_id in sch_ids.items()]
+            self.ScheduleTable.bulk_update(schs, fields=[self.ScheduleTable.ana_remarks], batch_size=misc.INSERT_BATCH_ROWS)
+
+            # Add new analysis items
+            self.insert_analysis_rows_atomic([(sch_id, items[code]) for code, sch_id in sch_ids.items()], res_ids)
+
+        return results
+
     def insert_item_atomic(self, item, path=None, update=False, number_with_path=False, local_res_code=None):
+        self.invalidate_rate_graph()
         with self.database.atomic():
             sch_category_added = None
             code = item.code
@@ -2287,7 +3540,9 @@ class ScheduleDatabase:
                 # Insert at last position of category and parent
                 if path is None:
                     if parent_id:
-                        order = parent.order
+                        order = self.get_order_index(self.ScheduleTable.order,
+                                                     (self.ScheduleTable.category == parent.category_id) & (self.ScheduleTable.parent == None),
+                                                     parent.order)
                         suborder = len(parent.children)
                         # Setup path
                         if suborder == 0:
@@ -2313,74 +3568,74 @@ class ScheduleDatabase:
 
                 # If category selected, add as first item
                 if len(path) == 1:
-                    order = 0
+                    [order_key, order] = self.get_schedule_order_key(category_id, 0)
+                    suborder_key = None
                     suborder = None
                     parent_id = None
                     # Modify code according to path
                     if number_with_path:
                         code = self.get_next_item_code(near_item_code=str(path[0]+1),
                                                                 nextlevel=True)
-                    self.ScheduleTable.update(order = self.ScheduleTable.order + 1).where(self.ScheduleTable.category == category_id).execute()
 
                 # If item selected, add next or under
                 elif len(path) == 2:
 
                     try:
-                        selected_item = self.ScheduleTable.select().where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.order == path[1]) & (self.ScheduleTable.suborder == None)).get()
+                        selected_item = self.get_schedule_item_at(category_id, path[1])
                     except:
                         log.error('ScheduleDatabase - insert_item - selected item could not be found for ' + str(path))
                         return False
 
                     # Add under
                     if selected_item.unit == '' and item.parent is not None:
+                        order_key = selected_item.order
                         order = path[1]
-                        suborder = 0
+                        [suborder_key, suborder] = self.get_schedule_suborder_key(selected_item.id, 0)
                         parent_id = selected_item.id
                         # Modify code according to path
                         if number_with_path:
                             code = self.get_next_item_code(near_item_code=selected_item.code,
                                                                     nextlevel=True)
-                        self.ScheduleTable.update(suborder = self.ScheduleTable.suborder + 1).where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.order == order)  & (self.ScheduleTable.suborder != None)).execute()
 
                     # Add next
                     else:
-                        order = path[1]+1
+                        [order_key, order] = self.get_schedule_order_key(category_id, path[1]+1)
+                        suborder_key = None
                         suborder = None
                         parent_id = None
                         # Modify code according to path
                         if number_with_path:
                             code = self.get_next_item_code(near_item_code=selected_item.code,
                                                                     nextlevel=False)
-                        self.ScheduleTable.update(order = self.ScheduleTable.order + 1).where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.order >= order)).execute()
 
                 # If subitem selected, add next
                 elif len(path) == 3:
 
                     try:
-                        parent_item = self.ScheduleTable.select().where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.order == path[1]) & (self.ScheduleTable.suborder == None)).get()
+                        parent_item = self.get_schedule_item_at(category_id, path[1])
                     except:
                         log.error('ScheduleDatabase - insert_item - parent item could not be found for ' + str(path))
                         return False
 
                     # Add as next element
                     if item.parent is not None:
+                        order_key = parent_item.order
                         order = path[1]
-                        suborder = path[2]+1
+                        [suborder_key, suborder] = self.get_schedule_suborder_key(parent_item.id, path[2]+1)
                         parent_id = parent_item.id
                         if number_with_path:
                             code = self.get_next_item_code(near_item_code=parent_item.code,
                                                            nextlevel=True, shift=path[2]+1)
-                        self.ScheduleTable.update(suborder = self.ScheduleTable.suborder + 1).where((self.ScheduleTable.suborder >= suborder) & (self.ScheduleTable.order == order) & (self.ScheduleTable.category == category_id)).execute()
                     # Add as next element of parent
                     else:
-                        order = path[1]+1
+                        [order_key, order] = self.get_schedule_order_key(category_id, path[1]+1)
+                        suborder_key = None
                         suborder = None
                         parent_id = None
                         # Modify code according to path
                         if number_with_path:
                             code = self.get_next_item_code(near_item_code=parent_item.code,
                                                                     nextlevel=False)
-                        self.ScheduleTable.update(order = self.ScheduleTable.order + 1).where((self.ScheduleTable.category == category_id) & (self.ScheduleTable.order >= order)).execute()
 
                 # Setup new schedule item
                 sch = self.ScheduleTable(code = code,
@@ -2392,13 +3647,13 @@ class ScheduleDatabase:
                                     ana_remarks = item.ana_remarks,
                                     category = category_id,
                                     parent = parent_id,
-                                    order = order,
-                                    suborder = suborder,
+                                    order = order_key,
+                                    suborder = suborder_key,
                                     colour = item.colour)
 
-                path_added = [sch.category.order, sch.order]
-                if sch.suborder is not None:
-                    path_added.append(sch.suborder)
+                path_added = [category.order, order]
+                if suborder is not None:
+                    path_added.append(suborder)
 
             try:
                 sch.save()
@@ -2519,28 +3774,271 @@ class ScheduleDatabase:
             # Delete resources
             self.delete_resource_atomic(ress_added)
 
+    def get_schedule_layout(self):
+        """Get layout of schedule items for positioning items in Python
+
+            Returns [categories, nodes] where categories is a list in order of
+            dicts with keys id, description and items, nodes maps item codes to
+            dicts with keys id, code, unit, position, key, category, parent and
+            children and items and children are lists of nodes in order.
+            position holds the stored (order, suborder) and key the ordering key
+            of the node among its siblings.
+        """
+        categories = []
+        category_ids = dict()
+        for category_id, description in (self.ScheduleCategoryTable.select(self.ScheduleCategoryTable.id, self.ScheduleCategoryTable.description)
+                                         .order_by(self.ScheduleCategoryTable.order).tuples()):
+            category_ids[category_id] = len(categories)
+            categories.append({'id': category_id, 'description': description, 'items': []})
+
+        nodes = dict()
+        node_ids = dict()
+        subitems = []
+        query = (self.ScheduleTable.select(self.ScheduleTable.id, self.ScheduleTable.code, self.ScheduleTable.unit,
+                                           self.ScheduleTable.category, self.ScheduleTable.parent,
+                                           self.ScheduleTable.order, self.ScheduleTable.suborder)
+                 .order_by(self.ScheduleTable.order, self.ScheduleTable.suborder).tuples())
+        for sch_id, code, unit, category_id, parent_id, order, suborder in query:
+            node = {'id': sch_id, 'code': code, 'unit': unit, 'position': (order, suborder),
+                    'key': order if parent_id is None else suborder,
+                    'category': None, 'parent': None, 'children': []}
+            nodes[code] = node
+            node_ids[sch_id] = node
+            if parent_id is not None:
+                subitems.append((parent_id, node))
+            elif category_id in category_ids:
+                node['category'] = categories[category_ids[category_id]]
+                node['category']['items'].append(node)
+        for parent_id, node in subitems:
+            if parent_id in node_ids:
+                parent = node_ids[parent_id]
+                node['category'] = parent['category']
+                node['parent'] = parent
+                parent['children'].append(node)
+        return [categories, nodes]
+
+    @staticmethod
+    def set_layout_key(nodes, index):
+        """Set ordering key of node at index of list of layout nodes between its neighbours
+
+            Keys of all nodes of the list are spread evenly if there is no room.
+        """
+        before = nodes[index-1]['key'] if index > 0 else None
+        after = nodes[index+1]['key'] if index+1 < len(nodes) else None
+        key = ScheduleDatabase.get_key_between(before, after)
+        if key is None:
+            for slno, node in enumerate(nodes):
+                node['key'] = (slno+1)*misc.ORDER_KEY_GAP
+        else:
+            nodes[index]['key'] = key
+
+    @staticmethod
+    def get_layout_index(nodes, node):
+        """Get index of node in list of layout nodes searching from end"""
+        for index in range(len(nodes)-1, -1, -1):
+            if nodes[index] is node:
+                return index
+        return None
+
     def insert_item_multiple_atomic(self, items, path=None, number_with_path=False, preserve_structure=False, local_res_code=None):
-        """Function to add multiple schedule items into schedule"""
-        with self.database.atomic():
+        """Function to add multiple schedule items into schedule
+
+            Positions and ordering keys of all items are worked out in Python
+            following insert_item_atomic. Existing rows are only updated when
+            their keys are spread for want of room and new rows are written
+            in batches. Returns [items_added, net_ress_added] or False with
+            all changes rolled back if resources could not be added.
+        """
+        self.invalidate_rate_graph()
+        with self.database.atomic() as transaction:
             items_added = OrderedDict()
             net_ress_added = OrderedDict()
+            [categories, nodes] = self.get_schedule_layout()
+            category_names = dict((category['description'], category) for category in categories)
+            changed_categories = []
+            added = []
+            new_codes = set()
 
             for item in items:
-                ret = self.insert_item_atomic(item, path=path, number_with_path=number_with_path, local_res_code=local_res_code)
-                if ret:
-                    [code_added, path_added, category_added, ress_added] = ret
+                category_added = None
 
-                    if category_added is not None:
-                        items_added[(path_added[0],)] = category_added
+                # Get category and parent if path not specified
+                if path is None:
+                    if item.category is None or item.category == '':
+                        category_name = 'UNCATEGORISED'
+                    else:
+                        category_name = item.category
+                    if category_name not in category_names:
+                        # Add new category at end
+                        if self.insert_schedule_category_atomic(category_name, path=[-1]) is False:
+                            log.error('ScheduleDatabase - insert_item_multiple_atomic - Category could not be set - ' + str(category_name))
+                            continue
+                        category_id = (self.ScheduleCategoryTable.select(self.ScheduleCategoryTable.id)
+                                       .where(self.ScheduleCategoryTable.description == category_name).scalar())
+                        category_names[category_name] = {'id': category_id, 'description': category_name, 'items': []}
+                        categories.append(category_names[category_name])
+                        category_added = category_name
+                    category = category_names[category_name]
+                    category_order = self.get_layout_index(categories, category)
+
+                    parent = None
+                    if item.parent is not None:
+                        parent = nodes.get(item.parent)
+                        if parent is None:
+                            log.warning('ScheduleDatabase - insert_item_multiple_atomic - Parent not found for ' + str(item.code))
+
+                    # Insert at last position of category and parent
+                    if parent and parent['category']:
+                        order = self.get_layout_index(parent['category']['items'], parent['parent'] or parent)
+                        if len(parent['children']) == 0:
+                            item_path = [category_order, order]
+                        else:
+                            item_path = [category_order, order, len(parent['children'])-1]
+                    else:
+                        if len(category['items']) == 0:
+                            item_path = [category_order]
+                        else:
+                            item_path = [category_order, len(category['items'])-1]
+                else:
+                    item_path = path
 
-                    items_added[tuple(path_added)] = code_added
-                    net_ress_added.update(ress_added)
+                # Get category by path
+                if not 0 <= item_path[0] < len(categories):
+                    log.error('ScheduleDatabase - insert_item_multiple_atomic - category could not be found for ' + str(item_path))
+                    continue
+                category = categories[item_path[0]]
+                siblings = category['items']
+                code = item.code
+
+                # If category selected, add as first item
+                if len(item_path) == 1:
+                    parent = None
+                    index = 0
+                    if number_with_path:
+                        code = self.get_next_item_code(near_item_code=str(item_path[0]+1), nextlevel=True, reserved=new_codes)
 
-                    if not preserve_structure:
-                        # Update path
-                        path = path_added
+                # If item selected, add next or under
+                elif len(item_path) == 2:
+                    if not 0 <= item_path[1] < len(siblings):
+                        log.error('ScheduleDatabase - insert_item_multiple_atomic - selected item could not be found for ' + str(item_path))
+                        continue
+                    selected_item = siblings[item_path[1]]
+                    # Add under
+                    if selected_item['unit'] == '' and item.parent is not None:
+                        parent = selected_item
+                        index = 0
+                        if number_with_path:
+                            code = self.get_next_item_code(near_item_code=selected_item['code'], nextlevel=True, reserved=new_codes)
+                    # Add next
+                    else:
+                        parent = None
+                        index = item_path[1]+1
+                        if number_with_path:
+                            code = self.get_next_item_code(near_item_code=selected_item['code'], nextlevel=False, reserved=new_codes)
+
+                # If subitem selected, add next
+                elif len(item_path) == 3:
+                    if not 0 <= item_path[1] < len(siblings):
+                        log.error('ScheduleDatabase - insert_item_multiple_atomic - parent item could not be found for ' + str(item_path))
+                        continue
+                    parent_item = siblings[item_path[1]]
+                    # Add as next element
+                    if item.parent is not None:
+                        parent = parent_item
+                        index = item_path[2]+1
+                        if number_with_path:
+                            code = self.get_next_item_code(near_item_code=parent_item['code'], nextlevel=True, shift=item_path[2]+1, reserved=new_codes)
+                    # Add as next element of parent
+                    else:
+                        parent = None
+                        index = item_path[1]+1
+                        if number_with_path:
+                            code = self.get_next_item_code(near_item_code=parent_item['code'], nextlevel=False, reserved=new_codes)
+
+                if code in nodes:
+                    log.warning('ScheduleDatabase - insert_item_multiple_atomic - Item code exists, Item not added - ' + str(code))
+                    continue
+
+                # Add item to layout
+                node = {'id': None, 'code': code, 'unit': item.unit, 'position': None, 'key': None,
+                        'category': category, 'parent': parent, 'children': [],
+                        'new_parent': bool(parent and parent['id'] is None)}
+                if parent:
+                    parent['children'].insert(index, node)
+                    index = min(index, len(parent['children'])-1)
+                    self.set_layout_key(parent['children'], index)
+                    path_added = [item_path[0], item_path[1], index]
                 else:
-                    log.error("ScheduleDatabase - insert_item_multiple_atomic - item not added - Code:'{}', Path:'{}'".format(item.code, path))
+                    siblings.insert(index, node)
+                    index = min(index, len(siblings)-1)
+                    self.set_layout_key(siblings, index)
+                    path_added = [item_path[0], index]
+                nodes[code] = node
+                new_codes.add(code)
+                added.append((item, node))
+                if category not in changed_categories:
+                    changed_categories.append(category)
+
+                if category_added is not None:
+                    items_added[(path_added[0],)] = category_added
+                items_added[tuple(path_added)] = code
+
+                if not preserve_structure:
+                    # Update path
+                    path = path_added
+
+            if not added:
+                return [items_added, net_ress_added]
+
+            # Update keys of existing items spread for want of room
+            rows = []
+            for category in changed_categories:
+                for node in category['items']:
+                    positions = [(node, (node['key'], None))]
+                    positions += [(child, (node['key'], child['key'])) for child in node['children']]
+                    for child, position in positions:
+                        if child['id'] is not None and child['position'] != position:
+                            rows.append(self.ScheduleTable(id=child['id'], order=position[0], suborder=position[1]))
+                        child['position'] = position
+            if rows:
+                self.ScheduleTable.bulk_update(rows, fields=[self.ScheduleTable.order, self.ScheduleTable.suborder],
+                                               batch_size=misc.INSERT_BATCH_ROWS)
+
+            # Add items, parents before sub items
+            for subitems in (False, True):
+                rows = []
+                for item, node in added:
+                    parent = node['parent']
+                    if node['new_parent'] == subitems:
+                        rows.append({'code': node['code'],
+                                     'description': item.description,
+                                     'unit': item.unit,
+                                     'rate': item.rate,
+                                     'qty': item.qty,
+                                     'remarks': item.remarks,
+                                     'ana_remarks': item.ana_remarks,
+                                     'category': node['category']['id'],
+                                     'parent': parent['id'] if parent else None,
+                                     'order': node['position'][0],
+                                     'suborder': node['position'][1],
+                                     'colour': item.colour})
+                for batch in peewee.chunked(rows, misc.INSERT_BATCH_ROWS):
+                    self.ScheduleTable.insert_many(batch).execute()
+                codes = [row['code'] for row in rows]
+                for batch in peewee.chunked(codes, misc.INSERT_BATCH_ROWS):
+                    for code, sch_id in (self.ScheduleTable.select(self.ScheduleTable.code, self.ScheduleTable.id)
+                                         .where(self.ScheduleTable.code << batch).tuples()):
+                        nodes[code]['id'] = sch_id
+
+            # Add resources and analysis of rates
+            ress = self.get_analysis_resources([item for item, node in added], local_res_code)
+            ret = self.insert_resources_missing_atomic(ress)
+            if ret is False:
+                log.error('ScheduleDatabase - insert_item_multiple_atomic - resources could not be added')
+                transaction.rollback()
+                return False
+            [res_ids, net_ress_added] = ret
+            self.insert_analysis_rows_atomic([(node['id'], item) for item, node in added], res_ids, local_res_code)
 
             return [items_added, net_ress_added]
 
@@ -2549,7 +4047,11 @@ class ScheduleDatabase:
         """Undoable function to add multiple schedule items into schedule"""
 
         with self.database.atomic():
-            [items_added, net_ress_added] = self.insert_item_multiple_atomic(items, path, number_with_path, preserve_structure, local_res_code)
+            ret = self.insert_item_multiple_atomic(items, path, number_with_path, preserve_structure, local_res_code)
+        if ret is False:
+            yield "Add schedule items at path:'{}' failed".format(path), [OrderedDict(), OrderedDict()]
+            return
+        [items_added, net_ress_added] = ret
 
         yield "Add schedule items at path:'{}'".format(path), [items_added, net_ress_added]
 
@@ -2559,26 +4061,15 @@ class ScheduleDatabase:
 
     def delete_item_atomic(self, code):
         """Delete schedule item"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             try:
                 old_item = self.ScheduleTable.select().where(self.ScheduleTable.code == code).get()
-                old_category_order = old_item.category.order
-                old_order = old_item.order
-                old_suborder = old_item.suborder
+                path_added = self.get_schedule_item_path(old_item)
                 old_item.delete_instance()
-                # Update order values
-                if old_item.parent:
-                    parent_id = old_item.parent.id
-                    self.ScheduleTable.update(suborder = self.ScheduleTable.suborder - 1).where((self.ScheduleTable.suborder > old_suborder) & (self.ScheduleTable.parent == parent_id)).execute()
-                else:
-                    self.ScheduleTable.update(order = self.ScheduleTable.order - 1).where((self.ScheduleTable.category == old_item.category.id) & (self.ScheduleTable.order > old_order)).execute()
             except self.ScheduleTable.DoesNotExist:
                 return False
 
-            path_added = [old_category_order, old_order]
-            if old_suborder is not None:
-                path_added.append(old_suborder)
-
             return path_added
 
     @undoable
@@ -2608,6 +4099,7 @@ class ScheduleDatabase:
 
     def delete_schedule_atomic(self, selected):
         """Delete schedule elements"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             unique_cats = set()
             unique_parents = set()
@@ -2710,7 +4202,10 @@ class ScheduleDatabase:
             times_items = (self.SequenceTable.select(self.SequenceTable.id_sch, self.SequenceTable.value)
                                         .where(self.SequenceTable.itemtype == ScheduleItemModel.ANA_TIMES))
             for time_item in times_items:
-                times_values[time_item.id_sch.id] = time_item.value
+                times_values[time_item.id_sch_id] = time_item.value
+
+            # Get quantities of schedule items in one query instead of per resource item
+            sch_qtys = dict(self.ScheduleTable.select(self.ScheduleTable.id, self.ScheduleTable.qty).tuples())
 
             cats = self.ResourceCategoryTable.select().order_by(self.ResourceCategoryTable.order)
             for cat in cats:
@@ -2726,9 +4221,9 @@ class ScheduleDatabase:
                 for res_item in res_items:
                     code = res_item.id_res.code
                     res_qty = res_item.qty
-                    sch_qty = res_item.id_sch.qty if res_item.id_sch.qty else 0
-                    if res_item.id_sch.id in times_values:
-                        mult_factor = times_values[res_item.id_sch.id]
+                    sch_qty = sch_qtys.get(res_item.id_sch_id) or 0
+                    if res_item.id_sch_id in times_values:
+                        mult_factor = times_values[res_item.id_sch_id]
                     else:
                         mult_factor = 1
 
@@ -2750,6 +4245,7 @@ class ScheduleDatabase:
     @undoable
     def assign_auto_item_numbers(self):
         """Assign automatic item numbers to schedule items"""
+        self.invalidate_rate_graph()
 
         with self.database.atomic():
             # Change all items to prevent uniqueness errors
@@ -2767,12 +4263,21 @@ class ScheduleDatabase:
                     counter_cat += 1
 
             # Calculate and modify item codes
-            items = self.ScheduleTable.select(self.ScheduleTable, self.ScheduleCategoryTable).join(self.ScheduleCategoryTable).order_by(self.ScheduleTable.order, self.ScheduleTable.suborder)
+            items = (self.ScheduleTable.select(self.ScheduleTable, self.ScheduleCategoryTable).join(self.ScheduleCategoryTable)
+                     .order_by(self.ScheduleCategoryTable.order, self.ScheduleTable.order, self.ScheduleTable.suborder))
+            counter_items = dict()
+            counter_subitems = dict()
             for item in items:
+                # Number items in order of their ordering keys
+                if item.parent_id is None:
+                    counter_items[item.category_id] = counter_items.get(item.category_id, 0) + 1
+                    counter_subitems[item.category_id] = 0
+                else:
+                    counter_subitems[item.category_id] = counter_subitems.get(item.category_id, 0) + 1
                 # If sub-analysis skip renumber
                 if item.category.description != misc.SUB_ANA_TITLE:
                     code_cat = code_cat_dict[item.category.id]
-                    code_item = item.order + 1
+                    code_item = counter_items.get(item.category_id, 0)
 
                     if item.parent == None:
                         # If only one category reduce level of item numbering
@@ -2781,7 +4286,7 @@ class ScheduleDatabase:
                         else:
                             code = str(code_cat) + '.' + str(code_item)
                     else:
-                        code_subitem = item.suborder + 1
+                        code_subitem = counter_subitems[item.category_id]
                         # If only one category reduce level of item numbering
                         if len(code_cat_dict) == 1:
                             code = str(code_item) + '.' + str(code_subitem)
@@ -2811,6 +4316,7 @@ class ScheduleDatabase:
     @undoable
     def assign_auto_item_numbers_res(self, exclude):
         """Assign automatic item numbers to schedule items"""
+        self.invalidate_rate_graph()
         with self.database.atomic():
             # Change all items to prevent uniqueness errors
             self.ResourceTable.update(code = self.ResourceTable.code.concat('_')).execute()
@@ -2860,11 +4366,12 @@ class ScheduleDatabase:
                     item.code = undodict[mod_code]
                     item.save(only=[self.ResourceTable.code])
 
-    def get_next_item_code(self, near_item_code=None, nextlevel=False, shift=0):
+    def get_next_item_code(self, near_item_code=None, nextlevel=False, shift=0, reserved=()):
+        """Get code for a new item near near_item_code; codes in reserved are taken as used"""
         if near_item_code:
             if nextlevel:
                 new_code = near_item_code + '.' + str(1+shift)
-                if not self.ScheduleTable.select().where(self.ScheduleTable.code == new_code).exists():
+                if new_code not in reserved and not self.ScheduleTable.select().where(self.ScheduleTable.code == new_code).exists():
                     return new_code
             else:
                 parsed = misc.human_code(near_item_code)
@@ -2873,7 +4380,7 @@ class ScheduleDatabase:
                     new_code = ''
                     for part in new_code_parsed:
                         new_code = new_code + str(part)
-                    if not self.ScheduleTable.select().where(self.ScheduleTable.code == new_code).exists():
+                    if new_code not in reserved and not self.ScheduleTable.select().where(self.ScheduleTable.code == new_code).exists():
                         return new_code
 
         # Fall back
@@ -2886,8 +4393,8 @@ class ScheduleDatabase:
             shift = 0
 
         # Add exisitng default items
-        for sch in sch_items:
-            split_up = misc.human_code(sch.code)
+        for code in [sch.code for sch in sch_items] + [code for code in reserved if code.startswith('_')]:
+            split_up = misc.human_code(code)
             if len(split_up) == 2 and split_up[0] == '_' and type(split_up[-1]) is int:
                 code_list.append(split_up)
 
@@ -2921,37 +4428,116 @@ class ScheduleDatabase:
     ## Data correction functions
 
     def reorder_items(self):
-        """Performs reordering of all items in database to correct any insertion errors"""
+        """Performs reordering of all items in database to correct any insertion errors
+
+            Categories are numbered in order and ordering keys of schedule and
+            resource items are spread evenly leaving room for later inserts.
+        """
         with self.database.atomic():
             # Schedule items
             categories = self.ScheduleCategoryTable.select().order_by(self.ScheduleCategoryTable.order)
             for cat_id, category in enumerate(categories):
                 category.order = cat_id
-                items = self.ScheduleTable.select().where((self.ScheduleTable.category == category.id) & (self.ScheduleTable.parent == None)).order_by(self.ScheduleTable.order)
                 category.save()
-                for item_id, item in enumerate(items):
-                    item.order = item_id
-                    item.suborder = None
-                    item.save()
-                    children = self.ScheduleTable.select().where(self.ScheduleTable.parent == item.id).order_by(self.ScheduleTable.suborder)
-                    for child_id, child in enumerate(children):
-                        child.order = item_id
-                        child.suborder = child_id
-                        child.save()
+                where = (self.ScheduleTable.category == category.id) & (self.ScheduleTable.parent == None)
+                self.ScheduleTable.update(suborder = None).where(where).execute()
+                self.rebalance_order_keys(self.ScheduleTable.order, where)
+                parents = self.ScheduleTable.select(self.ScheduleTable.id, self.ScheduleTable.order).where(where).tuples()
+                for parent_id, order in parents:
+                    self.ScheduleTable.update(order = order).where(self.ScheduleTable.parent == parent_id).execute()
+                    self.rebalance_order_keys(self.ScheduleTable.suborder, self.ScheduleTable.parent == parent_id)
 
             # Resource items
             categories = self.ResourceCategoryTable.select().order_by(self.ResourceCategoryTable.order)
             for cat_id, category in enumerate(categories):
                 category.order = cat_id
                 category.save()
-                items = self.ResourceTable.select().where(self.ResourceTable.category == category.id).order_by(self.ResourceTable.order)
-                for item_id, item in enumerate(items):
-                    item.order = item_id
-                    item.save()
+                self.rebalance_order_keys(self.ResourceTable.order, self.ResourceTable.category == category.id)
 
 
     ## Export items
 
+    def get_export_codes(self, sch_table):
+        """Get codes of all items and sub items of item table in export order"""
+        codes = []
+        for items in sch_table.values():
+            for code, item_list in items.items():
+                codes.append(code)
+                codes += [sub_item[0] for sub_item in item_list[1]]
+        return codes
+
+    def get_export_reader(self):
+        """Open a read only database on project file for use by an export worker"""
+        reader = ScheduleDatabase(None)
+        reader.open_database(self.database_filename, read_only=True)
+        return reader
+
+    def export_spreadsheet(self, spreadsheet, progress, break_lines=False):
+        """Export project to spreadsheet
+
+            Sheets are gathered by a pool of worker threads, each on its own read only
+            connection to the project file, and written to the spreadsheet in order.
+            Items for the analysis of rates are loaded in chunks across the workers.
+            Projects not backed by a file are exported sequentially.
+        """
+        sheet_exports = [('Schedule Items', lambda db, sheet: db.export_sch_spreadsheet(sheet, break_lines)),
+                         ('Resource Items', lambda db, sheet: db.export_res_spreadsheet(sheet)),
+                         ('Measurements', lambda db, sheet: db.export_meas_spreadsheet(sheet, break_lines)),
+                         ('Resource Usage', lambda db, sheet: db.export_res_usage_spreadsheet(sheet))]
+
+        if self.database_filename in (None, ':memory:'):
+            for fraction, (name, export_func) in enumerate(sheet_exports):
+                progress.add_message('Exporting ' + name + '...')
+                progress.set_fraction(fraction/10)
+                export_func(self, spreadsheet)
+            progress.add_message('Exporting Analysis of Rates...')
+            self.export_ana_spreadsheet(spreadsheet, progress, [0.4,0.9])
+            return
+
+        def export_sheets(export_func):
+            reader = self.get_export_reader()
+            try:
+                recorder = misc.SpreadsheetRecorder()
+                export_func(reader, recorder)
+                return recorder.get_sheets()
+            finally:
+                reader.close_database()
+
+        def load_items(codes):
+            reader = self.get_export_reader()
+            try:
+                return reader.get_items(codes, modify_res_code=False)
+            finally:
+                reader.close_database()
+
+        reader = self.get_export_reader()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=misc.EXPORT_WORKERS) as executor:
+                progress.add_message('Exporting sheets...')
+                progress.set_fraction(0)
+                sheet_futures = [executor.submit(export_sheets, export_func) for (name, export_func) in sheet_exports]
+                codes = self.get_export_codes(reader.get_item_table())
+                chunk = misc.EXPORT_ANALYSIS_CHUNK
+                item_futures = [executor.submit(load_items, codes[i:i+chunk]) for i in range(0, len(codes), chunk)]
+
+                # Write sheets in order while remaining sheets are gathered
+                for fraction, ((name, export_func), future) in enumerate(zip(sheet_exports, sheet_futures)):
+                    spreadsheet.write_sheets(future.result())
+                    progress.add_message(name + ' exported')
+                    progress.set_fraction(0.1*(fraction+1))
+
+                progress.add_message('Exporting Analysis of Rates...')
+                sch_items = dict()
+                for count, future in enumerate(concurrent.futures.as_completed(item_futures), 1):
+                    sch_items.update(future.result())
+                    progress.set_fraction(0.4 + 0.3*count/len(item_futures))
+
+            recorder = misc.SpreadsheetRecorder()
+            reader.export_ana_spreadsheet(recorder, progress, [0.7,0.9], sch_items)
+            spreadsheet.write_sheets(recorder.get_sheets())
+        finally:
+            reader.close_database()
+
     def export_sch_spreadsheet(self, spreadsheet, break_lines=False):
         sch_table = self.get_item_table()
         proj_name = self.get_project_settings()['project_name']
@@ -3078,9 +4664,10 @@ class ScheduleDatabase:
         spreadsheet.set_page_settings(font='Consolas')
         log.info('ScheduleDatabase - export_res_spreadsheet - Schedule exported')
 
-    def export_ana_item_spreadsheet(self, code, spreadsheet, parent=None):
-        sch_item = self.get_item(code, modify_res_code=False)
-        if sch_item.ana_items:
+    def export_ana_item_spreadsheet(self, code, spreadsheet, parent=None, sch_item=None):
+        if sch_item is None:
+            sch_item = self.get_item(code, modify_res_code=False)
+        if sch_item and sch_item.ana_items:
             s_row = spreadsheet.length() + 1
 
             # If parent item is there fill in code and decription
@@ -3194,7 +4781,8 @@ class ScheduleDatabase:
 
             spreadsheet.append_data([[None],[None]])
 
-    def export_ana_spreadsheet(self, spreadsheet, progress, range_progress):
+    def export_ana_spreadsheet(self, spreadsheet, progress, range_progress, sch_items=None):
+        """Export analysis of rates, using schedule items of sch_items if already loaded"""
         sch_table = self.get_item_table()
         spreadsheet.new_sheet()
         spreadsheet.set_title('Analysis')
@@ -3217,6 +4805,11 @@ class ScheduleDatabase:
             rows = [[None, category],[None]]
             spreadsheet.append_data(rows, bold=True)
             s_row = s_row + 2
+            # Get analysis of all items in category
+            if sch_items is None:
+                cat_items = self.get_items(self.get_export_codes({category: items}), modify_res_code=False)
+            else:
+                cat_items = sch_items
             # Set data of 1st level items
             for code, item_list in items.items():
                 item = item_list[0]
@@ -3227,11 +4820,11 @@ class ScheduleDatabase:
                     # Set data of 2nd level items
                     for sub_item in item_list[1]:
                         code2 = sub_item[0]
-                        self.export_ana_item_spreadsheet(code2, spreadsheet, [code, item_desc])
+                        self.export_ana_item_spreadsheet(code2, spreadsheet, [code, item_desc], cat_items.get(code2))
                         s_row = spreadsheet.length() + 1
                 # If regular item
                 else:
-                    self.export_ana_item_spreadsheet(code, spreadsheet)
+                    self.export_ana_item_spreadsheet(code, spreadsheet, sch_item=cat_items.get(code))
                     s_row = spreadsheet.length() + 1
                 progress.set_fraction(range_progress[0] + (range_progress[1]-range_progress[0])*cur_item/total_items)
                 cur_item = cur_item + 1
@@ -22,6 +22,8 @@
 #
 #
 
+from estimator.misc import evaluate
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -42,7 +44,7 @@ class CustomItem:
                     l = ''
                     for value in values[3:9]:
                         if value not in ['','0','0.0']:
-                            l += str(eval(value)) + ','
+                            l += str(evaluate(value)) + ','
                     l = l[:-1]
             except:
                 l = ''
@@ -50,9 +52,9 @@ class CustomItem:
 
         def c_1(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[3])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[3])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -60,9 +62,9 @@ class CustomItem:
 
         def c_2(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[4])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[4])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -70,9 +72,9 @@ class CustomItem:
 
         def c_3(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[5])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[5])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -80,9 +82,9 @@ class CustomItem:
 
         def c_4(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[6])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[6])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -90,9 +92,9 @@ class CustomItem:
 
         def c_5(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[7])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[7])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -100,9 +102,9 @@ class CustomItem:
 
         def c_6(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[8])
+                n1 = evaluate(values[1])
+                n2 = evaluate(values[2])
+                l = evaluate(values[8])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -22,6 +22,8 @@
 #
 #
 
+from estimator.misc import evaluate
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -37,7 +39,7 @@ class CustomItem:
             data = []
             for x in data_str:
                 try:
-                    num = int(eval(x))
+                    num = int(evaluate(x))
                     data.append(num)
                 except:
                     data.append(0)
@@ -22,12 +22,12 @@
 #
 #
 
-import subprocess, threading, os, posixpath, platform, logging, re, copy, json, time, pathlib, math
+import subprocess, threading, os, posixpath, platform, logging, re, copy, json, pathlib, math
+import ast, operator, functools, itertools
 from prettytable import PrettyTable, TableStyle
 from urllib.parse import urlparse
 from urllib.request import url2pathname
 
-from gi.repository import Gtk, Gdk, GLib, GObject, Pango
 import openpyxl
 
 # Setup logger object
@@ -60,16 +60,35 @@ MEAS_DESC = 3
 MEAS_CUST = 4
 
 # String used for checking file version
-PROJECT_FILE_VER = 'GESTIMATOR_FILE_REFERENCE_VER_2'
+PROJECT_FILE_VER = 'GESTIMATOR_FILE_REFERENCE_VER_4'
 PROJECT_EXTENSION = '.eproj'
 
 # Sub Analysis item
 SUB_ANA_TITLE = "SUB ANALYSIS"
-SUB_ANA_SEARCH_DEPTH = 2
 
 # Limiting values
 MAX_DESC_LEN = 1000
 MAX_DESC_LEN_MEAS = 100
+# Number of changed rows above which tree models are detached from view during refresh
+MAX_STORE_CHANGES_ATTACHED = 200
+# Number of rows appended to tree models per idle call while populating in background
+STORE_CHUNK_ROWS = 500
+# Number of evaluated cell expressions cached
+EVALUATE_CACHE_SIZE = 8192
+# Largest exponent allowed in cell expressions
+MAX_EVALUATE_EXPONENT = 100
+# Number of worker threads gathering sheets during spreadsheet export
+EXPORT_WORKERS = min(4, os.cpu_count() or 1)
+# Number of schedule items loaded per export worker task for analysis of rates
+EXPORT_ANALYSIS_CHUNK = 200
+# Number of rows written per statement during bulk inserts
+INSERT_BATCH_ROWS = 100
+# Number of parsed items imported per transaction while importing analysis of rates
+IMPORT_ANALYSIS_CHUNK = 200
+# Spacing of ordering keys of schedule and resource rows, leaving room for inserts between rows
+ORDER_KEY_GAP = 1024
+# Connection settings of read only libraries, memory mapped with a larger page cache
+LIBRARY_PRAGMAS = (('mmap_size', 256*1024*1024), ('cache_size', -32*1024))
 
 ana_copy_add_items = []
 ana_default_add_items = [{'description': 'MATERIALS', 'code': '', 'itemtype': 0, 'resource_list': []},
@@ -90,7 +109,7 @@ default_project_settings = {'file_version':PROJECT_FILE_VER,
                             'project_name':'',
                             'project_item_code':'',
                             'project_resource_code':'',
-                            'project_measurement':'["Measurement", ["", []]]'}
+                            'project_measurement_caption':''}
 default_program_settings = {'export_break_items': 'True',
                             'sch_rate_mult_factor':'1',
                             'ana_copy_delete_rows':'0',
@@ -154,416 +173,8 @@ MENU_XML="""
 ## GLOBAL VARIABLES
 
 
-
-## Custom Gtk Widgets
-
-class CellTextView(Gtk.TextView, Gtk.CellEditable):
-
-    __gproperties__ = {
-         'editing-canceled': (bool, 'editing-canceled', 'Inheritedproperty', False,
-                  GObject.PARAM_READWRITE)
-    }
-
-    property_names = __gproperties__.keys()
-
-    def __init__(self):
-        super().__init__()
-
-    def set_text(self, text):
-        text_buffer = self.get_buffer()
-        text_buffer.set_text(text)
-
-    def get_text(self, *args):
-        text_buffer = self.get_buffer()
-        start = text_buffer.get_start_iter()
-        end   = text_buffer.get_end_iter()
-        return text_buffer.get_text(start, end, True)
-
-    def do_editing_done(*args):
-        pass
-
-    def do_remove_widget(*args):
-        pass
-
-    def do_start_editing(*args):
-        pass
-
-class CellRendererMultilineText(Gtk.CellRendererText):
-
-     def __init__(self):
-         Gtk.CellRendererText.__init__(self)
-         self.set_property('mode',  Gtk.CellRendererMode.EDITABLE)
-
-     def __getattr__(self, name):
-         try:
-             return self.get_property(name)
-         except TypeError:
-             raise AttributeError
-
-     def __setattr__(self, name, value):
-         try:
-             self.set_property(name, value)
-         except TypeError:
-             self.__dict__[name] = value
-
-     def do_get_property(self, property):
-         if property.name not in self.property_names:
-             raise TypeError('No property named %s' % (property.name,))
-         return self.__dict__[property.name]
-
-     def do_set_property(self, property, value):
-         if property.name not in self.property_names:
-             raise TypeError('No property named %s' % (property.name,))
-         self.__dict__[property.name] = value
-
-     def do_start_editing(self, event, widget, path, bg_area, cell_area, flags):
-
-         editor = CellTextView()
-         editor.set_wrap_mode(Gtk.WrapMode.WORD)
-         editor.props.accepts_tab = False
-         editor.connect('key-press-event', self.on_key_press_event, path)
-
-         if self.text:
-             editor.set_text(self.text)
-
-         editor.grab_focus()
-         editor.show()
-
-         return editor
-
-     def on_key_press_event(self, widget, event, path):
-         '''Catch pressing Enter keys.
-
-         Shift, Ctrl or Alt combined with Return or Keypad Enter can be used
-         for linebreaking. Pressing Return or Keypad Enter alone will finish
-         editing.'''
-
-         mask     = event.state
-         keyname = Gdk.keyval_name(event.keyval)
-
-         accel_masks    = (Gdk.ModifierType.CONTROL_MASK | \
-                           Gdk.ModifierType.SHIFT_MASK | \
-                           Gdk.ModifierType.MOD1_MASK)
-         enter_keynames = ('Return', 'KP_Enter')
-
-         if (keyname in enter_keynames) and not (mask & accel_masks):
-             self.emit('edited', path, widget.get_text())
-             widget.destroy()
-
-
-
 ## GLOBAL CLASSES
 
-class UserEntryDialog():
-    """Creates a dialog box for entry of custom data fields
-
-        Arguments:
-            parent: Parent Window
-            window_caption: Window Caption to be displayed on Dialog
-            item_values: Item values to be requested from user
-            item_captions: Description of item values to be shown to user
-    """
-
-    def __init__(self, parent, window_caption, item_values, item_captions):
-        self.toplevel = parent
-        self.entrys = []
-        self.item_values = item_values
-        self.item_captions = item_captions
-
-        self.dialog_window = Gtk.Dialog(window_caption, parent, Gtk.DialogFlags.MODAL,
-            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
-             Gtk.STOCK_OK, Gtk.ResponseType.OK))
-        self.dialog_window.set_title(window_caption)
-        self.dialog_window.set_resizable(True)
-        self.dialog_window.set_border_width(5)
-        self.dialog_window.set_size_request(int(self.toplevel.get_size_request()[0]*0.8),-1)
-        self.dialog_window.set_default_response(Gtk.ResponseType.OK)
-
-        # Pack Dialog
-        dialog_box = self.dialog_window.get_content_area()
-        grid = Gtk.Grid()
-        grid.set_column_spacing(5)
-        grid.set_row_spacing(5)
-        grid.set_border_width(5)
-        grid.set_hexpand(True)
-        dialog_box.add(grid)
-        for caption in self.item_captions:
-            # Captions
-            user_label = Gtk.Label(caption)
-            user_label.set_halign(Gtk.Align.END)
-            # Text Entry
-            user_entry = Gtk.Entry()
-            user_entry.set_hexpand(True)
-            user_entry.set_activates_default(True)
-            # Pack Widgets
-            grid.attach_next_to(user_label, None, Gtk.PositionType.BOTTOM, 1, 1)
-            grid.attach_next_to(user_entry, user_label, Gtk.PositionType.RIGHT, 1, 1)
-            self.entrys.append(user_entry)
-        # Add data
-        for value, user_entry in zip(self.item_values, self.entrys):
-            user_entry.set_text(value)
-
-    def run(self):
-        """Display dialog box and modify Item Values in place
-
-            Save modified values to "item_values" (item passed by reference)
-            if responce is Ok. Discard modified values if response is Cancel.
-
-            Returns:
-                True on Ok
-                False on Cancel
-        """
-        # Run dialog
-        self.dialog_window.show_all()
-        response = self.dialog_window.run()
-
-        if response == Gtk.ResponseType.OK:
-            # Get formated text and update item_values
-            for key, user_entry in zip(range(len(self.item_values)), self.entrys):
-                cell = user_entry.get_text()
-                try:  # try evaluating string
-                    if type(self.item_values[key]) is str:
-                        cell_formated = str(cell)
-                    elif type(self.item_values[key]) is int:
-                        cell_formated = str(float(cell))
-                    elif type(self.item_values[key]) is float:
-                        cell_formated = str(int(cell))
-                    else:
-                        cell_formated = ''
-                except:
-                    cell_formated = ''
-                self.item_values[key] = cell_formated
-
-            self.dialog_window.destroy()
-            return True
-        else:
-            self.dialog_window.destroy()
-            return False
-
-class SpreadsheetDialog:
-    """Dialog for manage input and output of spreadsheets"""
-
-    def __init__(self, parent, filename, columntypes, captions, dimensions = None, allow_formula=False):
-        """Initialise SpreadsheetDialog class
-
-            Arguments:
-                parent: Parent widget (Main window)
-                filename:
-                columntypes: Data types of columns.
-                             Takes following values:
-                                misc.MEAS_NO: Integer
-                                misc.MEAS_L: Float
-                                misc.MEAS_DESC: String
-                                misc.MEAS_CUST: Value omited
-                dimensions: List of two lists passing column widths and expand properties
-                allow_formula: Reads all values as string
-        """
-        log.info('SpreadsheetDialog - Initialise')
-        # Setup variables
-        self.parent = parent
-        self.filename = filename
-        self.captions = captions
-        self.columntypes = columntypes
-        self.dimensions = dimensions
-        self.allow_formula = allow_formula
-
-        self.top = 0
-        self.bottom = 0
-        self.left = 0
-        self.right = 0
-        self.values = []
-        self.spreadsheet = None
-        self.sheet = ''
-
-        # Setup dialog window
-        self.builder = Gtk.Builder()
-        self.builder.add_from_file(abs_path("interface","spreadsheetdialog.glade"))
-        self.window = self.builder.get_object("dialog")
-        self.window.set_transient_for(self.parent)
-        self.window.set_default_size(1100,600)
-        self.builder.connect_signals(self)
-
-        # Get required objects
-        self.combo = self.builder.get_object("combobox_sheet")
-        self.combo_store = self.builder.get_object("liststore_combo")
-        self.tree = self.builder.get_object("treeview_schedule")
-        self.entry_top = self.builder.get_object("entry_top")
-        self.entry_bottom = self.builder.get_object("entry_bottom")
-        self.entry_left = self.builder.get_object("entry_left")
-        self.entry_right = self.builder.get_object("entry_right")
-
-        # Setup treeview
-        self.columns = []
-        self.cells = []
-        # Setup row number column
-        cell_row = Gtk.CellRendererText()
-        column_row = Gtk.TreeViewColumn('', cell_row)
-        column_row.add_attribute(cell_row, "markup", 0)
-        column_row.set_min_width(50)
-        column_row.set_fixed_width(50)
-        cell_row.props.wrap_width = 50
-        cell_row.props.background = MEAS_COLOR_LOCKED
-        self.cells.append(cell_row)
-        self.columns.append(column_row)
-        self.tree.append_column(column_row)
-        # Setup remaining columns
-        for c_no, caption  in enumerate(self.captions,1):
-            cell = Gtk.CellRendererText()
-            column = Gtk.TreeViewColumn(caption, cell)
-            column.props.sizing = Gtk.TreeViewColumnSizing.AUTOSIZE
-            column.connect("notify", self.on_wrap_column_resized, cell)
-            column.add_attribute(cell, "text", c_no)
-            self.cells.append(cell)
-            self.columns.append(column)
-            self.tree.append_column(column)
-        # Setup dimensions
-        if dimensions is not None:
-            self.setup_column_props(*dimensions)
-        # Setup liststore model
-        types = [str] + [str]*len(self.columntypes)
-        self.store = Gtk.ListStore(*types)
-        self.tree.set_model(self.store)
-        # Misc options
-        self.tree.set_grid_lines(3)
-        self.tree.set_enable_search(True)
-        search_cols = [no for no,x in enumerate(self.columntypes,1) if x == str]
-        self.tree.set_search_equal_func(self.equal_func, [0,1,2,3])
-
-        # Read file into spreadsheet object
-        if filename is not None:
-            try:
-                self.spreadsheet = Spreadsheet(filename)
-            except:
-                self.spreadsheet = None
-                log.warning('SpreadsheetDialog - Spreadsheet could not be read - ' + filename)
-
-        # Setup combobox
-        if self.spreadsheet:
-            sheets = self.spreadsheet.sheets()
-            for sheet in sheets:
-                self.combo_store.append([sheet])
-            if sheets:
-                self.combo.set_active_id(sheets[0])
-                self.update()
-
-
-    def run(self):
-        """Display dialog box and return data model
-
-            Returns:
-                Data Model on Ok
-                [] on Cancel
-        """
-        self.window.show_all()
-        response = self.window.run()
-        self.window.destroy()
-
-        if response == 1 and self.spreadsheet:
-            log.info('SpreadsheetDialog - run - Response Ok')
-            return self.values
-        else:
-            log.info('SpreadsheetDialog - run - Response Cancel')
-            return []
-
-    def update(self):
-        """Update contents from input values"""
-        log.info('SpreadsheetDialog - Update')
-
-        # Read if sheet changed
-        sheet = self.combo_store[self.combo.get_active_iter()][0]
-        if sheet != self.sheet:
-            self.sheet = sheet
-            self.spreadsheet.set_active_sheet(self.sheet)
-            self.entry_top.set_text('1')
-            self.entry_bottom.set_text(str(self.spreadsheet.length()+1))
-            self.entry_left.set_text('1')
-
-        # Read values of entries
-        self.top = int(self.entry_top.get_text())
-        self.bottom = int(self.entry_bottom.get_text())
-        self.left = int(self.entry_left.get_text())
-
-        # Set values
-        self.entry_right.set_text(str(self.left + len(self.columntypes)))
-
-        # Read spreadsheet
-        self.values = self.spreadsheet.read_rows(self.columntypes, start=self.top-1, end=self.bottom-1, left=self.left-1, allow_formula=self.allow_formula)
-
-        # Update store
-        self.store.clear()
-        for slno, value in enumerate(self.values, self.top):
-            formated_value = [str(x) if x != 0 else '' for x in value]
-            self.store.append(['<b>' + str(slno) + '</b>'] + formated_value)
-
-    def setup_column_props(self, widths, expandables):
-        """Set column properties
-            Arguments:
-                widths: List of column widths type-> [int, ...]. None values are skiped.
-                expandables: List of expand property type-> [bool, ...]. None values are skiped.
-        """
-        for column, cell, width, expandable in zip(self.columns[1:], self.cells[1:], widths, expandables):
-            if width != None:
-                column.set_min_width(width)
-                column.set_fixed_width(width)
-                cell.props.wrap_width = width
-            if expandable != None:
-                column.set_expand(expandable)
-
-    def equal_func(self, model, column, key, iter, cols):
-        """Equal function for interactive search"""
-        search_string = ''
-        for col in cols:
-            search_string += ' ' + model[iter][col].lower()
-        for word in key.split():
-            if word.lower() not in search_string:
-                return True
-        return False
-
-    def on_wrap_column_resized(self, column, pspec, cell):
-        """ Automatically adjust wrapwidth to column width"""
-
-        width = column.get_width() - 5
-        oldwidth = cell.props.wrap_width
-
-        if width > 0 and width != oldwidth:
-            cell.props.wrap_width = width
-            # Force redraw of treeview
-            GLib.idle_add(column.queue_resize)
-
-    # Callbacks
-
-    def onRefreshClicked(self, button):
-        """Refresh screen on button click"""
-
-        # Sanitise entries
-        if self.entry_top.get_text() == '':
-            self.entry_top.set_text('1')
-        if self.entry_bottom.get_text() == '':
-            self.entry_bottom.set_text('1')
-        if self.entry_left.get_text() == '':
-            self.entry_left.set_text('1')
-
-        if self.spreadsheet:
-            self.update()
-
-    def onEntryEditedNum(self, entry):
-        """Treeview cell renderer for editable number field
-
-            User Data:
-                column: column in ListStore being edited
-        """
-        new_text = entry.get_text()
-        num = ''
-        if new_text != '':
-            try:  # check whether item evaluates fine
-                num = int(new_text)
-                if num <= 0:
-                   num = 1
-            except:
-                log.warning("SpreadsheetDialog - onEntryEditedNum - evaluation of ["
-                + new_text + "] failed")
-        entry.set_text(str(num))
-
 
 class Spreadsheet:
     """Manage input and output of spreadsheets"""
@@ -726,214 +337,306 @@ class Spreadsheet:
 
     def read_rows(self, columntypes = [], start=0, end=-1, left=0, allow_formula=False):
         """Read and validate selected rows from current sheet"""
-        # Get count of rows
-        rowcount = self.length()
-        if end < 0 or end >= rowcount:
-            count_actual = rowcount
-        else:
-            count_actual = end
+        return list(iter_sheet_rows(self.sheet, self.length(), columntypes, start, end, left, allow_formula))
 
-        items = []
-        for row in range(start, count_actual):
-            cells = []
-            skip = 0  # No of columns to be skiped ex. breakup, total etc...
-            for columntype, i in zip(columntypes, list(range(left, len(columntypes)+left))):
-                cell = self.sheet.cell(row = row + 1, column = i - skip + 1).value
-                if columntype == str:
-                    if cell is None:
-                        cell_formated = ""
-                    else:
-                        cell_formated = str(cell)
-                elif columntype == float:
-                    if cell is None:
-                        if allow_formula:
-                            cell_formated = '0'
-                        else:
-                            cell_formated = 0
-                    else:
-                        if allow_formula:
-                            try:  # try evaluating float
-                                if len(str(cell)) > 1 and str(cell)[0] == '=':
-                                    formula = str(cell)[1:]
-                                else:
-                                    formula = str(cell)
-                                evaluated = str(float(eval(formula)))
-                                cell_formated = formula
-                            except:
-                                cell_formated = '0'
-                        else:
-                            try:  # try evaluating float
-                                cell_formated = str(float(cell))
-                            except:
-                                cell_formated = 0
-
-                elif columntype == int:
-                    if cell is None:
-                        if allow_formula:
-                            cell_formated = '0'
-                        else:
-                            cell_formated = 0
-                    else:
-                        if allow_formula:
-                            try:  # try evaluating int
-                                if len(str(cell)) > 1 and str(cell)[0] == '=':
-                                    formula = str(cell)[1:]
-                                else:
-                                    formula = str(cell)
-                                evaluated = str(int(eval(formula)))
-                                cell_formated = formula
-                            except:
-                                cell_formated = '0'
-                        else:
-                            try:  # try evaluating int
-                                cell_formated = str(int(cell))
-                            except:
-                                cell_formated = 0
-                else:
-                    cell_formated = ''
-                    log.warning("Spreadsheet - Value skipped on import - " + str((row, i)))
-                if columntype is None:
-                    skip = skip + 1
-                cells.append(cell_formated)
-            items.append(cells)
-        return items
-
-
-class ProgressWindow:
-    """Class for handling display of long running proccess"""
-
-    def __init__(self, parent=None, label=None, progress=None):
-
-        self.parent = parent
-        self.label = label
-        self.progress = progress
-        # Setup data
-        self.step = 0
-        self.fraction = 0
-
-        # Setup progress indicator window
-        if parent:
-            self.dialog = Gtk.Window(default_height=250, default_width=400,
-                                     title='Process running...')
-            self.dialog.set_transient_for(self.parent)
-            self.dialog.set_gravity(Gdk.Gravity.CENTER)
-            self.dialog.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
-            self.dialog.set_modal(True)
-            self.dialog.set_type_hint(Gdk.WindowTypeHint.DIALOG)
-            box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
-            box.set_margin_left(6)
-            box.set_margin_right(6)
-
-            scroll = Gtk.ScrolledWindow()
-            scroll.set_vexpand(True)
-            self.store = Gtk.ListStore(str)
-            self.tree = Gtk.TreeView.new_with_model(self.store)
-            column = Gtk.TreeViewColumn("Message")
-            cell = Gtk.CellRendererText()
-            column.pack_start(cell, True)
-            column.add_attribute(cell, "markup", 0)
-            self.tree.append_column(column)
-            scroll.add(self.tree)
-
-            box.pack_start(scroll, True, True, 3)
-            self.progress = Gtk.ProgressBar()
-            box.pack_start(self.progress, False, False, 3)
-            dismiss = Gtk.Button('Dismiss')
-            box.pack_start(dismiss, False, False, 3)
-            self.dialog.add(box)
-
-            # Connect events
-            self.dialog.connect("delete-event",self.on_delete)
-            dismiss.connect("clicked",self.on_dismiss)
-
-    # Window functions
-
-    def show(self):
-        def callback():
-            self.dialog.show_all()
-            return False
-        GLib.idle_add(callback)
+
+class SpreadsheetReader:
+    """Read only spreadsheet streaming rows of a sheet for imports
+
+        Rows are read in file order without loading the workbook into memory.
+    """
+
+    def __init__(self, filename):
+        self.spreadsheet = openpyxl.load_workbook(filename, read_only=True)
+        self.sheet = self.spreadsheet.active
+        # Row counts of sheets keyed by title
+        self.rowcounts = dict()
 
     def close(self):
-        self.dialog.close()
+        """Close spreadsheet file"""
+        self.spreadsheet.close()
 
-    def on_delete(self, *args):
-        if self.fraction == 1:
-            return False
-        else:
-            # Cancel event
-            self.dialog.hide()
-            return True
+    def sheets(self):
+        """Returns a list of sheetnames"""
+        return self.spreadsheet.sheetnames
 
-    def on_dismiss(self, button):
-        if self.fraction == 1:
-            self.close()
-        else:
-            self.dialog.hide()
-
-    # General functions
-
-    def set_pulse_step(self, width):
-        self.step = width
-        self.fraction = 0
-
-    def set_fraction(self, fraction):
-        def callback():
-            self.fraction = fraction
-            self.progress.set_fraction(self.fraction)
-            if self.parent:
-                self.show()
-            return False
-        GLib.idle_add(callback)
-
-    def pulse(self, end=False):
-        def callback():
-            self.fraction += self.step
-            if end:
-                if self.parent:
-                    self.fraction = 1
-                    self.dialog.set_title('Process Complete')
-                    self.show()
-                else:
-                    pass
-            self.progress.set_fraction(self.fraction)
-            return False
-        GLib.idle_add(callback)
-
-    def add_message(self, message):
-        if self.parent:
-            def callback():
-                itemiter = self.store.append([message])
-                path = self.store.get_path(itemiter)
-                self.tree.scroll_to_cell(path)
-                return False
-            GLib.idle_add(callback)
+    def set_active_sheet(self, sheetref):
+        """Set active sheet of spreadsheet by name or number"""
+        if type(sheetref) is str and sheetref in self.sheets():
+            self.sheet = self.spreadsheet[sheetref]
+        elif type(sheetref) is int and sheetref < len(self.sheets()):
+            self.sheet = self.spreadsheet.worksheets[sheetref]
+
+    def length(self):
+        """Get number of rows in sheet
+
+            Stored dimensions can include trailing empty rows, so rows are counted
+            once per sheet by scanning. Empty sheets have a single row as in
+            openpyxl.
+        """
+        if self.sheet.title not in self.rowcounts:
+            self.sheet.reset_dimensions()
+            rowcount = 1
+            for row_no, row in enumerate(self.sheet.iter_rows(values_only=True), 1):
+                if row:
+                    rowcount = row_no
+            self.rowcounts[self.sheet.title] = rowcount
+        return self.rowcounts[self.sheet.title]
+
+    def iter_rows(self, columntypes = [], start=0, end=-1, left=0, allow_formula=False):
+        """Iterate over validated rows from current sheet"""
+        return iter_sheet_rows(self.sheet, self.length(), columntypes, start, end, left, allow_formula)
+
+    def read_rows(self, columntypes = [], start=0, end=-1, left=0, allow_formula=False):
+        """Read and validate selected rows from current sheet"""
+        return list(self.iter_rows(columntypes, start, end, left, allow_formula))
+
+
+class SpreadsheetBuffer:
+    """Rows of spreadsheet cells held in memory as (value, style) with style tags
+
+        Style tags are tuples of (bold, italic, wrap_text, horizontal, vertical, fill).
+    """
+
+    def __init__(self):
+        # Row 1 is left empty as in a new worksheet
+        self.rows = [[]]
+        # Merged ranges as (start_row, start_column, end_row, end_column)
+        self.merged_cells = []
+
+    def length(self):
+        """Get number of rows in buffer"""
+        return len(self.rows)
+
+    def get_cells(self, row, col):
+        """Return cell list of row extended upto column col"""
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row-1]
+        while len(cells) < col:
+            cells.append((None, None))
+        return cells
+
+    def set_style(self, row, col, bold=False, wrap_text=True, horizontal='general', vertical='bottom', fill=None):
+        """Set style of individual cell"""
+        cells = self.get_cells(row, col)
+        (value, style) = cells[col-1]
+        if fill is None and style is not None:
+            fill = style[5]
+        cells[col-1] = (value, (bold, False, wrap_text, horizontal, vertical, fill))
+
+    def append(self, buffer):
+        """Append rows of another buffer, an empty buffer adds no rows as with an empty worksheet"""
+        if not any(buffer.rows):
+            return
+        rowcount = self.length()
+        self.rows.extend(list(cells) for cells in buffer.rows)
+        for (start_row, start_column, end_row, end_column) in buffer.merged_cells:
+            self.merged_cells.append((start_row+rowcount, start_column, end_row+rowcount, end_column))
+
+    def append_data(self, data, bold=False, italic=False, wrap_text=True, horizontal='general', vertical='bottom', fill = None):
+        """Append data rows"""
+        style = (bold, italic, wrap_text, horizontal, vertical, fill)
+        for row in data:
+            self.rows.append([(value, style) for value in row])
+
+    def insert_data(self, data, start_row=1, start_col=1, bold=False, italic=False, wrap_text=True, horizontal='general', vertical='bottom', fill=None):
+        """Insert data rows at position"""
+        style = (bold, italic, wrap_text, horizontal, vertical, fill)
+        for row_no, row in enumerate(data, start_row):
+            cells = self.get_cells(row_no, start_col + len(row) - 1)
+            for col_no, value in enumerate(row, start_col):
+                cells[col_no-1] = (value, style)
+
+    def add_merged_cell(self, value, row=None, width=2, bold=False, wrap_text=True, horizontal='center', start_column=1):
+        """Add a merged cell of prescrbed width"""
+        if row is None:
+            rowstart = self.length() + 1
         else:
-            GLib.idle_add(self.label.set_markup, message)
+            rowstart = row
+        self.merged_cells.append((rowstart, start_column, rowstart, start_column+width-1))
+        self.__setitem__([rowstart,start_column], value)
+        self.set_style(rowstart, start_column, bold, wrap_text, horizontal)
+
+    def __setitem__(self, index, value):
+        """Set an individual cell"""
+        cells = self.get_cells(index[0], index[1])
+        cells[index[1]-1] = (value, cells[index[1]-1][1])
+
+    def __getitem__(self, index):
+        """Get an individual cell"""
+        if index[0] <= len(self.rows) and index[1] <= len(self.rows[index[0]-1]):
+            return self.rows[index[0]-1][index[1]-1][0]
+        return None
+
+
+class SpreadsheetSheet(SpreadsheetBuffer):
+    """SpreadsheetBuffer along with sheet title, column widths and page settings"""
+
+    def __init__(self):
+        SpreadsheetBuffer.__init__(self)
+        self.title = None
+        self.column_widths = []
+        self.page_settings = None
+
+    def is_blank(self):
+        """Check if sheet is untouched since creation"""
+        return self.title is None and self.rows == [[]] and not self.merged_cells
+
+    def detach_sheet(self):
+        """Return contents of current sheet as a new sheet and start an empty current sheet"""
+        sheet = SpreadsheetSheet()
+        sheet.rows = self.rows
+        sheet.merged_cells = self.merged_cells
+        sheet.title = self.title
+        sheet.column_widths = self.column_widths
+        sheet.page_settings = self.page_settings
+        SpreadsheetSheet.__init__(self)
+        return sheet
+
+    def set_title(self, title):
+        """Set title of sheet"""
+        self.title = title
+
+    def set_page_settings(self, orientation='portrait', papersize='A4', font=None, print_title_rows = None):
+        """Set page settings of sheet, applied when sheet is written"""
+        self.page_settings = dict(orientation=orientation, papersize=papersize, font=font,
+                                  print_title_rows=print_title_rows)
+
+    def set_column_widths(self, widths):
+        """Set column widths of sheet"""
+        self.column_widths = widths
+
+
+class SpreadsheetRecorder(SpreadsheetSheet):
+    """Records sheets in memory for writing later with SpreadsheetWriter
+
+        Used by export workers so that sheets can be gathered independently of the
+        workbook. Blank sheets left behind by new_sheet are not recorded.
+    """
+
+    def __init__(self):
+        SpreadsheetSheet.__init__(self)
+        self.recorded_sheets = []
+
+    def new_sheet(self):
+        """Record current sheet and start a new sheet"""
+        sheet = self.detach_sheet()
+        if not sheet.is_blank():
+            self.recorded_sheets.append(sheet)
 
+    def sheets(self):
+        """Returns a list of sheetnames"""
+        return [sheet.title for sheet in self.recorded_sheets] + [self.title]
+
+    def get_sheets(self):
+        """Record current sheet and return all recorded sheets"""
+        self.new_sheet()
+        return self.recorded_sheets
 
-class SplashScreen:
-    def __init__(self, callback, image_filename, min_splash_time=0 ):
-        self.image = Gtk.Image.new_from_file(image_filename )
-        self.window = Gtk.Window(Gtk.WindowType.TOPLEVEL)
-        self.window.set_position(Gtk.WindowPosition.CENTER)
-        self.window.set_type_hint(Gdk.WindowTypeHint.SPLASHSCREEN)
-        self.window.set_gravity(Gdk.Gravity.CENTER)
-        self.window.set_auto_startup_notification(False)
-        self.window.set_decorated(False)
-        self.window.add(self.image)
-        self.min_splash_time   = time.time() + min_splash_time
-        self.window.show_all()
-        GLib.timeout_add_seconds(1, callback)
 
-    def exit(self):
-        # Make sure the minimum splash time has elapsed
-        timeNow = time.time()
-        if timeNow < self.min_splash_time:
-            time.sleep( self.min_splash_time - timeNow )
+class SpreadsheetWriter(SpreadsheetSheet):
+    """Write only spreadsheet for exports
 
-        # Destroy the splash window
-        self.window.destroy( )
+        Rows of the current sheet are held as a SpreadsheetBuffer so that earlier cells
+        can still be styled, and are streamed into a write only worksheet when the next
+        sheet is started or on save. Cell formats are shared named styles.
+    """
+
+    def __init__(self):
+        SpreadsheetSheet.__init__(self)
+        self.spreadsheet = openpyxl.Workbook(write_only=True)
+        # Cell style arrays of named styles keyed by (style tag, font name)
+        self.named_styles = dict()
+        self.sheet_titles = []
+
+    def save(self, filename):
+        """Write current sheet and save spreadsheet to file"""
+        # Skip blank current sheet if sheets were added through write_sheets
+        if not self.is_blank() or not self.sheet_titles:
+            self.write_sheet(self.detach_sheet())
+        self.spreadsheet.save(filename)
+
+    # Sheet management
+
+    def new_sheet(self):
+        """Write current sheet and start a new sheet"""
+        self.write_sheet(self.detach_sheet())
+
+    def write_sheets(self, sheets):
+        """Write sheets recorded by SpreadsheetRecorder"""
+        for sheet in sheets:
+            self.write_sheet(sheet)
+
+    def sheets(self):
+        """Returns a list of sheetnames"""
+        return self.sheet_titles + [self.title]
+
+    def get_named_style(self, style, font):
+        """Return cell style array of named style for style tag and font, adding it if required"""
+        key = (style, font)
+        if key not in self.named_styles:
+            name = 'Export ' + str(len(self.named_styles) + 1)
+            named_style = openpyxl.styles.NamedStyle(name=name)
+            if style is None:
+                named_style.font = openpyxl.styles.Font(name=font)
+            else:
+                (bold, italic, wrap_text, horizontal, vertical, fill) = style
+                named_style.font = openpyxl.styles.Font(name=font, bold=bold, italic=italic)
+                named_style.alignment = openpyxl.styles.Alignment(wrap_text=wrap_text, horizontal=horizontal, vertical=vertical)
+                if fill is not None and fill != '#FFFFFF':
+                    named_style.fill = openpyxl.styles.PatternFill(start_color=fill[1:], end_color=fill[1:], fill_type='solid')
+            self.spreadsheet.add_named_style(named_style)
+            self.named_styles[key] = named_style.as_tuple()
+        return self.named_styles[key]
+
+    def write_sheet(self, source):
+        """Stream a sheet into spreadsheet"""
+        sheet = self.spreadsheet.create_sheet(source.title)
+        self.sheet_titles.append(sheet.title)
+
+        # Column widths are to be set before writing rows
+        for column, width in enumerate(source.column_widths, 1):
+            col_letter = openpyxl.utils.get_column_letter(column)
+            sheet.column_dimensions[col_letter].width = width
+
+        font = None
+        if source.page_settings:
+            settings = source.page_settings
+            font = settings['font']
+            # Orientation
+            if settings['orientation'] == 'portrait':
+                sheet.page_setup.orientation = openpyxl.worksheet.worksheet.Worksheet.ORIENTATION_PORTRAIT
+            elif settings['orientation'] == 'landscape':
+                sheet.page_setup.orientation = openpyxl.worksheet.worksheet.Worksheet.ORIENTATION_LANDSCAPE
+            # Paper size
+            if settings['papersize'] == 'A4':
+                sheet.page_setup.paperSize = openpyxl.worksheet.worksheet.Worksheet.PAPERSIZE_A4
+            # Print title rows
+            sheet.print_title_rows = settings['print_title_rows']
+            # General settings
+            sheet.page_setup.fitToPage = True
+            sheet.page_setup.fitToHeight = 99
+            sheet.page_setup.fitToWidth = 1
+            sheet.print_options.horizontalCentered = True
+
+        # Ranges do not overlap, add directly skipping containment checks
+        for (start_row, start_column, end_row, end_column) in source.merged_cells:
+            cell_range = openpyxl.worksheet.cell_range.CellRange(min_col=start_column, min_row=start_row,
+                                                                 max_col=end_column, max_row=end_row)
+            sheet.merged_cells.ranges.add(cell_range)
+
+        for cells in source.rows:
+            row = []
+            for (value, style) in cells:
+                if style is None and font is None:
+                    row.append(value)
+                else:
+                    cell = openpyxl.cell.WriteOnlyCell(sheet, value)
+                    # Share style array of named style instead of resolving style by name per cell
+                    cell._style = copy.copy(self.get_named_style(style, font))
+                    row.append(cell)
+            sheet.append(row)
 
 
 class Command(object):
@@ -967,82 +670,6 @@ class Command(object):
 
 ## GLOBAL METHODS
 
-def get_user_input_text(parent, message, title='', oldval=None, multiline=False):
-    '''Gets a single user input by diplaying a dialog box
-
-    Arguments:
-        parent: Parent window
-        message: Message to be displayed to user
-        title: Dialog title text
-        multiline: Allows multiline input is True
-    Returns:
-        Returns user input as a string or 'None' if user does not input text.
-    '''
-    dialogWindow = Gtk.MessageDialog(parent,
-                                     Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                                     Gtk.MessageType.QUESTION,
-                                     Gtk.ButtonsType.OK_CANCEL,
-                                     message)
-
-    dialogWindow.set_transient_for(parent)
-    dialogWindow.set_title(title)
-    dialogWindow.set_default_response(Gtk.ResponseType.OK)
-
-    dialogBox = dialogWindow.get_content_area()
-    text = ''
-
-    if multiline:
-        # Function to mark first line as bold
-        def mark_heading(textbuff, tag):
-            start = textbuff.get_start_iter()
-            end = textbuff.get_end_iter()
-            textbuff.remove_all_tags(start, end)
-            match = start.forward_search('\n', 0, end)
-            if match != None:
-                match_start, match_end = match
-                textbuff.apply_tag(tag, start, match_start)
-
-        scrolledwindow = Gtk.ScrolledWindow()
-        scrolledwindow.set_hexpand(True)
-        scrolledwindow.set_vexpand(True)
-        scrolledwindow.set_size_request(300, 100)
-
-        textview = Gtk.TextView()
-        textbuffer = textview.get_buffer()
-        dialogBox.pack_end(scrolledwindow, False, False, 0)
-        scrolledwindow.add(textview)
-        scrolledwindow.set_border_width(6)
-
-        # Set old value
-        if oldval != None:
-            textbuffer.set_text(oldval)
-
-        # Mark heading
-        tag_bold = textbuffer.create_tag("bold", weight=Pango.Weight.BOLD)
-        mark_heading(textbuffer, tag_bold)
-        textbuffer.connect("changed", mark_heading, tag_bold)
-
-        dialogWindow.show_all()
-        response = dialogWindow.run()
-        text = textbuffer.get_text(textbuffer.get_start_iter(),textbuffer.get_end_iter(), True)
-    else:
-        userEntry = Gtk.Entry()
-        userEntry.set_activates_default(True)
-        userEntry.set_size_request(50, 0)
-        dialogBox.pack_end(userEntry, False, False, 0)
-
-        # Set old value
-        if oldval != None:
-            userEntry.set_text(oldval)
-
-        dialogWindow.show_all()
-        response = dialogWindow.run()
-        text = userEntry.get_text()
-    dialogWindow.destroy()
-    if (response == Gtk.ResponseType.OK) and (text != ''):
-        return text
-    else:
-        return None
 
 def file_to_uri(filename):
     if platform.system() == 'Windows':
@@ -1163,6 +790,95 @@ def get_tabular_text(data, col_labels=None):
     return table.get_string()
 
 
+def iter_sheet_rows(sheet, rowcount, columntypes = [], start=0, end=-1, left=0, allow_formula=False):
+    """Iterate over validated rows of worksheet
+
+        Cells are read by row with values only. Columns with type None are not
+        read from the sheet and yield an empty value.
+    """
+    # Get count of rows
+    if end < 0 or end >= rowcount:
+        count_actual = rowcount
+    else:
+        count_actual = end
+
+    if not columntypes:
+        for row in range(start, count_actual):
+            yield []
+        return
+    # Columns of sheet read, relative to left, for each column type
+    columns = []
+    skip = 0  # No of columns to be skiped ex. breakup, total etc...
+    for i, columntype in enumerate(columntypes):
+        columns.append(i - skip)
+        if columntype is None:
+            skip = skip + 1
+    width = max(columns) + 1
+
+    # Read only sheets skip missing rows at the end of sheet, pad them as empty rows
+    values_rows = itertools.chain(sheet.iter_rows(min_row=start+1, max_row=count_actual, min_col=left+1,
+                                                  max_col=left+width, values_only=True),
+                                  itertools.repeat(()))
+    for row, values in zip(range(start, count_actual), values_rows):
+        cells = []
+        for columntype, i, column in zip(columntypes, range(left, len(columntypes)+left), columns):
+            cell = values[column] if column < len(values) else None
+            if columntype == str:
+                if cell is None:
+                    cell_formated = ""
+                else:
+                    cell_formated = str(cell)
+            elif columntype == float:
+                if cell is None:
+                    if allow_formula:
+                        cell_formated = '0'
+                    else:
+                        cell_formated = 0
+                else:
+                    if allow_formula:
+                        try:  # try evaluating float
+                            if len(str(cell)) > 1 and str(cell)[0] == '=':
+                                formula = str(cell)[1:]
+                            else:
+                                formula = str(cell)
+                            evaluated = str(float(evaluate(formula)))
+                            cell_formated = formula
+                        except:
+                            cell_formated = '0'
+                    else:
+                        try:  # try evaluating float
+                            cell_formated = str(float(cell))
+                        except:
+                            cell_formated = 0
+
+            elif columntype == int:
+                if cell is None:
+                    if allow_formula:
+                        cell_formated = '0'
+                    else:
+                        cell_formated = 0
+                else:
+                    if allow_formula:
+                        try:  # try evaluating int
+                            if len(str(cell)) > 1 and str(cell)[0] == '=':
+                                formula = str(cell)[1:]
+                            else:
+                                formula = str(cell)
+                            evaluated = str(int(evaluate(formula)))
+                            cell_formated = formula
+                        except:
+                            cell_formated = '0'
+                    else:
+                        try:  # try evaluating int
+                            cell_formated = str(int(cell))
+                        except:
+                            cell_formated = 0
+            else:
+                cell_formated = ''
+                log.warning("Spreadsheet - Value skipped on import - " + str((row, i)))
+            cells.append(cell_formated)
+        yield cells
+
 def round_value(value, rounding='Round to 0'):
     """Round value using predefined schemes"""
     if rounding == 'Round within 1%':
@@ -1193,6 +909,42 @@ def round_value(value, rounding='Round to 0'):
 
 # Cairo drawing functions
 
+# Operators allowed in cell expressions
+evaluate_operators = {ast.Add: operator.add,
+                      ast.Sub: operator.sub,
+                      ast.Mult: operator.mul,
+                      ast.Div: operator.truediv,
+                      ast.Pow: operator.pow,
+                      ast.UAdd: operator.pos,
+                      ast.USub: operator.neg}
+
+def evaluate_node(node):
+    """Evaluate parsed arithmetic expression node"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    elif isinstance(node, ast.BinOp) and type(node.op) in evaluate_operators:
+        left = evaluate_node(node.left)
+        right = evaluate_node(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > MAX_EVALUATE_EXPONENT:
+            raise ValueError('Exponent too large')
+        return evaluate_operators[type(node.op)](left, right)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in evaluate_operators:
+        return evaluate_operators[type(node.op)](evaluate_node(node.operand))
+    raise ValueError('Unsupported expression')
+
+@functools.lru_cache(maxsize=EVALUATE_CACHE_SIZE)
+def evaluate(expression):
+    """Evaluate arithmetic expression of numbers, + - * / ** and parentheses
+
+        Raises ValueError if expression is invalid.
+    """
+    if type(expression) in (int, float):
+        return expression
+    try:
+        return evaluate_node(ast.parse(str(expression).strip(), mode='eval').body)
+    except (SyntaxError, ArithmeticError, TypeError, RecursionError) as e:
+        raise ValueError(str(e))
+
 def rgb2hex(r,g,b,a=None):
     if a:
         return "#{:02x}{:02x}{:02x}{:02x}".format(int(r*255),int(g*255),int(b*255),int(a*255))
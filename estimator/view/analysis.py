@@ -29,7 +29,7 @@ from gi.repository import Gtk, Gdk, GLib, Pango
 
 # local files import
 from . import resource
-from .. import misc, data, undo
+from .. import misc, misc_gtk, data, undo
 from ..undo import undoable
 from .cellrenderercustomtext import CellRendererTextView
 
@@ -653,7 +653,7 @@ class AnalysisView:
         widths = [80, 200, 80, 80, 80, 80]
         expandables = [False, True, False, False, False, False]
 
-        spreadsheet_dialog = misc.SpreadsheetDialog(self.parent, filename, columntypes, captions, [widths, expandables])
+        spreadsheet_dialog = misc_gtk.SpreadsheetDialog(self.parent, filename, columntypes, captions, [widths, expandables])
         models = spreadsheet_dialog.run()
 
         model_copy = copy.deepcopy(self.model)
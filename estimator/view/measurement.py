@@ -27,7 +27,7 @@ import pickle, codecs, os.path, copy, logging
 from gi.repository import Gtk, Gdk, GLib
 
 # local files import
-from .. import misc, data, undo
+from .. import misc, misc_gtk, data, undo
 from ..undo import undoable
 from .scheduledialog import ScheduleDialog
 
@@ -56,7 +56,7 @@ class MeasurementsView:
 
     def add_heading(self):
         """Add a Heading to measurement view"""
-        heading_name = misc.get_user_input_text(self.parent, "Please input Heading. Any additional lines will be printed under the heading.", "Add new Item: Heading", None, True)
+        heading_name = misc_gtk.get_user_input_text(self.parent, "Please input Heading. Any additional lines will be printed under the heading.", "Add new Item: Heading", None, True)
         if heading_name != None:
             # get selection
             selection = self.tree.get_selection()
@@ -67,7 +67,6 @@ class MeasurementsView:
                 self.sch_database.add_measurement_item_at_node(heading, path)
             else: # if no selection append at end
                 self.sch_database.add_measurement_item_at_node(heading, None)
-            self.update_store()
         else:
             # Return status code for main application interface
             return (misc.WARNING,"Item not added")
@@ -105,7 +104,6 @@ class MeasurementsView:
                     self.sch_database.add_measurement_item_at_node(item, None)
             else: # if cancel pressed
                 return (misc.INFO,'Cancelled by user. Item not added')
-        self.update_store()
 
     def delete_selected_row(self):
         """Delete selected rows"""
@@ -119,7 +117,6 @@ class MeasurementsView:
             rows.reverse()
             for row in rows:
                 self.sch_database.delete_row_meas([row])
-                self.update_store()
 
     def copy_selection(self):
         """Copy selected row to clipboard"""
@@ -170,7 +167,6 @@ class MeasurementsView:
                                 path = [path[0]+1]
                         else:
                             pass
-                    self.update_store()
             except:
                 log.warning('MeasurementsView - paste_at_selection - No valid data in clipboard')
         else:
@@ -186,7 +182,7 @@ class MeasurementsView:
             item = self.measurements[path[0]]
             if isinstance(item, data.measurement.MeasurementItemHeading):
                 oldval = copy.deepcopy(item)
-                text = misc.get_user_input_text(self.parent, "Please input Heading. Any additional lines will be printed under the heading.", "Edit Heading", oldval.get_remark(), True)
+                text = misc_gtk.get_user_input_text(self.parent, "Please input Heading. Any additional lines will be printed under the heading.", "Edit Heading", oldval.get_remark(), True)
                 if text is not None:
                     newval = data.measurement.MeasurementItemHeading([text])
                     self.sch_database.edit_measurement_item(path, newval, oldval)
@@ -195,8 +191,6 @@ class MeasurementsView:
                 newval = self.add_custom(oldval, item.itemtype, path)
                 if newval is not None:
                     self.sch_database.edit_measurement_item(path, newval, oldval)
-            # Update GUI
-            self.update_store()
 
     def edit_selected_properties(self):
         """Edit user data of selected item"""
@@ -213,7 +207,7 @@ class MeasurementsView:
                         olddata = oldmodel[1][4]
                         # Setup user data dialog
                         newdata = olddata[:]
-                        project_settings_dialog = misc.UserEntryDialog(self.parent,
+                        project_settings_dialog = misc_gtk.UserEntryDialog(self.parent,
                                                     'Edit User Data',
                                                     newdata,
                                                     item.captions_udata)
@@ -225,10 +219,36 @@ class MeasurementsView:
                             newmodel[1][4] = newdata
                             newitem = data.measurement.MeasurementItemCustom(newmodel[1], newmodel[1][5])
                             self.sch_database.edit_measurement_item(path, newitem, item)
-                            self.update_store()
                         return None
         return (misc.WARNING,'User data not supported')
 
+    def on_database_changed(self, changes):
+        """Refresh store when idle if measurements are modified"""
+        if 'measurement' in changes:
+            meas_changes = changes['measurement']
+            if meas_changes['inserted'] or meas_changes['deleted'] or meas_changes['moved']:
+                self.refresh_all = True
+            self.refresh_ids |= meas_changes['updated']
+            if not self.refresh_pending:
+                self.refresh_pending = True
+                GLib.idle_add(self.on_refresh_idle)
+
+    def on_refresh_idle(self):
+        """Refresh store queued by on_database_changed"""
+        if self.refresh_all or self.measurements is None:
+            self.update_store()
+        else:
+            # Only item contents modified, update affected rows
+            items = self.sch_database.get_measurement_items(self.refresh_ids)
+            for (index, mitem) in items.values():
+                if index < len(self.measurements.items) and mitem is not None:
+                    self.measurements[index] = mitem
+                    self.store[index] = [str(index+1), mitem.get_text(), mitem.get_tooltip()]
+        self.refresh_pending = False
+        self.refresh_all = False
+        self.refresh_ids = set()
+        return False
+
     def update_store(self):
         """Update GUI of MeasurementsView from data model while trying to preserve selection"""
         log.info('MeasurementsView - update_store')
@@ -304,5 +324,11 @@ class MeasurementsView:
         self.tree.connect("key-press-event", self.onKeyPressTreeview)
         self.tree.connect("button-press-event", self.onButtonPressTreeview)
 
+        # Subscribe to database changes
+        self.refresh_pending = False
+        self.refresh_all = False
+        self.refresh_ids = set()
+        self.sch_database.subscribe(self.on_database_changed)
+
         # Update GUI elements according to data
         self.update_store()
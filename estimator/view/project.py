@@ -128,7 +128,7 @@ class ProgramSettings:
         if 'export_break_items' in settings:
             export_break_items_switch.set_active(bool(eval(settings['export_break_items'])))
         sch_mult_entry.set_text(settings['sch_rate_mult_factor'])
-        ana_delete_spin.set_value(int(eval(settings['ana_copy_delete_rows'])))
+        ana_delete_spin.set_value(int(misc.evaluate(settings['ana_copy_delete_rows'])))
         location_button.set_label(library_dir)
 
         # Show settings dialog
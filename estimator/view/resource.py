@@ -22,7 +22,7 @@
 #  
 #  
 
-import pickle, codecs, os.path, copy, logging
+import pickle, codecs, os.path, copy, logging, threading
 from collections import OrderedDict
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -33,7 +33,7 @@ def Currency(x, places=2):
 from gi.repository import Gtk, Gdk, GLib, Pango
 
 # local files import
-from .. import misc, data, undo
+from .. import misc, misc_gtk, data, undo
 from .cellrenderercustomtext import CellRendererTextView
 
 # Setup logger object
@@ -43,13 +43,14 @@ log = logging.getLogger(__name__)
 class ResourceView:
     """Implement resource view"""
         
-    def __init__(self, parent, database, box, compact=False, read_only=False, instance_code_callback=None):
+    def __init__(self, parent, database, box, compact=False, read_only=False, instance_code_callback=None, load_async=False):
         """Setup resource view and connect signals
         
             Arguments:
                 parent: Parent window
                 database: database of items to be displayed
                 box: Box to implement resource view
+                load_async: Populate store in background
         """
         log.info('ResourceView - Initialise')
         
@@ -74,6 +75,8 @@ class ResourceView:
         self.store = Gtk.TreeStore(*([str]*7 + [bool]*7 + [int]))
         self.filter = self.store.filter_new()
         self.filter.set_visible_func(self.filter_func, data=[0,1,2,6])
+        # Codes and categories matching search text from search index
+        self.search_result = None
 
         self.search_field = Gtk.SearchEntry()
         self.search_field.set_width_chars(30)
@@ -148,7 +151,15 @@ class ResourceView:
         # Intialise clipboard
         self.clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
         
-        self.update_store()
+        # Subscribe to database changes
+        self.pending_changes = []
+        if not self.read_only:
+            self.database.subscribe(self.on_database_changed)
+        
+        if load_async:
+            self.update_store_async()
+        else:
+            self.update_store()
 
     def update_store(self):
     
@@ -159,39 +170,35 @@ class ResourceView:
             [model, paths] = selection.get_selected_rows()
             old_item = paths[0].get_indices()
             
-        # Clear store
-        self.store.clear()
-        # Fill in data in treeview
-        res_table = self.database.get_resource_table()
-        for category, items in res_table.items():
-            category_row = ['',category,'','','','','']
-            
-            if self.read_only:
-                bools = [False]*7
-            else:
-                bools = [False,True] + [False]*5
-            
-            category_iter = self.store.append(None, category_row + bools + [700])
+        # Build rows from database
+        rows = self.get_store_rows(self.database.get_resource_table())
             
-            if self.read_only:
-                bools = [False]*7
-            else:
-                bools = [True]*7
+        # Patch store, detaching model from view if many rows change
+        key_columns = [1, 0]
+        initial = len(self.store) == 0
+        changes = len(misc_gtk.get_store_keys(self.store, key_columns) ^ misc_gtk.get_rows_keys(rows))
+        detach = changes > misc.MAX_STORE_CHANGES_ATTACHED
+        if detach:
+            expanded = misc_gtk.get_expanded_rows(self.tree)
+            self.tree.set_model(None)
+        inserted = misc_gtk.patch_store(self.store, rows, key_columns)
+        if detach:
+            self.tree.set_model(self.filter)
             
-            for code, item in items.items():
-                # Add items to store
-                row = []
-                for value in item:
-                    if value is None:
-                        row.append('')
-                    else:    
-                        row.append(str(value))
-                item_iter = self.store.append(category_iter, row + bools + [400])
-                        
-        # Expand all expanders
-        self.tree.expand_all()
-        
-        select_item = old_item
+        # Restore expanded rows and expand new rows
+        if initial:
+            self.tree.expand_all()
+        else:
+            if detach:
+                misc_gtk.expand_rows(self.tree, expanded)
+            new_rows = [Gtk.TreeRowReference.new(self.store, self.store.get_path(iterator)) for iterator in inserted]
+            misc_gtk.expand_rows(self.tree, new_rows)
+        
+        # Set old selection if lost
+        if selection.count_selected_rows() == 0:
+            select_item = old_item
+        else:
+            select_item = None
         # Set old selection
         if select_item is not None:
             if len(select_item) > 0:
@@ -214,6 +221,105 @@ class ResourceView:
             path = Gtk.TreePath.new_from_indices(select_item)
             self.tree.set_cursor(path)
             
+    def get_store_rows(self, res_table):
+        """Return rows of store for resource table in misc_gtk.patch_store format"""
+        rows = []
+        for category, items in res_table.items():
+            category_row = ['',category,'','','','','']
+            
+            if self.read_only:
+                bools = [False]*7
+            else:
+                bools = [False,True] + [False]*5
+            
+            category_row = category_row + bools + [700]
+            
+            if self.read_only:
+                bools = [False]*7
+            else:
+                bools = [True]*7
+            
+            item_rows = []
+            for code, item in items.items():
+                # Add item rows
+                row = []
+                for value in item:
+                    if value is None:
+                        row.append('')
+                    else:    
+                        row.append(str(value))
+                item_rows.append((code, row + bools + [400], None))
+            rows.append((category, category_row, item_rows))
+        return rows
+        
+    def update_store_async(self, callback=None):
+        """Populate empty store from database on a worker thread without blocking GUI"""
+        log.info('ResourceView - update_store_async')
+        
+        def on_fetched(rows):
+            misc_gtk.append_store_idle(self.store, rows, on_populated)
+            return False
+            
+        def on_populated():
+            self.tree.expand_all()
+            if callback:
+                callback()
+                
+        def fetch():
+            rows = self.get_store_rows(self.database.get_resource_table())
+            GLib.idle_add(on_fetched, rows)
+            
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+        
+    def on_database_changed(self, changes):
+        """Queue database changes to be applied to store when idle"""
+        if 'resource' in changes or 'resource_category' in changes:
+            self.pending_changes.append(changes)
+            if len(self.pending_changes) == 1:
+                GLib.idle_add(self.apply_changes)
+            
+    def apply_changes(self):
+        """Patch rows of store affected by queued database changes"""
+        pending = self.pending_changes
+        self.pending_changes = []
+        
+        structural = False
+        updated = set()
+        for changes in pending:
+            if 'resource_category' in changes:
+                structural = True
+            if 'resource' in changes:
+                res_changes = changes['resource']
+                updated |= res_changes['updated'] | res_changes['inserted']
+                if res_changes['inserted'] or res_changes['deleted'] or res_changes['moved']:
+                    structural = True
+        
+        # Read layout and row iters of store
+        layout = []
+        iters = dict()
+        for category_row in self.store:
+            codes = []
+            for item_row in category_row.iterchildren():
+                codes.append(item_row[0])
+                iters[item_row[0]] = item_row.iter
+            layout.append((category_row[1], codes))
+            
+        # Rows inserted, deleted or moved outside the view need a rebuild
+        if structural and layout != self.database.get_resource_layout():
+            self.update_store()
+            return False
+        
+        # Update modified rows
+        if updated:
+            for code, item in self.database.get_resource_table(flat=True, codes=updated).items():
+                if code in iters:
+                    row = self.store[iters[code]]
+                    for column, value in enumerate(item[0:7]):
+                        row[column] = '' if value is None else str(value)
+        return False
+            
     def insert_row_from_database(self, path, code):
         
         if len(path) == 1:
@@ -646,6 +752,13 @@ class ResourceView:
             return False
 
         key = self.search_field.get_text()
+        # Use search index result if available
+        if self.search_result is not None:
+            (codes, categories) = self.search_result
+            if model[model_iter][0] != '':
+                return model[model_iter][0] in codes
+            else:
+                return model[model_iter][1] in categories or check_key(key, model_iter)
         # Check item
         if check_key(key, model_iter) == True:
             return True
@@ -656,6 +769,13 @@ class ResourceView:
     # Callbacks
 
     def on_search(self, entry):
+        # Get matching resources from search index
+        key = self.search_field.get_text()
+        matches = self.database.search_resources(key) if key.strip() else None
+        if matches is None:
+            self.search_result = None
+        else:
+            self.search_result = (set(matches), set(matches.values()))
         # Refilter model
         self.filter.refilter()
         # Expand all expanders
@@ -782,9 +902,9 @@ class ResourceView:
         
         try:  # check whether item evaluates fine
             if column == 3:
-                evaluated_no = float(Currency(eval(new_text)))
+                evaluated_no = float(Currency(misc.evaluate(new_text)))
             else:
-                evaluated_no = round(eval(new_text), 2)
+                evaluated_no = round(misc.evaluate(new_text), 2)
                 
             if evaluated_no == 0:
                 evaluated = '0'
@@ -894,38 +1014,42 @@ class SelectResourceDialog:
             
             self.resourceviews['Current'] = res_view
             
-        for library in self.libraries:
-            box_res = Gtk.Box.new(Gtk.Orientation.VERTICAL,0)
-            self.stack.add_named(box_res, library)
-            with self.database.using_library(library):
-                res_view = ResourceView(self.dialog_window, 
-                                        self.database, 
-                                        box_res, 
-                                        compact=False,
-                                        read_only=True)
-                self.resourceviews[library] = res_view
-                # Overide functions of resource view
-                res_view.select_action = self.select_action
-            # Disable selection in database selection mode
-            if select_database_mode:
-                res_view.tree.get_selection().set_mode(Gtk.SelectionMode.NONE)
-            # Multiple item selection in select resource mode
-            else:
-                res_view.tree.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
-                
+        # Library views are built when first shown
         if not select_database_mode:
             self.resourceview = self.resourceviews['Current']
+            self.resourceview.tree.grab_focus()
         else:
-            self.resourceview = self.resourceviews[self.libraries[0]]
-            
-        self.resourceview.tree.grab_focus()
+            self.resourceview = None
         
         # Connect signals
         self.library_combo.connect("changed", self.on_combo_changed)
         
+    def get_library_view(self, name):
+        """Get resource view of library, building it in background on first use"""
+        if name not in self.resourceviews:
+            box_res = Gtk.Box.new(Gtk.Orientation.VERTICAL,0)
+            self.stack.add_named(box_res, name)
+            res_view = ResourceView(self.dialog_window, 
+                                    self.database.get_library_reader(name), 
+                                    box_res, 
+                                    compact=False,
+                                    read_only=True,
+                                    load_async=True)
+            # Overide functions of resource view
+            res_view.select_action = self.select_action
+            # Disable selection in database selection mode
+            if self.select_database_mode:
+                res_view.tree.get_selection().set_mode(Gtk.SelectionMode.NONE)
+            # Multiple item selection in select resource mode
+            else:
+                res_view.tree.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+            box_res.show_all()
+            self.resourceviews[name] = res_view
+        return self.resourceviews[name]
+        
     def on_combo_changed(self, combo):
         name = combo.get_active_text()
-        self.resourceview = self.resourceviews[name]
+        self.resourceview = self.get_library_view(name)
         self.stack.set_visible_child_name(name)
         self.resourceview.tree.grab_focus()
 
@@ -938,6 +1062,9 @@ class SelectResourceDialog:
         if not self.select_database_mode:
             # Update current item resource view
             self.resourceviews['Current'].update_store()
+        elif self.resourceview is None and self.libraries:
+            # Build view of selected library
+            self.on_combo_changed(self.library_combo)
             
         # Show Dialog window
         self.dialog_window.show_all()
@@ -958,8 +1085,7 @@ class SelectResourceDialog:
                         else:
                             name = self.library_combo.get_active_text()
                             # Get resource from selected library
-                            with self.database.using_library(name):
-                                selected_resource = self.database.get_resource(selected_code, modify_code=True)
+                            selected_resource = self.database.get_library_reader(name).get_resource(selected_code, modify_code=True)
                         selected_resources.append(selected_resource)
 
 
@@ -1093,17 +1219,17 @@ class ResourceEntryDialog():
         if response == Gtk.ResponseType.OK:
             # Get formated text and update item_values
             try:
-                rate = Currency(eval(self.entrys['Rate'].get_text()))
+                rate = Currency(misc.evaluate(self.entrys['Rate'].get_text()))
             except:
                 self.entrys['Rate'].set_text('0')
                 return self.run()
             try:
-                tax = Currency(eval(self.entrys['Tax'].get_text()))
+                tax = Currency(misc.evaluate(self.entrys['Tax'].get_text()))
             except:
                 self.entrys['Tax'].set_text('0')
                 return self.run()
             try:
-                discount = Currency(eval(self.entrys['Discount'].get_text()))
+                discount = Currency(misc.evaluate(self.entrys['Discount'].get_text()))
             except:
                 self.entrys['Discount'].set_text('0')
                 return self.run()
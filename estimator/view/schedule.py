@@ -22,7 +22,7 @@
 #
 #
 
-import logging, pickle, codecs
+import logging, pickle, codecs, threading
 from collections import OrderedDict
 from decimal import Decimal, ROUND_HALF_UP
 # Rates rounding function
@@ -38,7 +38,7 @@ def Currency(x, places=2):
 from gi.repository import Gtk, Gdk, GLib, Pango
 
 # local files import
-from .. import misc, data
+from .. import misc, misc_gtk, data
 from . import analysis
 from .cellrenderercustomtext import CellRendererTextView
 
@@ -48,13 +48,14 @@ log = logging.getLogger(__name__)
 class ScheduleView:
     """Implement Schedule view"""
 
-    def __init__(self, parent, database, box, compact=False, show_sum=False, read_only=False, instance_code_callback=None):
+    def __init__(self, parent, database, box, compact=False, show_sum=False, read_only=False, instance_code_callback=None, load_async=False):
         """Setup schedule view and connect signals
 
             Arguments:
                 parent: Parent window
                 database: database of items to be displayed
                 box: Box to implement schedule view
+                load_async: Populate store in background
         """
         log.info('ScheduleView - Initialise')
 
@@ -82,6 +83,8 @@ class ScheduleView:
         self.store = Gtk.TreeStore(*([str]*7 + [bool] + [int] + [bool]*5 + [str]*2 + [int]))
         self.filter = self.store.filter_new()
         self.filter.set_visible_func(self.filter_func, data=[0,15,2,6])
+        # Codes and categories matching search text from search index
+        self.search_result = None
 
         self.search_field = Gtk.SearchEntry()
         self.search_field.set_width_chars(30)
@@ -160,7 +163,15 @@ class ScheduleView:
         # Intialise clipboard
         self.clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
 
-        self.update_store()
+        # Subscribe to database changes
+        self.pending_changes = []
+        if not self.read_only:
+            self.database.subscribe(self.on_database_changed)
+
+        if load_async:
+            self.update_store_async()
+        else:
+            self.update_store()
 
     def update_store(self, mark=False, select_path=None):
         """
@@ -176,20 +187,82 @@ class ScheduleView:
             [model, paths] = selection.get_selected_rows()
             old_item = paths[-1].get_indices()
 
-        # Clear store
-        self.store.clear()
+        # Build rows from database
+        rows = self.get_store_rows(self.database.get_item_table())
+
+        # Patch store, detaching model from view if many rows change
+        key_columns = [1, 0, 0]
+        initial = len(self.store) == 0
+        changes = len(misc_gtk.get_store_keys(self.store, key_columns) ^ misc_gtk.get_rows_keys(rows))
+        detach = changes > misc.MAX_STORE_CHANGES_ATTACHED
+        if detach:
+            expanded = misc_gtk.get_expanded_rows(self.tree)
+            self.tree.set_model(None)
+        inserted = misc_gtk.patch_store(self.store, rows, key_columns)
+        if detach:
+            self.tree.set_model(self.filter)
+
+        # If mark, check rates with analysed rate
+        if mark:
+            metrics = self.mark_rates(self.database.get_analysed_rates())
 
-        # Metrics to be returned on mark
-        with_mismatch = 0
-        delta1 = 0
-        delta2 = 0
-        delta3 = 0
-        without_analysis = 0
-        item_count = 0
+        # Restore expanded rows and expand new rows
+        if initial:
+            self.tree.expand_all()
+        else:
+            if detach:
+                misc_gtk.expand_rows(self.tree, expanded)
+            new_rows = [Gtk.TreeRowReference.new(self.store, self.store.get_path(iterator)) for iterator in inserted]
+            misc_gtk.expand_rows(self.tree, new_rows)
+
+        # Set selection to the nearest item that was selected if lost
+        if select_path is None:
+            if selection.count_selected_rows() == 0:
+                select_item = old_item
+            else:
+                select_item = None
+        else:
+            select_item = select_path
+
+        if select_item is not None:
+            if len(select_item) > 0:
+                if len(self.store) == 0:
+                    return
+                elif select_item[0] >= len(self.store):
+                    select_item = [len(self.store)-1]
+                elif len(select_item) > 1:
+                    path = Gtk.TreePath.new_from_indices(select_item[0:1])
+                    try:
+                        store_row = self.store.get_iter(path)
+                        store_row_len = self.store.iter_n_children(store_row)
+                        if store_row_len == 0:
+                            select_item = [select_item[0]]
+                        elif select_item[1] >= store_row_len:
+                            select_item = [select_item[0], store_row_len-1]
+                        elif len(select_item) == 3:
+                            path = Gtk.TreePath.new_from_indices(select_item[0:2])
+                            try:
+                                store_row_2 = self.store.get_iter(path)
+                                store_row_2_len = self.store.iter_n_children(store_row_2)
+                                if store_row_2_len == 0:
+                                    select_item = [select_item[0],select_item[1]]
+                                elif select_item[2] >= store_row_2_len:
+                                    select_item[2] = store_row_2_len-1
+                            except ValueError:
+                                select_item = [select_item[0]]
+                    except ValueError:
+                        return
+            path = Gtk.TreePath.new_from_indices(select_item)
+            self.tree.set_cursor(path)
 
-        # Fill in data in treeview
+        # Return metrics
+        if mark:
+            return metrics
+
+    def get_store_rows(self, sch_table):
+        """Return rows of store for schedule table in misc_gtk.patch_store format"""
+        rows = []
         sum_total = 0
-        sch_table = self.database.get_item_table()
         for category, items in sch_table.items():
             data = ['', category, '', '', '', '', '']
             if self.read_only:
@@ -197,9 +270,9 @@ class ScheduleView:
             else:
                 bools = [False] + [True] + [False]*5
             category_row = data + bools + [misc.MEAS_COLOR_NORMAL, category, 700]
-            category_iter = self.store.append(None, category_row)
+            item_rows = []
             for code, item_list in items.items():
-                # Add items to store
+                # Add item rows
                 item = item_list[0]
                 item_desc = misc.get_ellipsized_text(item[1], misc.MAX_DESC_LEN)
                 item_unit = item[2]
@@ -224,33 +297,8 @@ class ScheduleView:
                     colour = misc.MEAS_COLOR_NORMAL
                 full_description = item[1]
 
-                # If mark, check rates with analysed rate
-                if mark and item_unit !='':
-                    sch_item = self.database.get_item(code)
-                    if sch_item.results:
-                        delta = abs(Currency(sch_item.get_ana_rate()) - Currency(item[3]))
-                        if delta == 0:
-                            colour = misc.MEAS_COLOR_NORMAL
-                        elif delta <= 0.1:
-                            colour = misc.MEAS_COLOR_LOCKED
-                            with_mismatch = with_mismatch + 1
-                            delta1 = delta1 + 1
-                        elif delta <= 1:
-                            colour = misc.MEAS_COLOR_LOCKED_L1
-                            with_mismatch = with_mismatch + 1
-                            delta2 = delta2 + 1
-                        else:
-                            colour = misc.MEAS_COLOR_LOCKED_L2
-                            with_mismatch = with_mismatch + 1
-                            delta3 = delta3 + 1
-                    else:
-                        colour = misc.MEAS_COLOR_MISSING
-                        without_analysis = without_analysis + 1
-
-                    item_count = item_count + 1
-
                 item_row = data + bools + [colour, full_description, 400]
-                item_iter = self.store.append(category_iter, item_row)
+                sub_item_rows = []
 
                 for sub_item in item_list[1]:
                     code = sub_item[0]
@@ -277,32 +325,10 @@ class ScheduleView:
 
                     full_description = sub_item[1]
 
-                    # If mark, check rates with analysed rate
-                    if mark and unit !='':
-                        sch_item = self.database.get_item(code)
-                        if sch_item.results:
-                            delta = abs(Currency(sch_item.get_ana_rate()) - Currency(sub_item[3]))
-                            if delta == 0:
-                                colour = misc.MEAS_COLOR_NORMAL
-                            elif delta <= 0.1:
-                                colour = misc.MEAS_COLOR_LOCKED
-                                with_mismatch = with_mismatch + 1
-                                delta1 = delta1 + 1
-                            elif delta <= 1:
-                                colour = misc.MEAS_COLOR_LOCKED_L1
-                                with_mismatch = with_mismatch + 1
-                                delta2 = delta2 + 1
-                            else:
-                                colour = misc.MEAS_COLOR_LOCKED_L2
-                                with_mismatch = with_mismatch + 1
-                                delta3 = delta3 + 1
-                        else:
-                            colour = misc.MEAS_COLOR_MISSING
-                            without_analysis = without_analysis + 1
-                        item_count = item_count + 1
-
                     row = data + bools + [colour, full_description, 400]
-                    self.store.append(item_iter, row)
+                    sub_item_rows.append((code, row, None))
+                item_rows.append((item_list[0][0], item_row, sub_item_rows))
+            rows.append((category, category_row, item_rows))
 
         # Append sum row
         if self.show_sum:
@@ -310,51 +336,169 @@ class ScheduleView:
             bools = [False]*7
             colour = misc.MEAS_COLOR_HIGHLIGHTED
             row = data + bools + [colour, '', 700]
-            self.store.append(None, row)
+            rows.append(('SUM TOTAL', row, None))
 
-        # Expand all expanders
-        self.tree.expand_all()
+        return rows
 
-        # Set selection to the nearest item that was selected
-        if select_path is None:
-            select_item = old_item
-        else:
-            select_item = select_path
+    def update_store_async(self, callback=None):
+        """Populate empty store from database on a worker thread without blocking GUI"""
+        log.info('ScheduleView - update_store_async')
 
-        if select_item is not None:
-            if len(select_item) > 0:
-                if len(self.store) == 0:
-                    return
-                elif select_item[0] >= len(self.store):
-                    select_item = [len(self.store)-1]
-                elif len(select_item) > 1:
-                    path = Gtk.TreePath.new_from_indices(select_item[0:1])
-                    try:
-                        store_row = self.store.get_iter(path)
-                        store_row_len = self.store.iter_n_children(store_row)
-                        if store_row_len == 0:
-                            select_item = [select_item[0]]
-                        elif select_item[1] >= store_row_len:
-                            select_item = [select_item[0], store_row_len-1]
-                        elif len(select_item) == 3:
-                            path = Gtk.TreePath.new_from_indices(select_item[0:2])
-                            try:
-                                store_row_2 = self.store.get_iter(path)
-                                store_row_2_len = self.store.iter_n_children(store_row_2)
-                                if store_row_2_len == 0:
-                                    select_item = [select_item[0],select_item[1]]
-                                elif select_item[2] >= store_row_2_len:
-                                    select_item[2] = store_row_2_len-1
-                            except ValueError:
-                                select_item = [select_item[0]]
-                    except ValueError:
-                        return
-            path = Gtk.TreePath.new_from_indices(select_item)
-            self.tree.set_cursor(path)
+        def on_fetched(rows):
+            misc_gtk.append_store_idle(self.store, rows, on_populated)
+            return False
 
-        # Return metrics
-        if mark:
-            return [item_count, with_mismatch, delta1, delta2, delta3, without_analysis]
+        def on_populated():
+            self.tree.expand_all()
+            if callback:
+                callback()
+
+        def fetch():
+            rows = self.get_store_rows(self.database.get_item_table())
+            GLib.idle_add(on_fetched, rows)
+
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+
+    def mark_rates(self, analysed_rates):
+        """Set row background of items with rates differing from analysed rates
+
+            Arguments:
+                analysed_rates: dict of code to (stored_rate, analysed_rate, has_analysis)
+            Returns:
+                [item_count, with_mismatch, delta1, delta2, delta3, without_analysis]
+        """
+        with_mismatch = 0
+        delta1 = 0
+        delta2 = 0
+        delta3 = 0
+        without_analysis = 0
+        item_count = 0
+
+        def mark_row(row):
+            nonlocal with_mismatch, delta1, delta2, delta3, without_analysis, item_count
+            code = row[0]
+            if row[2] != '' and code in analysed_rates:
+                [stored_rate, analysed_rate, has_analysis] = analysed_rates[code]
+                if has_analysis:
+                    delta = abs(Currency(analysed_rate) - Currency(stored_rate))
+                    if delta == 0:
+                        colour = misc.MEAS_COLOR_NORMAL
+                    elif delta <= 0.1:
+                        colour = misc.MEAS_COLOR_LOCKED
+                        with_mismatch = with_mismatch + 1
+                        delta1 = delta1 + 1
+                    elif delta <= 1:
+                        colour = misc.MEAS_COLOR_LOCKED_L1
+                        with_mismatch = with_mismatch + 1
+                        delta2 = delta2 + 1
+                    else:
+                        colour = misc.MEAS_COLOR_LOCKED_L2
+                        with_mismatch = with_mismatch + 1
+                        delta3 = delta3 + 1
+                else:
+                    colour = misc.MEAS_COLOR_MISSING
+                    without_analysis = without_analysis + 1
+                row[14] = colour
+                item_count = item_count + 1
+
+        for category_row in self.store:
+            for item_row in category_row.iterchildren():
+                mark_row(item_row)
+                for sub_item_row in item_row.iterchildren():
+                    mark_row(sub_item_row)
+
+        return [item_count, with_mismatch, delta1, delta2, delta3, without_analysis]
+
+    def update_marks(self, callback=None):
+        """Evaluate analysed rates in a background thread and mark rows on completion
+
+            Arguments:
+                callback: Called with metrics returned by mark_rates
+        """
+        def on_evaluated(analysed_rates):
+            metrics = self.mark_rates(analysed_rates)
+            if callback:
+                callback(metrics)
+            return False
+
+        def evaluate():
+            try:
+                analysed_rates = self.database.get_analysed_rates()
+            except Exception as e:
+                log.error('ScheduleView - update_marks - Error evaluating rates - ' + str(e))
+                return
+            GLib.idle_add(on_evaluated, analysed_rates)
+
+        thread = threading.Thread(target=evaluate)
+        thread.daemon = True
+        thread.start()
+
+    def on_database_changed(self, changes):
+        """Queue database changes to be applied to store when idle"""
+        if 'schedule' in changes or 'schedule_category' in changes:
+            self.pending_changes.append(changes)
+            if len(self.pending_changes) == 1:
+                GLib.idle_add(self.apply_changes)
+
+    def apply_changes(self):
+        """Patch rows of store affected by queued database changes"""
+        pending = self.pending_changes
+        self.pending_changes = []
+
+        structural = False
+        updated = set()
+        for changes in pending:
+            if 'schedule_category' in changes:
+                structural = True
+            if 'schedule' in changes:
+                sch_changes = changes['schedule']
+                updated |= sch_changes['updated'] | sch_changes['inserted']
+                if sch_changes['inserted'] or sch_changes['deleted'] or sch_changes['moved']:
+                    structural = True
+
+        # Read layout and row iters of store
+        layout = []
+        iters = dict()
+        for category_row in self.store:
+            if self.show_sum and category_row.next is None:
+                break
+            items = []
+            for item_row in category_row.iterchildren():
+                items.append((item_row[0], False))
+                iters[item_row[0]] = item_row.iter
+                for sub_item_row in item_row.iterchildren():
+                    items.append((sub_item_row[0], True))
+                    iters[sub_item_row[0]] = sub_item_row.iter
+            layout.append((category_row[1], items))
+
+        # Rows inserted, deleted or moved outside the view need a rebuild
+        if structural and layout != self.database.get_item_layout():
+            self.update_store()
+            return False
+
+        # Update modified rows
+        if updated:
+            for code, item in self.database.get_item_table(flat=True, codes=updated).items():
+                if code in iters:
+                    self.set_row_from_item(iters[code], item)
+            self.update_sum()
+        return False
+
+    def set_row_from_item(self, iterator, item):
+        """Set values of row at iterator from flat item table entry"""
+        rate = item[3] if item[3] else 0
+        qty = item[4] if item[4] else 0
+        row = self.store[iterator]
+        row[1] = misc.get_ellipsized_text(item[1], misc.MAX_DESC_LEN)
+        row[2] = item[2] if item[2] else ''
+        row[3] = str(rate) if rate != 0 else ''
+        row[4] = str(qty) if qty != 0 else ''
+        row[5] = str(Currency(rate*qty)) if rate*qty != 0 else ''
+        row[6] = item[5] if item[5] else ''
+        row[14] = item[7] if item[7] else misc.MEAS_COLOR_NORMAL
+        row[15] = item[1]
 
     def update_sum(self):
         """Update sum of amounts"""
@@ -586,7 +730,6 @@ class ScheduleView:
         codes = self.get_selected_codes()
         if codes:
             if self.database.update_rates(codes):
-                self.update_store()
                 return True
             else:
                 return False
@@ -598,7 +741,6 @@ class ScheduleView:
         codes = self.get_selected_codes()
         if codes:
             if self.database.update_qty(codes, rounding):
-                self.update_store()
                 return True
             else:
                 return False
@@ -773,6 +915,13 @@ class ScheduleView:
             return False
 
         key = self.search_field.get_text()
+        # Use search index result if available
+        if self.search_result is not None:
+            (codes, categories) = self.search_result
+            if model[model_iter][0] != '':
+                return model[model_iter][0] in codes
+            else:
+                return model[model_iter][1] in categories or check_key(key, model_iter)
         # Check item
         if check_key(key, model_iter) == True:
             return True
@@ -784,6 +933,19 @@ class ScheduleView:
     # Callbacks
 
     def on_search(self, entry):
+        # Get matching items and their parents from search index
+        key = self.search_field.get_text()
+        matches = self.database.search_items(key) if key.strip() else None
+        if matches is None:
+            self.search_result = None
+        else:
+            codes = set(matches)
+            categories = set()
+            for (parent_code, category) in matches.values():
+                if parent_code:
+                    codes.add(parent_code)
+                categories.add(category)
+            self.search_result = (codes, categories)
         # Refilter model
         self.filter.refilter()
         # Expand all expanders
@@ -922,9 +1084,9 @@ class ScheduleView:
 
         try:  # check whether item evaluates fine
             if column == 3:
-                evaluated_no = float(Currency(eval(new_text)))
+                evaluated_no = float(Currency(misc.evaluate(new_text)))
             else:
-                evaluated_no = round(eval(new_text), 4)
+                evaluated_no = round(misc.evaluate(new_text), 4)
 
             if evaluated_no == 0:
                 evaluated = ''
@@ -1032,30 +1194,34 @@ class SelectScheduleDialog:
             box.pack_start(self.stack, True, True, 0)
 
 
+            # Library views are built when first shown
             self.scheduleviews = dict()
-            for library in self.libraries:
-                box_res = Gtk.Box.new(Gtk.Orientation.VERTICAL,0)
-                self.stack.add_named(box_res, library)
-                with self.database.using_library(library):
-                    sch_view = ScheduleView(self.dialog_window,
-                                            self.database,
-                                            box_res,
-                                            compact = False,
-                                            read_only = True)
-                    self.scheduleviews[library] = sch_view
-                    # Overide functions of schedule view
-                    sch_view.select_action = self.select_action
-                    sch_view.select_action_alt = self.select_action_alt
-            if self.scheduleviews:
-                self.scheduleview = self.scheduleviews[self.libraries[0]]
-                self.scheduleview.tree.grab_focus()
+            self.scheduleview = None
 
             # Connect signals
             self.library_combo.connect("changed", self.on_combo_changed)
 
+    def get_library_view(self, name):
+        """Get schedule view of library, building it in background on first use"""
+        if name not in self.scheduleviews:
+            box_res = Gtk.Box.new(Gtk.Orientation.VERTICAL,0)
+            self.stack.add_named(box_res, name)
+            sch_view = ScheduleView(self.dialog_window,
+                                    self.database.get_library_reader(name),
+                                    box_res,
+                                    compact = False,
+                                    read_only = True,
+                                    load_async = True)
+            # Overide functions of schedule view
+            sch_view.select_action = self.select_action
+            sch_view.select_action_alt = self.select_action_alt
+            box_res.show_all()
+            self.scheduleviews[name] = sch_view
+        return self.scheduleviews[name]
+
     def on_combo_changed(self, combo):
         name = combo.get_active_text()
-        self.scheduleview = self.scheduleviews[name]
+        self.scheduleview = self.get_library_view(name)
         self.stack.set_visible_child_name(name)
         self.scheduleview.tree.grab_focus()
 
@@ -1065,6 +1231,10 @@ class SelectScheduleDialog:
             Returns:
             Returns Schedule items or None if user does not select any item.
         """
+        # Build view of selected library
+        if not self.simple and self.scheduleview is None and self.libraries:
+            self.on_combo_changed(self.library_combo)
+
         # Show Dialog window
         self.dialog_window.show_all()
         response = self.dialog_window.run()
@@ -1086,20 +1256,21 @@ class SelectScheduleDialog:
             if response == Gtk.ResponseType.OK:
                 if selected_codes:
                     # Get settings
-                    delete_rows = int(eval(self.settings['ana_copy_delete_rows']))
+                    delete_rows = int(misc.evaluate(self.settings['ana_copy_delete_rows']))
                     ana_rows = self.settings['ana_copy_add_items']
                     sch_mult_text = self.settings['sch_rate_mult_factor']
                     try:
-                        sch_mult = Currency(eval(sch_mult_text), 5)
+                        sch_mult = Currency(misc.evaluate(sch_mult_text), 5)
                     except:
                         sch_mult = 1
 
-                    for selected_code in selected_codes:
-                        # Get item from selected library
-                        with self.database.using_library(name):
-                            item = self.database.get_item(selected_code)
-                            proj_code = self.database.get_project_settings()['project_item_code']
+                    # Get items from selected library
+                    library = self.database.get_library_reader(name)
+                    items = library.get_items(selected_codes)
+                    proj_code = library.get_project_settings()['project_item_code']
 
+                    for selected_code in selected_codes:
+                        item = items.get(selected_code)
                         if item:
                             # Modify current item according to settings
                             item.rate = item.rate * sch_mult
@@ -1121,19 +1292,20 @@ class SelectScheduleDialog:
                     if selected_items:
                         # Hide and Return
                         codes = [item.code for item in selected_items]
-                        with self.database.using_library(name):
-                            sub_ana_items = self.database.get_sub_ana_items(codes, modify_res_code=True)
+                        sub_ana_items = library.get_sub_ana_items(codes, modify_res_code=True)
                         self.dialog_window.hide()
                         return selected_items, sub_ana_items
 
             # Add without modiying
             elif response == Gtk.ResponseType.APPLY:
                 if selected_codes:
+                    # Get items from selected library
+                    library = self.database.get_library_reader(name)
+                    items = library.get_items(selected_codes)
+                    proj_code = library.get_project_settings()['project_item_code']
+
                     for selected_code in selected_codes:
-                        # Get item from selected library
-                        with self.database.using_library(name):
-                            item = self.database.get_item(selected_code)
-                            proj_code = self.database.get_project_settings()['project_item_code']
+                        item = items.get(selected_code)
                         if item:
                             # Modify item reference
                             remarks = proj_code + ' ' + item.code
@@ -1145,8 +1317,7 @@ class SelectScheduleDialog:
                     if selected_items:
                         # Hide and Return
                         codes = [item.code for item in selected_items]
-                        with self.database.using_library(name):
-                            sub_ana_items = self.database.get_sub_ana_items(codes, modify_res_code=True)
+                        sub_ana_items = library.get_sub_ana_items(codes, modify_res_code=True)
                         self.dialog_window.hide()
                         return selected_items, sub_ana_items
 
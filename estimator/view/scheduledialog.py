@@ -26,7 +26,7 @@ import copy, logging, codecs, pickle, textwrap
 from gi.repository import Gtk, Gdk, GLib, Pango
 
 # local files import
-from .. import misc, data, undo
+from .. import misc, misc_gtk, data, undo
 from . import schedule
 from .cellrenderercustomtext import CellRendererTextView
 from .schedule import SelectScheduleDialog
@@ -56,7 +56,7 @@ class ScheduleViewGeneric:
         """
         try:  # check whether item evaluates fine
             if new_text != '':
-                eval(new_text)
+                misc.evaluate(new_text)
         except:
             log.warning("ScheduleViewGeneric - onScheduleCellEditedNum - evaluation of ["
             + new_text + "] failed")
@@ -330,14 +330,14 @@ class ScheduleViewGeneric:
                         if columntype == misc.MEAS_DESC:
                             display_item.append(item_elem)
                         elif columntype == misc.MEAS_NO:
-                            value = str(int(eval(item_elem)))
+                            value = str(int(misc.evaluate(item_elem)))
                             display_item.append(value)
                         elif columntype == misc.MEAS_L:
-                            value = str(round(float(eval(item_elem)), 3))
+                            value = str(round(float(misc.evaluate(item_elem)), 3))
                             display_item.append(value)
                     else:
                         display_item.append("")
-                except TypeError:
+                except (TypeError, ValueError):
                     display_item.append("")
                     log.warning('ScheduleViewGeneric - Wrong value loaded in store - '  + str(item_elem))
             self.store[row] = display_item
@@ -564,7 +564,7 @@ class ScheduleDialog:
 
     def onButtonScheduleAddMultPressed(self, button):
         """Add multiple rows to schedule"""
-        user_input = misc.get_user_input_text(self.window, "Please enter the number \nof rows to be inserted",
+        user_input = misc_gtk.get_user_input_text(self.window, "Please enter the number \nof rows to be inserted",
                                              "Number of Rows")
         try:
             number_of_rows = int(user_input)
@@ -615,7 +615,7 @@ class ScheduleDialog:
             elif columntype == misc.MEAS_CUST:
                 spread_col_types.append(None)
 
-        spreadsheet_dialog = misc.SpreadsheetDialog(self.window, filename, spread_col_types, self.captions, self.dimensions, allow_formula=True)
+        spreadsheet_dialog = misc_gtk.SpreadsheetDialog(self.window, filename, spread_col_types, self.captions, self.dimensions, allow_formula=True)
         models = spreadsheet_dialog.run()
 
         items = []
@@ -31,7 +31,8 @@ from gi.repository import Gtk, Gdk, GLib, GObject
 # Get logger object
 log = logging.getLogger()
 
-from estimator import MainApp, misc
+from estimator import misc
+from estimator.app import MainApp
 
 if __name__ == '__main__':
     # Setup logging
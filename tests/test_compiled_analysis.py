@@ -0,0 +1,39 @@
+"""Tests of compiled analysis of rates against evaluation of item models"""
+
+import shutil
+
+import pytest
+
+from estimator import undo, misc
+from estimator.data.schedule import ScheduleDatabase
+
+
+@pytest.fixture
+def library(tmp_path):
+    """Open copy of bundled library as a project"""
+    filename = str(tmp_path / 'library.eproj')
+    shutil.copyfile(misc.abs_path('database', 'DSREM2022.eproj'), filename)
+    database = ScheduleDatabase(undo.Stack())
+    assert database.validate_database(filename) == [True]
+    database.open_database(filename)
+    yield database
+    database.close_database()
+
+
+def test_analysed_rates_match_evaluate_results(library):
+    rates = library.get_analysed_rates()
+    items = library.get_items(list(rates))
+    assert len(items) == len(rates) > 0
+
+    for code, (stored_rate, analysed_rate, has_analysis) in rates.items():
+        item = items[code]
+        assert has_analysis == bool(item.ana_items), code
+        if has_analysis:
+            item.evaluate_results()
+            assert analysed_rate == item.get_ana_rate(), code
+
+
+def test_analysed_rates_of_selected_codes(library):
+    rates = library.get_analysed_rates()
+    codes = list(rates)[::10]
+    assert library.get_analysed_rates(codes) == {code: rates[code] for code in codes}
@@ -0,0 +1,107 @@
+"""Tests of composite indexes used by listing and analysis queries"""
+
+import sqlite3
+
+import pytest
+
+from estimator import undo, misc
+from estimator.data.schedule import ScheduleDatabase, ScheduleItemModel
+
+
+def get_query_plan(database, query):
+    """Return EXPLAIN QUERY PLAN details of peewee query joined as text"""
+    (sql, params) = query.sql()
+    cursor = database.database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+    return ' | '.join(row[3] for row in cursor.fetchall())
+
+
+def get_index_names(filename):
+    connection = sqlite3.connect(filename)
+    try:
+        return {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        connection.close()
+
+
+INDEX_NAMES = {'scheduletable_category_id_parent_id_order',
+               'scheduletable_parent_id_suborder',
+               'resourcetable_category_id_order',
+               'sequencetable_id_sch_id_itemtype',
+               'resourceitemtable_id_sch_id_id_seq_id'}
+
+
+@pytest.fixture
+def project():
+    """Create new in memory project"""
+    database = ScheduleDatabase(undo.Stack())
+    database.create_new_database()
+    yield database
+    database.close_database()
+
+
+def test_schedule_items_listed_by_index(project):
+    table = project.ScheduleTable
+    query = (table.select().where((table.category == 1) & (table.parent == None))
+             .order_by(table.order))
+    plan = get_query_plan(project, query)
+    assert 'scheduletable_category_id_parent_id_order' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_schedule_sub_items_ordered_by_index(project):
+    table = project.ScheduleTable
+    query = table.select().where(table.parent == 1).order_by(table.suborder)
+    plan = get_query_plan(project, query)
+    assert 'scheduletable_parent_id_suborder' in plan
+    assert 'TEMP B-TREE' not in plan
+
+    query = table.select().where(table.parent != None).order_by(table.parent, table.suborder)
+    plan = get_query_plan(project, query)
+    assert 'scheduletable_parent_id_suborder' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_resources_listed_by_index(project):
+    table = project.ResourceTable
+    query = table.select().where(table.category == 1).order_by(table.order)
+    plan = get_query_plan(project, query)
+    assert 'resourcetable_category_id_order' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_analysis_rows_looked_up_by_index(project):
+    table = project.SequenceTable
+    query = table.select().where((table.id_sch == 1) & (table.itemtype == ScheduleItemModel.ANA_TIMES))
+    assert 'sequencetable_id_sch_id_itemtype' in get_query_plan(project, query)
+
+    table = project.ResourceItemTable
+    query = table.select().where((table.id_sch == 1) & (table.id_seq == 1))
+    assert 'resourceitemtable_id_sch_id_id_seq_id' in get_query_plan(project, query)
+
+
+def test_indexes_added_on_migration(tmp_path):
+    filename = str(tmp_path / 'project.eproj')
+    database = ScheduleDatabase(undo.Stack())
+    database.create_new_database(filename)
+    database.close_database()
+    assert INDEX_NAMES <= get_index_names(filename)
+
+    # Revert project to a file without composite indexes
+    connection = sqlite3.connect(filename)
+    for name in INDEX_NAMES:
+        connection.execute('DROP INDEX ' + name)
+    connection.execute('UPDATE ProjectTable SET value = ? WHERE key = "file_version"',
+                       ('GESTIMATOR_FILE_REFERENCE_VER_3',))
+    connection.commit()
+    connection.close()
+    assert not INDEX_NAMES & get_index_names(filename)
+
+    assert database.validate_database(filename) == [True]
+    assert INDEX_NAMES <= get_index_names(filename)
+    database.open_database(filename)
+    assert database.get_project_settings()['file_version'] == misc.PROJECT_FILE_VER
+    database.close_database()
+
+
+def test_bundled_library_pre_indexed():
+    assert INDEX_NAMES <= get_index_names(misc.abs_path('database', 'DSREM2022.eproj'))
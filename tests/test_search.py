@@ -0,0 +1,41 @@
+"""Tests of full text search index held outside project files"""
+
+import sqlite3
+
+from estimator import undo
+from estimator.data.schedule import ScheduleDatabase
+
+
+def get_search_objects(filename):
+    connection = sqlite3.connect(filename)
+    try:
+        return connection.execute("SELECT name FROM sqlite_master WHERE name LIKE '%search%'").fetchall()
+    finally:
+        connection.close()
+
+
+def test_search_index_not_stored_in_project(tmp_path):
+    filename = str(tmp_path / 'project.eproj')
+    database = ScheduleDatabase(undo.Stack())
+    database.create_new_database(filename)
+    table = database.ScheduleTable
+    table.insert(code='1', description='Earth work excavation', order=0, suborder=0).execute()
+    assert list(database.search_items('excavation')) == ['1']
+    database.close_database()
+    assert get_search_objects(filename) == []
+
+
+def test_search_index_follows_changes():
+    database = ScheduleDatabase(undo.Stack())
+    database.create_new_database()
+    table = database.ScheduleTable
+    assert database.search_items('excavation') == {}
+
+    table.insert(code='1', description='Earth work excavation', order=0, suborder=0).execute()
+    assert list(database.search_items('excavation')) == ['1']
+    table.update(description='Plain cement concrete').where(table.code == '1').execute()
+    assert database.search_items('excavation') == {}
+    assert list(database.search_items('cement')) == ['1']
+    table.delete().where(table.code == '1').execute()
+    assert database.search_items('cement') == {}
+    database.close_database()